@@ -0,0 +1,75 @@
+"""
+Throughput of `eden.batching.Batcher` for different batch sizes, on a synthetic block
+whose calls take a fixed overhead (i.e launching a model on the GPU) plus some time per config.
+
+Jobs are submitted from as many threads as the host would run (max_num_workers * batch_size),
+and `max_concurrent_batches` plays the part of the number of GPUs.
+
+$ python3 benchmarks/batching.py --overhead-ms 200 --per-item-ms 10
+"""
+import time
+import argparse
+import threading
+
+from eden.batching import Batcher
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num-jobs", type=int, default=64)
+parser.add_argument("--overhead-ms", type=float, default=200)
+parser.add_argument("--per-item-ms", type=float, default=10)
+parser.add_argument("--max-wait-ms", type=float, default=50)
+parser.add_argument("--num-gpus", type=int, default=1)
+parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+args = parser.parse_args()
+
+
+def synthetic_block(configs):
+    time.sleep((args.overhead_ms + args.per_item_ms * len(configs)) / 1000)
+    return [{"output": config} for config in configs]
+
+
+def measure(batch_size):
+    batcher = Batcher(
+        fn=synthetic_block,
+        batch_size=batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_concurrent_batches=args.num_gpus,
+    )
+
+    ## like celery's threads, each one runs one job at a time
+    jobs = list(range(args.num_jobs))
+    lock = threading.Lock()
+    latencies = []
+
+    def worker():
+        while True:
+            with lock:
+                if len(jobs) == 0:
+                    return
+                job = jobs.pop(0)
+            start = time.perf_counter()
+            batcher.submit(job)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker) for i in range(args.num_gpus * batch_size)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return args.num_jobs / elapsed, sum(latencies) / len(latencies) * 1000
+
+
+if __name__ == "__main__":
+    print(
+        f"{args.num_jobs} jobs, {args.overhead_ms}ms per call + {args.per_item_ms}ms per config, {args.num_gpus} GPU(s)\n"
+    )
+    print(f"{'batch size':>10} {'jobs/s':>8} {'mean latency (ms)':>18}")
+
+    for batch_size in args.batch_sizes:
+        throughput, latency = measure(batch_size)
+        print(f"{batch_size:>10} {throughput:>8.2f} {latency:>18.1f}")
@@ -0,0 +1,98 @@
+"""
+Compares the bytes moved and the CPU time spent per 4K image with json (base64 images) and msgpack (raw image bytes).
+Jpg encoding is the same for both so it's done only once, what's measured is everything that happens after it:
+
+* http: the body sent by the client, and parsed by the host
+* broker: the celery task message (kombu base64-encodes the serialized body of every message on redis)
+* redis: the config stored by `eden.result_storage.ResultStorage`
+
+Doesn't need a running host or redis:
+$ python3 benchmarks/binary_transport.py
+"""
+import json
+import time
+import base64
+import argparse
+import numpy as np
+
+from eden.datatypes import Image
+from eden.data_handlers import Decoder
+from eden.msgpack_utils import packb, unpackb
+from eden.result_storage import MSGPACK_MARKER
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--num-runs", type=int, default=20)
+args = parser.parse_args()
+
+
+def make_4k_image():
+    """
+    smooth gradients with some noise, so that the jpg is about as big as a photo's
+    """
+    x = np.linspace(0, 255, 3840, dtype=np.float32)
+    y = np.linspace(0, 255, 2160, dtype=np.float32)
+    image = np.stack(
+        [
+            np.add.outer(y, x) / 2,
+            np.add.outer(y, 255 - x) / 2,
+            np.tile(x, (2160, 1)),
+        ],
+        axis=-1,
+    )
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def json_round_trip(image):
+    config = {"prompt": "hello", "input_image": image.encode(binary=False)}
+
+    http_body = json.dumps(config).encode("utf-8")
+    config = json.loads(http_body)
+
+    broker_message = base64.b64encode(json.dumps([[], config, {}]).encode("utf-8"))
+    json.loads(base64.b64decode(broker_message))
+
+    redis_value = json.dumps(config).encode("utf-8")
+    config = json.loads(redis_value)
+
+    Decoder().decode(config)
+    return len(http_body), len(broker_message), len(redis_value)
+
+
+def msgpack_round_trip(image):
+    config = {"prompt": "hello", "input_image": image.encode(binary=True)}
+
+    http_body = packb(config)
+    config = unpackb(http_body)
+
+    broker_message = base64.b64encode(packb([[], config, {}]))
+    unpackb(base64.b64decode(broker_message))
+
+    redis_value = MSGPACK_MARKER + packb(config)
+    config = unpackb(redis_value[len(MSGPACK_MARKER) :])
+
+    Decoder().decode(config)
+    return len(http_body), len(broker_message), len(redis_value)
+
+
+def measure(fn, image, n):
+    sizes = fn(image)
+    start = time.process_time()
+    for i in range(n):
+        fn(image)
+    return sizes, (time.process_time() - start) / n * 1000
+
+
+if __name__ == "__main__":
+    image = Image(make_4k_image())
+
+    print(f"jpg: {len(image.image_bytes) / 1e6:.2f} MB\n")
+    print(
+        f"{'transport':>10} {'http (MB)':>10} {'broker (MB)':>12} {'redis (MB)':>11} {'CPU (ms)':>9}"
+    )
+
+    for name, fn in [("json", json_round_trip), ("msgpack", msgpack_round_trip)]:
+        (http, broker, redis), cpu = measure(fn, image, args.num_runs)
+        print(
+            f"{name:>10} {http / 1e6:>10.2f} {broker / 1e6:>12.2f} {redis / 1e6:>11.2f} {cpu:>9.2f}"
+        )
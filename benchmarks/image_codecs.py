@@ -0,0 +1,66 @@
+"""
+Encode time vs bytes for each image format/quality supported by `eden.datatypes.Image`,
+for square images of the sizes that are typical for generations.
+
+The test image is images/cloud.jpg resized to each size, with some noise on top of it
+so that upscaling doesn't make it unrealistically easy to compress.
+
+$ python3 benchmarks/image_codecs.py
+"""
+import time
+import argparse
+import numpy as np
+import PIL.Image
+
+from eden.image_utils import encode_to_bytes, decode
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--num-runs", type=int, default=5)
+parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+args = parser.parse_args()
+
+options = [
+    ("policy=fastest", {"policy": "fastest"}),
+    ("policy=smallest", {"policy": "smallest"}),
+    ("jpeg q=85", {"format": "jpeg", "quality": 85}),
+    ("webp q=80", {"format": "webp", "quality": 80}),
+    ("webp q=90 m=0", {"format": "webp", "quality": 90, "compress_level": 0}),
+    ("png level=1", {"format": "png", "compress_level": 1}),
+    ("png level=6", {"format": "png", "compress_level": 6}),
+]
+
+
+def make_image(size):
+    image = PIL.Image.open("images/cloud.jpg").convert("RGB")
+    image = np.array(image.resize((size, size), resample=PIL.Image.LANCZOS))
+    noise = np.random.default_rng(0).normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def time_per_call(fn, n):
+    fn()
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+
+if __name__ == "__main__":
+    print(
+        f"{'size':>6} {'options':>17} {'format':>7} {'encode (ms)':>12} {'decode (ms)':>12} {'KB':>9}"
+    )
+
+    for size in args.sizes:
+        image = make_image(size)
+
+        for name, kwargs in options:
+            image_bytes = encode_to_bytes(image, **kwargs)
+
+            encode_ms = time_per_call(
+                lambda: encode_to_bytes(image, **kwargs), args.num_runs
+            )
+            decode_ms = time_per_call(lambda: decode(image_bytes).load(), args.num_runs)
+
+            print(
+                f"{size:>6} {name:>17} {decode(image_bytes).format:>7} {encode_ms:>12.1f} {decode_ms:>12.1f} {len(image_bytes) / 1000:>9.1f}"
+            )
@@ -0,0 +1,113 @@
+"""
+Compares `eden.image_utils.encode_to_bytes` with the old numpy/cv2 round-trip, for each kind of input.
+
+For each path it prints the throughput and the peak memory allocated per call.
+Note that tracemalloc only sees allocations made through python (including numpy arrays),
+the buffers allocated inside of cv2 and PIL are not counted.
+The legacy path encoded RGBA arrays as jpg (cvtColor dropped the alpha channel), so that row compares jpg with png.
+
+$ python3 benchmarks/image_encoding.py
+"""
+import os
+import cv2
+import time
+import tempfile
+import argparse
+import tracemalloc
+import numpy as np
+import PIL.Image
+
+from eden.image_utils import encode_to_bytes
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--num-runs", type=int, default=20)
+parser.add_argument("--width", type=int, default=1920)
+parser.add_argument("--height", type=int, default=1080)
+args = parser.parse_args()
+
+
+def legacy_encode_numpy_array_image(image):
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    if image.shape[-1] == 3:
+        _, buffer = cv2.imencode(".jpg", image)
+
+    elif image.shape[-1] == 4:
+        _, buffer = cv2.imencode(".png", image)
+
+    return buffer.tobytes()
+
+
+def legacy_encode(image):
+    """
+    what encode_to_bytes used to do: everything goes through numpy and cv2
+    """
+    if type(image) == str:
+        image = PIL.Image.open(image)
+    if not isinstance(image, np.ndarray):
+        image = np.array(image)
+    return legacy_encode_numpy_array_image(image)
+
+
+def make_image(width, height, channels):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    image = np.stack(
+        [np.add.outer(y, x) / 2, np.add.outer(y, 255 - x) / 2, np.tile(x, (height, 1))]
+        + [np.full((height, width), 200, dtype=np.float32)] * (channels - 3),
+        axis=-1,
+    )
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def measure(fn, image, n):
+    fn(image)
+
+    start = time.perf_counter()
+    for i in range(n):
+        fn(image)
+    images_per_second = n / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return images_per_second, peak
+
+
+if __name__ == "__main__":
+    rgb = make_image(args.width, args.height, channels=3)
+    rgba = make_image(args.width, args.height, channels=4)
+
+    tmp_dir = tempfile.mkdtemp()
+    jpg_filename = os.path.join(tmp_dir, "image.jpg")
+    png_filename = os.path.join(tmp_dir, "image.png")
+    PIL.Image.fromarray(rgb).save(jpg_filename, quality=95)
+    PIL.Image.fromarray(rgba).save(png_filename)
+
+    inputs = [
+        ("jpg file", jpg_filename),
+        ("png file (RGBA)", png_filename),
+        ("PIL.Image (RGB)", PIL.Image.fromarray(rgb)),
+        ("np.array (RGB)", rgb),
+        ("np.array (RGBA)", rgba),
+        ("np.array (sliced)", make_image(args.width * 2, args.height, 3)[:, ::2]),
+    ]
+
+    print(f"{args.width}x{args.height}, {args.num_runs} runs per path\n")
+    print(
+        f"{'input':>18} {'legacy (img/s)':>15} {'fast (img/s)':>13} {'legacy peak (MB)':>17} {'fast peak (MB)':>15}"
+    )
+
+    for name, image in inputs:
+        legacy_speed, legacy_peak = measure(legacy_encode, image, args.num_runs)
+        fast_speed, fast_peak = measure(encode_to_bytes, image, args.num_runs)
+        print(
+            f"{name:>18} {legacy_speed:>15.1f} {fast_speed:>13.1f} {legacy_peak / 1e6:>17.2f} {fast_peak / 1e6:>15.2f}"
+        )
+
+    os.remove(jpg_filename)
+    os.remove(png_filename)
+    os.rmdir(tmp_dir)
@@ -0,0 +1,77 @@
+"""
+Wall-clock time to encode (and decode) results with many output images, serially vs on the shared thread pool
+of `eden.data_handlers`. The thread pool is disabled on machines with a single CPU, so there's nothing to compare there.
+
+$ python3 benchmarks/parallel_encoding.py --num-images 16 --size 1024
+"""
+import os
+import time
+import argparse
+import numpy as np
+
+from eden.datatypes import Image
+from eden.data_handlers import Encoder, Decoder
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--num-runs", type=int, default=3)
+parser.add_argument("--num-images", type=int, default=16)
+parser.add_argument("--size", type=int, default=1024)
+parser.add_argument("--formats", type=str, nargs="+", default=["jpeg", "png", "webp"])
+args = parser.parse_args()
+
+
+def make_outputs(images, format):
+    outputs = {f"image_{i}": Image(image, format=format) for i, image in enumerate(images)}
+    outputs["prompt"] = "let there be benchmarks"
+    return outputs
+
+
+def load_all(decoded):
+    """
+    serially decoded images are decoded by PIL only when their pixels are used, so they're used here
+    """
+    for key, value in decoded.items():
+        if key.startswith("image_"):
+            value.load()
+
+
+def time_per_call(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    images = [
+        rng.integers(0, 255, (args.size, args.size, 3), dtype=np.uint8)
+        for i in range(args.num_images)
+    ]
+
+    print(f"{os.cpu_count()} CPUs, {args.num_images} images of {args.size}x{args.size}\n")
+    print(
+        f"{'format':>7} {'encode serial (ms)':>19} {'encode parallel (ms)':>21} {'decode serial (ms)':>19} {'decode parallel (ms)':>21}"
+    )
+
+    for format in args.formats:
+        ## Images are encoded only once, so each run gets new ones
+        encode_times = {}
+        for parallel in [False, True]:
+            encoder = Encoder(binary=True, parallel=parallel)
+            encode_times[parallel] = time_per_call(
+                lambda: encoder.encode(make_outputs(images, format)), args.num_runs
+            )
+
+        encoded = Encoder(binary=True).encode(make_outputs(images, format))
+
+        decode_times = {}
+        for parallel in [False, True]:
+            decoder = Decoder(lazy=False, parallel=parallel)
+            decode_times[parallel] = time_per_call(
+                lambda: load_all(decoder.decode(dict(encoded))), args.num_runs
+            )
+
+        print(
+            f"{format:>7} {encode_times[False]:>19.1f} {encode_times[True]:>21.1f} {decode_times[False]:>19.1f} {decode_times[True]:>21.1f}"
+        )
@@ -0,0 +1,78 @@
+"""
+Measures how long `QueueData.get_status` takes for a queued job as the queue grows.
+
+Needs a running redis server:
+$ python3 benchmarks/queue_position.py --redis-host localhost --redis-port 6379
+"""
+import json
+import time
+import argparse
+
+from eden.queue import QueueData
+from eden.utils import generate_random_string
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-rh", "--redis-host", type=str, default="localhost")
+parser.add_argument("-rp", "--redis-port", type=int, default=6379)
+parser.add_argument("-n", "--num-fetches", type=int, default=200)
+args = parser.parse_args()
+
+queue_depths = [10, 100, 1000, 5000]
+queue_name = "eden_benchmark_queue"
+
+
+def fill_queue(queue_data, depth):
+    """
+    mimics what /run does: celery pushes a message into the list and eden indexes the token
+    """
+    tokens = []
+    for i in range(depth):
+        token = generate_random_string(len=10)
+        message = {"headers": {"id": token}, "body": "x" * 1024}
+        queue_data.redis.lpush(queue_name, json.dumps(message))
+        queue_data.add_to_queue_index(token=token)
+        tokens.append(token)
+    return tokens
+
+
+def time_per_call(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+
+def legacy_get_status(queue_data, token):
+    """
+    what get_status used to do: scan the whole celery list twice
+    """
+    if queue_data.check_if_token_in_queue(token=token):
+        all_tokens = queue_data.get_queue()
+        return len(all_tokens) - all_tokens.index(token)
+
+
+if __name__ == "__main__":
+    queue_data = QueueData(
+        redis_host=args.redis_host, redis_port=args.redis_port, queue_name=queue_name
+    )
+
+    print(f"{'queue depth':>12} {'indexed (ms)':>14} {'legacy scan (ms)':>18}")
+
+    for depth in queue_depths:
+        queue_data.redis.delete(
+            queue_name, queue_data.queue_index_name, queue_data.queue_counter_name
+        )
+        tokens = fill_queue(queue_data=queue_data, depth=depth)
+
+        ## the last token is the worst case for a list scan
+        token = tokens[-1]
+        indexed = time_per_call(lambda: queue_data.get_status(token=token), args.num_fetches)
+        legacy = time_per_call(
+            lambda: legacy_get_status(queue_data=queue_data, token=token),
+            max(1, args.num_fetches // 10),
+        )
+        print(f"{depth:>12} {indexed:>14.3f} {legacy:>18.3f}")
+
+    queue_data.redis.delete(
+        queue_name, queue_data.queue_index_name, queue_data.queue_counter_name
+    )
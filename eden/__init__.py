@@ -1,3 +1,3 @@
 __version__ = "0.2.0"
 
-__all__ = ["block", "client", "hosting", "image_utils"]
+__all__ = ["block", "client", "async_client", "hosting", "image_utils"]
@@ -0,0 +1,278 @@
+import json
+import httpx
+import asyncio
+
+from .client import get_fetch_interval, is_unparsed_body_error
+from .models import MAX_FETCH_MANY_TOKENS
+from .data_handlers import Encoder, Decoder, encode_bytes_as_text
+from .msgpack_utils import MSGPACK_MEDIA_TYPE, packb, unpackb
+
+
+class AsyncClient(object):
+    """
+    asyncio flavour of `eden.client.Client`, meant for submitting and waiting on lots of tasks at once.
+    All of the requests share a pool of keep-alive connections, and encoding/decoding images happens off the event loop.
+
+    Args:
+        url (str): URL which is printed on your eden block host.
+        username (str, optional): Used to identify the client, for now it's only used for debugging. Defaults to 'client'.
+        timeout (int, optional): Number of seconds to wait after sending a request before throwing a timeout error. Defaults to 100000.
+        verify_ssl (bool, optional): Verify SSL certificate of client URL. Defaults to True
+        max_connections (int, optional): Max number of connections open at once, requests beyond this wait for a free connection. Defaults to 100.
+        max_keepalive_connections (int, optional): Max number of idle connections kept alive for later requests. Defaults to 20.
+        binary (bool, optional): Same as in `eden.client.Client`. Defaults to True.
+
+    Example:
+
+    ```python
+    async with AsyncClient(url="http://127.0.0.1:5656") as c:
+        tokens = await asyncio.gather(*[c.run(config) for config in configs])
+        results = await c.await_many([t["token"] for t in tokens])
+    ```
+    """
+
+    def __init__(
+        self,
+        url,
+        username="client",
+        timeout=100000,
+        verify_ssl=True,
+        max_connections=100,
+        max_keepalive_connections=20,
+        binary=True,
+    ):
+
+        self.username = username
+        self.url = url
+        self.timeout = timeout
+        self.verify_ssl = verify_ssl
+        self.binary = binary
+        self.encoder = Encoder(binary=binary)
+        self.decoder = Decoder()
+
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            verify=verify_ssl,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes all of the pooled connections
+        """
+        await self.http.aclose()
+
+    async def run_off_event_loop(self, fn, *args):
+        """
+        encoding/decoding images is CPU heavy, so it's done on the default executor
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, fn, *args)
+
+    async def send(self, endpoint: str, data: dict, params: dict, binary: bool):
+        headers = {}
+        if self.binary == True:
+            headers["Accept"] = MSGPACK_MEDIA_TYPE
+
+        if binary == True:
+            headers["Content-Type"] = MSGPACK_MEDIA_TYPE
+            return await self.http.post(
+                self.url + endpoint, content=packb(data), params=params, headers=headers
+            )
+
+        return await self.http.post(
+            self.url + endpoint, json=data, params=params, headers=headers
+        )
+
+    async def post(self, endpoint: str, data: dict = None, params: dict = None):
+        binary = self.binary == True and data is not None
+
+        resp = await self.send(endpoint, data=data, params=params, binary=binary)
+
+        if binary == True and is_unparsed_body_error(resp):
+            ## older hosts can't parse msgpack, see `eden.client.Client.request()`
+            resp = await self.send(
+                endpoint, data=encode_bytes_as_text(data), params=params, binary=False
+            )
+
+            if not is_unparsed_body_error(resp):
+                self.binary = False
+                self.encoder.binary = False
+
+        if resp.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+            return unpackb(resp.content)
+
+        try:
+            resp = resp.json()
+        except json.decoder.JSONDecodeError:
+            raise Exception("got invalid response from host: \n", str(resp))
+
+        return resp
+
+    def decode_fetch_response(self, resp: dict):
+        """
+        Decodes the config and the output (if any) of a response from /fetch
+        """
+        resp_keys = list(resp.keys())
+
+        if "output" in resp_keys:
+            resp["output"] = self.decoder.decode(resp["output"])
+        if "config" in resp_keys:
+            resp["config"] = self.decoder.decode(resp["config"])
+
+        return resp
+
+    async def get_generator_identity(self):
+        """
+        Same as `eden.client.Client.get_generator_identity()`
+        """
+        resp = await self.post("/get_identity")
+        return self.decoder.decode(resp)
+
+    async def run(self, config, priority=None):
+        """
+        Same as `eden.client.Client.run()`
+
+        Returns:
+            dict: {'token': some_long_string}
+        """
+        config["username"] = self.username
+        config = await self.run_off_event_loop(self.encoder.encode, config)
+
+        params = {"priority": priority} if priority is not None else None
+        resp = await self.post("/run", data=config, params=params)
+        return self.decoder.decode(resp)
+
+    async def fetch(self, token, wait=0):
+        """
+        Same as `eden.client.Client.fetch()`
+        """
+        resp = await self.post("/fetch", data={"token": token}, params={"wait": wait})
+        return await self.run_off_event_loop(self.decode_fetch_response, resp)
+
+    async def fetch_many(
+        self, tokens: list, fields: list = ["status", "config", "output"]
+    ):
+        """
+        Same as `eden.client.Client.fetch_many()`
+        """
+        results = {}
+
+        for i in range(0, len(tokens), MAX_FETCH_MANY_TOKENS):
+            resp = await self.post(
+                "/fetch_many",
+                data={"tokens": tokens[i : i + MAX_FETCH_MANY_TOKENS], "fields": fields},
+            )
+            results.update(resp["results"])
+
+        for token in results.keys():
+            results[token] = await self.run_off_event_loop(
+                self.decode_fetch_response, results[token]
+            )
+
+        return results
+
+    async def update_config(self, token, config):
+        """
+        Same as `eden.client.Client.update_config()`
+        """
+        config = await self.run_off_event_loop(self.encoder.encode, config)
+
+        config = {
+            "credentials": {
+                "token": token,
+            },
+            "config": config,
+        }
+
+        resp = await self.post("/update", data=config)
+        return self.decoder.decode(resp)
+
+    async def await_results(
+        self, token, fetch_interval=1, max_fetch_interval=30, show_progress=False
+    ):
+        """
+        Same as `eden.client.Client.await_results()`, but waits without blocking the event loop.
+        """
+        results = await self.await_many(
+            tokens=[token],
+            fetch_interval=fetch_interval,
+            max_fetch_interval=max_fetch_interval,
+            show_progress=show_progress,
+        )
+        return results[token]
+
+    async def await_many(
+        self, tokens: list, fetch_interval=1, max_fetch_interval=30, show_progress=False
+    ):
+        """Waits until all of the given tasks are either complete or failed.
+
+        Only the statuses of the pending tasks are polled (all of them with a single request to /fetch_many),
+        and the full results of each task are fetched only once it's done.
+        The time between two polls adapts to all of the pending tasks together, see `eden.client.get_fetch_interval()`
+
+        Args:
+            tokens (list): tokens you received after running `some_client.run()`
+            fetch_interval (int, optional): Min amount of time in seconds to wait between two polls. Defaults to 1.
+            max_fetch_interval (int, optional): Max amount of time in seconds to wait between two polls. Defaults to 30.
+            show_progress (bool, optional): If set to True, it prints the statuses on stdout. Defaults to False.
+
+        Returns:
+            dict: {token: output/failure message of the given task}
+        """
+        pending = list(tokens)
+        results = {}
+        previous_statuses = {}
+        interval = fetch_interval
+
+        while True:
+            statuses = await self.fetch_many(tokens=pending, fields=["status"])
+
+            done = [
+                token
+                for token in pending
+                if statuses[token]["status"]["status"]
+                not in ["queued", "starting", "running"]
+            ]
+
+            if len(done) > 0:
+                results.update(await self.fetch_many(tokens=done))
+
+            pending = [token for token in pending if token not in done]
+
+            if len(pending) == 0:
+                break
+
+            if show_progress == True:
+                print(f"{len(results)}/{len(tokens)} done", end="\r")
+
+            ## progress updates don't count as changes
+            current_statuses = {
+                token: (
+                    statuses[token]["status"]["status"],
+                    statuses[token]["status"].get("queue_position"),
+                )
+                for token in pending
+            }
+
+            interval = get_fetch_interval(
+                statuses=[statuses[token]["status"] for token in pending],
+                previous_interval=interval,
+                something_changed=(len(done) > 0 or current_statuses != previous_statuses),
+                min_interval=fetch_interval,
+                max_interval=max_fetch_interval,
+            )
+            previous_statuses = current_statuses
+
+            await asyncio.sleep(interval)
+
+        return results
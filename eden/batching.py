@@ -0,0 +1,125 @@
+import time
+import threading
+
+
+class PendingItem(object):
+    """
+    Something which was submitted to a Batcher, along with its result once its batch is done
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.result = None
+        self.exception = None
+        self.done = False
+
+        ## set when the batch is done, or when this item has to lead the next batch
+        self.event = threading.Event()
+        self.is_leader = False
+
+
+class Batcher(object):
+    def __init__(
+        self, fn, batch_size: int, max_wait_ms: float = 50, max_concurrent_batches=1
+    ):
+        """Groups the values submitted by many threads into batches, so that `fn` is called once per batch.
+
+        Each batch is led by one of the threads which submitted to it: once there's a free slot (see `max_concurrent_batches`),
+        it waits for up to `max_wait_ms` for the batch to fill up, calls `fn` and hands the results back to the other threads.
+
+        Args:
+            fn (callable): takes a list of values and returns a list of results in the same order.
+                A result can be an Exception, which is raised only on the thread that submitted its value.
+            batch_size (int): max number of values in a batch
+            max_wait_ms (float, optional): max number of milliseconds to wait for a batch to fill up. Defaults to 50.
+            max_concurrent_batches (int, optional): max number of batches being run at the same time (i.e the number of GPUs). Defaults to 1.
+        """
+        self.fn = fn
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self.condition = threading.Condition()
+        self.slots = threading.Semaphore(max_concurrent_batches)
+
+        """
+        values which are not in a batch yet. Whenever there are some, the first one of them is the leader of the next batch
+        """
+        self.pending = []
+
+    def submit(self, value):
+        """Adds a value to the next batch, and blocks until its batch is done.
+
+        Args:
+            value: anything `fn` can handle
+
+        Returns:
+            the result of `fn` for this value
+        """
+        item = PendingItem(value)
+
+        with self.condition:
+            self.pending.append(item)
+            if len(self.pending) == 1:
+                item.is_leader = True
+            else:
+                ## the leader might be waiting for the batch to fill up
+                self.condition.notify_all()
+
+        while item.done == False:
+            if item.is_leader == True:
+                self.lead()
+            else:
+                item.event.wait()
+                item.event.clear()
+
+        if item.exception is not None:
+            raise item.exception
+
+        return item.result
+
+    def lead(self):
+        """
+        Runs the next batch, called by the thread whose value is the first pending one
+        """
+        with self.slots:
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+
+            with self.condition:
+                while len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(timeout=remaining)
+
+                batch = self.pending[: self.batch_size]
+                self.pending = self.pending[self.batch_size :]
+
+                ## whatever did not fit goes to the next batch, which can start filling up right away
+                if len(self.pending) > 0:
+                    self.pending[0].is_leader = True
+                    self.pending[0].event.set()
+
+            self.run_batch(batch)
+
+    def run_batch(self, batch: list):
+        try:
+            results = self.fn([item.value for item in batch])
+
+            if len(results) != len(batch):
+                raise Exception(
+                    f"expected {len(batch)} results from a batch of {len(batch)}, but got {len(results)}"
+                )
+
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    item.exception = result
+                else:
+                    item.result = result
+
+        except Exception as e:
+            for item in batch:
+                item.exception = e
+
+        for item in batch:
+            item.done = True
+            item.event.set()
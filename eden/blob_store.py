@@ -0,0 +1,167 @@
+import os
+import mmap
+import hashlib
+import tempfile
+
+"""
+Content addressed storage for large values, so that they don't have to live in redis.
+
+Each blob is keyed by the sha256 of its content, so the same bytes (i.e an input image which is echoed
+in the config of many tasks) are stored only once. eden.result_storage.ResultStorage keeps only the key in redis.
+"""
+
+
+def get_blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore(object):
+    """
+    Interface of the blob stores used by eden.result_storage.ResultStorage.
+    Subclasses (i.e an object store backend) implement `write`, `read`, `exists`, `touch`, `delete`, `get_last_modified` and `list_blobs`.
+    """
+
+    def put(self, data):
+        """Stores `data` if it's not stored yet.
+
+        Args:
+            data (bytes): content of the blob
+
+        Returns:
+            str: key of the blob (sha256 hex digest of its content)
+        """
+        key = get_blob_key(data)
+
+        ## touched so that the garbage collector does not remove it while it's being referenced again,
+        ## it's written again if it was removed in the meantime
+        if self.touch(key) == False:
+            self.write(key, data)
+
+        return key
+
+    def get(self, key):
+        """
+        Returns:
+            bytes-like: content of the blob
+        """
+        return self.read(key)
+
+    def write(self, key, data):
+        raise NotImplementedError
+
+    def read(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def touch(self, key):
+        """
+        Updates the last modified time of a blob
+
+        Returns:
+            bool: False if there's no such blob
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def get_last_modified(self, key):
+        """
+        Returns:
+            float or None: last modified unix timestamp of a blob, None if there's no such blob
+        """
+        raise NotImplementedError
+
+    def list_blobs(self):
+        """
+        Returns:
+            iterable: (key, last modified unix timestamp) for each blob
+        """
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, directory):
+        """Stores blobs as files on the local filesystem, under `directory/{key[:2]}/{key}`
+
+        Blobs are read with mmap, so serving them doesn't copy them into python first.
+
+        Args:
+            directory (str): where the blobs are stored, created if it does not exist
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def write(self, key, data):
+        filename = self.get_filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        ## written to a temporary file first so that nobody ever reads half of a blob
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def read(self, key):
+        """
+        Returns:
+            memoryview: read-only view over the memory-mapped file, which is closed once the view is no longer used
+        """
+        filename = self.get_filename(key)
+
+        if os.path.exists(filename) == False:
+            raise Exception(f"blob not found: {key}")
+
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                ## empty files can't be mapped
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def exists(self, key):
+        return os.path.exists(self.get_filename(key))
+
+    def touch(self, key):
+        try:
+            os.utime(self.get_filename(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key):
+        try:
+            os.remove(self.get_filename(key))
+        except FileNotFoundError:
+            pass
+
+    def get_last_modified(self, key):
+        try:
+            return os.path.getmtime(self.get_filename(key))
+        except FileNotFoundError:
+            return None
+
+    def list_blobs(self):
+        for subdirectory in os.listdir(self.directory):
+            path = os.path.join(self.directory, subdirectory)
+
+            if os.path.isdir(path) == False:
+                continue
+
+            for key in os.listdir(path):
+                if key.endswith(".tmp"):
+                    continue
+                try:
+                    yield key, os.path.getmtime(os.path.join(path, key))
+                except FileNotFoundError:
+                    ## deleted in the meantime
+                    continue
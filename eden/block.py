@@ -1,7 +1,11 @@
+import time
+import queue
 import uvicorn
 from fastapi import FastAPI
 from pydantic import create_model
-from .datatypes import Image
+from .datatypes import Image, Video
+from .image_utils import encode_to_bytes
+from .video_utils import FRAMES_JPEG_QUALITY
 from .progress_tracker import ProgressTracker
 
 
@@ -13,21 +17,112 @@ class Block(object):
     Args:
         progress (bool): set to True if you want to update the progress of your task with `config.progress`
         name (str): unique name to be used to identify this block. Useful if you're planning to host the queues of multiple different blocks on the same redis.
+        image_options (dict, optional): default encoding options for the output images, like {'format': 'webp', 'quality': 85} or {'policy': 'smallest'}.
+            Options set on an `eden.datatypes.Image` itself take precedence. Defaults to None.
+        version (str, optional): version of the block, results are only shared between identical configs of the same version (see `run(cache = True)`). Defaults to None.
+        lazy_inputs (bool, optional): set to True to get the input images as `eden.image_utils.LazyImage`s, which are decoded only when they're used.
+            Defaults to False (PIL images).
     """
 
-    def __init__(self, progress=True, name="eden_block"):
+    def __init__(
+        self,
+        progress=True,
+        name="eden_block",
+        image_options: dict = None,
+        version: str = None,
+        lazy_inputs: bool = False,
+    ):
 
         self.__run__ = None
         self.__setup__ = None
+        ## {gpu: queue.Queue with the states of its free slots}
+        self.states = {}
         self.default_args = None
         self.data_model = None
         self.progress = progress
         self.name = name
+        self.image_options = image_options
+        self.version = version
+        self.lazy_inputs = lazy_inputs
+        self.cache = False
+        self.cache_exclude = ["username"]
+        self.batch_size = 1
+        self.max_wait_ms = 50
+        self.gpu_memory_mb = None
+        self.gpu_fraction = None
+        self.num_gpus = 1
 
         ## extras
         self.result_storage = None
         self.data_encoder = None
 
+    def setup(self, fn):
+        """
+        Setup decorator which defines a function that runs before the host accepts any task, i.e to load a model.
+        It runs once for each worker slot of each GPU (one slot per task which fits on the GPU at the same time),
+        and gets the GPU (None if the host does not require GPUs). Whatever it returns is available as `config.state`
+        to the tasks which run on that slot, one task at a time, so tasks running side by side never share a state.
+
+        Example:
+
+        ```python
+        @eden_block.setup
+        def load_model(gpu):
+            return {'model': load_my_model().to(gpu)}
+
+        @eden_block.run(args = my_args)
+        def do_something(config):
+            model = config.state['model']
+        ```
+        """
+        self.__setup__ = fn
+        return fn
+
+    def run_setup(self, gpus: list, num_slots=1):
+        """Runs the setup function once for each slot of each GPU, one after the other.
+
+        Args:
+            gpus (list): something like ['cuda:0', 'cuda:1'], or [None] if the host does not require GPUs
+            num_slots (int or dict, optional): number of tasks which can run at the same time on each GPU, or {gpu: number of tasks}.
+                Each one of them gets its own state. Defaults to 1.
+
+        Returns:
+            dict: {gpu: number of seconds the setup of all of its slots took}, empty if there's no setup function
+        """
+        setup_times = {}
+
+        if self.__setup__ is None:
+            return setup_times
+
+        for gpu in gpus:
+            slots = num_slots[gpu] if isinstance(num_slots, dict) else num_slots
+
+            start = time.time()
+            self.states[gpu] = queue.Queue()
+            for slot in range(slots):
+                self.states[gpu].put(self.__setup__(gpu))
+            setup_times[gpu] = time.time() - start
+
+        return setup_times
+
+    def acquire_state(self, gpu: str):
+        """Takes the state of a free slot of a GPU, no other task gets it until it's given back with `release_state()`.
+        Waits for a slot to get free if they're all taken.
+
+        Returns:
+            the state returned by the setup function for a slot of `gpu`, None if there's no setup function
+        """
+        if gpu not in self.states:
+            return None
+        return self.states[gpu].get()
+
+    def release_state(self, gpu: str, state):
+        """
+        Gives back a state obtained from `acquire_state()`, for the next task which runs on `gpu`
+        """
+        if gpu in self.states:
+            self.states[gpu].put(state)
+
     def write_results(self, output: dict, token: str):
         """Encodes and saves a dictionary of outputs into the result storage
 
@@ -44,14 +139,40 @@ class Block(object):
 
         output = self.data_encoder.encode(output)
 
-        output_from_storage = self.result_storage.get(token=token)
-        output_from_storage["output"] = output
-        success = self.result_storage.add(
-            encoded_results=output_from_storage, token=token
-        )
+        ## replaces only the outputs, the config and the progress are left untouched
+        success = self.result_storage.set_output(token=token, output=output)
+        self.result_storage.publish_update(token=token, event="output")
 
         return success
 
+    def write_frame(self, token: str, name: str, frame, fps=24, quality=None):
+        """Streams a single frame of an intermediate video into the result storage.
+        Frames are appended to the ones written before under the same name, without re-encoding them,
+        and clients get them as an `eden.datatypes.Video` output until the final results are written.
+
+        Args:
+            token (str): unique token to identify the task
+            name (str): name of the output
+            frame (numpy.array or PIL.Image): RGB frame
+            fps (float, optional): frames per second of the video. Defaults to 24.
+            quality (int, optional): jpg quality (0-100) of the frame. Defaults to None.
+        """
+        assert (
+            self.result_storage != None
+        ), "block.result_storage is None, but expected an instance of eden.result_storage.ResultStorage"
+
+        frame_bytes = encode_to_bytes(
+            frame,
+            format="jpeg",
+            quality=quality if quality is not None else FRAMES_JPEG_QUALITY,
+        )
+
+        self.result_storage.append_frame(
+            token=token, name=name, frame_bytes=frame_bytes, fps=fps
+        )
+        ## lets /stream send this frame only, instead of all of the outputs
+        self.result_storage.publish_update(token=token, event="frames:" + name)
+
     def get_progress_bar(self, token: str, result_storage):
         self.progress_tracker = ProgressTracker(
             token=token, result_storage=result_storage
@@ -64,11 +185,12 @@ class Block(object):
 
         It includes:
         * eden.datatypes.Image: wraps PIL images, numpy arrays and image files (str)
+        * eden.datatypes.Video: wraps lists of frames and video files (str)
 
         """
 
         for key, value in self.default_args.items():
-            if isinstance(value, Image):
+            if isinstance(value, (Image, Video)):
                 self.default_args[key] = value.encode()
 
     def build_pydantic_model(self):
@@ -85,12 +207,34 @@ class Block(object):
         else:
             raise Exception("default_args are not defined for block.run")
 
-    def run(self, args: dict = None, progress=False):
+    def run(
+        self,
+        args: dict = None,
+        progress=False,
+        cache=False,
+        cache_exclude: list = ["username"],
+        batch_size: int = 1,
+        max_wait_ms: float = 50,
+        gpu_memory_mb: float = None,
+        gpu_fraction: float = None,
+        num_gpus: int = 1,
+    ):
         """
         Run decorator which defines the function to run on each request from a client.
 
         Args:
             args (dict): Specifies the arguments which are to be used in the decorated function. When using special dataypes like images, make sure you use eden.datatypes.Image.
+            cache (bool, optional): set to True if your function always returns the same outputs for the same config (i.e it has a seed).
+                Requests with a config identical to the one of a task that is complete (or still running) get its token instead of running again. Defaults to False.
+            cache_exclude (list, optional): keys of the config which don't change the outputs, and are ignored when comparing configs. Defaults to ['username'].
+            batch_size (int, optional): if > 1, up to `batch_size` queued tasks are run together: the decorated function gets a list of configs
+                and should return a list with the outputs of each of them, in the same order. An Exception in that list fails only its own task. Defaults to 1.
+            max_wait_ms (float, optional): max number of milliseconds to wait for a batch to fill up once a GPU is free. Defaults to 50.
+            gpu_memory_mb (float, optional): GPU memory in MB that each task (or batch) needs, several of them can share a GPU if it has enough memory. Defaults to None.
+            gpu_fraction (float, optional): same as gpu_memory_mb, but as a fraction of the memory of the GPU (i.e 0.25). Defaults to None.
+                If neither gpu_memory_mb nor gpu_fraction are set, each task gets a whole GPU.
+            num_gpus (int, optional): number of GPUs each task (or batch) needs, they're all in `config.gpus` and are picked so that their links are as fast as possible (i.e NVLink).
+                gpu_memory_mb and gpu_fraction apply to each of them. Defaults to 1.
 
         Example:
 
@@ -112,11 +256,39 @@ class Block(object):
                 'image': Image(pil_image)   ## Image() works on PIL.Image, numpy.array and on jpg an png files
             }
         ```
+
+        With batching, each config has its own token and progress:
+
+        ```python
+        @eden_block.run(args = my_args, batch_size = 8, max_wait_ms = 100)
+        def do_something(configs):
+
+            images = model([config['prompt'] for config in configs], device = configs[0].gpu)
+
+            return [{'image': Image(image)} for image in images]
+        ```
+
+        Models which don't fit on a single GPU can get several of them:
+
+        ```python
+        @eden_block.run(args = my_args, num_gpus = 4)
+        def do_something(config):
+
+            model = load_sharded_model(devices = config.gpus)  ## like ['cuda:0', 'cuda:1', 'cuda:2', 'cuda:3']
+            ...
+        ```
         """
 
         self.default_args = args
         if progress == True:
             self.progress = True
+        self.cache = cache
+        self.cache_exclude = cache_exclude
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.gpu_memory_mb = gpu_memory_mb
+        self.gpu_fraction = gpu_fraction
+        self.num_gpus = num_gpus
         self.build_pydantic_model()
 
         def decorator(fn):
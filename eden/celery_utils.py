@@ -1,6 +1,65 @@
+import threading
+
+from celery.signals import worker_ready
+
 from .log_utils import PREFIX
 
 
+class ConsumerGate(object):
+    def __init__(self, queue_name: str):
+        """Stops and restarts the consumption of a queue by the worker of this process,
+        i.e while it has no room for the tasks it would take off the queue.
+
+        The worker's consumer is only known once it's ready, pausing before that does nothing.
+        Both are done through consumer.call_soon(), on the consumer's own thread like celery's remote control commands.
+
+        Args:
+            queue_name (str): name of the queue the worker consumes
+        """
+        self.queue_name = queue_name
+        self.consumer = None
+        self.paused = False
+        self.lock = threading.Lock()
+
+        worker_ready.connect(self.on_worker_ready, weak=False)
+
+    def on_worker_ready(self, sender, **kwargs):
+        self.consumer = sender
+
+    def pause(self):
+        """
+        Returns:
+            bool: True if this call paused the consumer, False if it was paused already (or is not ready yet)
+        """
+        with self.lock:
+            if self.paused == True or self.consumer is None:
+                return False
+            self.paused = True
+
+        self.consumer.call_soon(self.consumer.cancel_task_queue, self.queue_name)
+        return True
+
+    def resume(self):
+        with self.lock:
+            if self.paused == False:
+                return
+            self.paused = False
+
+        self.consumer.call_soon(self.consumer.add_task_queue, self.queue_name)
+
+    def pause_until(self, fn):
+        """Pauses the consumer, and resumes it on a daemon thread as soon as fn() returns True.
+        fn is called over and over, so it should wait for a while before it returns False.
+        """
+        if self.pause() == True:
+            threading.Thread(target=self.resume_after, args=(fn,), daemon=True).start()
+
+    def resume_after(self, fn):
+        while fn() == False:
+            pass
+        self.resume()
+
+
 def run_celery_app(
     app,
     loglevel="ERROR",
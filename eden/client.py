@@ -1,63 +1,317 @@
 import requests
 import json
 import time
-from .data_handlers import Encoder, Decoder
+from typing import Callable
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from .data_handlers import Encoder, Decoder, encode_bytes_as_text
+from .msgpack_utils import MSGPACK_MEDIA_TYPE, packb, unpackb
+from .models import MAX_FETCH_MANY_TOKENS
+from .image_utils import text_to_bytes
+from .video_utils import FRAMES_MAGIC, get_video_format
+
+
+def merge_streamed_frames(output: dict, streams: dict):
+    """
+    Puts the new frames sent by /stream (outputs with a 'first_frame') after the ones received before,
+    so that each output has all of the frames streamed so far.
+
+    Args:
+        output (dict): encoded outputs of a response from /stream, updated in place
+        streams (dict): {name: packed frames received so far}, updated in place
+    """
+    header_length = len(FRAMES_MAGIC) + 4
+
+    for name, value in output.items():
+        if not isinstance(value, dict) or value.get("type") != "eden.datatypes.Video":
+            continue
+
+        data = value["data"]
+        if isinstance(data, str):
+            data = text_to_bytes(data)
+
+        if "first_frame" in value:
+            data = streams.get(name, data[:header_length]) + data[header_length:]
+            output[name] = {"data": data, "type": value["type"]}
+
+        if get_video_format(data) == "frames":
+            streams[name] = data
+
+
+def is_connect_error(error: requests.exceptions.ConnectionError):
+    """
+    True if the connection to the host could not be made at all, so the request never reached it
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if len(error.args) > 0 else None
+    return isinstance(reason, NewConnectionError)
+
+
+def is_unparsed_body_error(resp):
+    """
+    True if the host rejected a request because it could not parse its body at all, i.e an older host which only reads json.
+    Any other 422 (an invalid config, or one raised by the block itself) might come from a request which already did something.
+    """
+    if resp.status_code == 415:
+        return True
+    if resp.status_code != 422:
+        return False
+
+    try:
+        detail = resp.json()["detail"]
+    except (ValueError, KeyError, TypeError):
+        return False
+
+    if not isinstance(detail, list) or len(detail) == 0:
+        return False
+
+    ## the whole body failed, not one of its fields
+    return all(
+        isinstance(error, dict)
+        and (
+            list(error.get("loc", [])) == ["body"]
+            or error.get("type") in ["value_error.jsondecode", "json_invalid"]
+        )
+        for error in detail
+    )
+
+
+def get_fetch_interval(
+    statuses: list,
+    previous_interval: float,
+    something_changed: bool,
+    min_interval: float = 1,
+    max_interval: float = 30,
+    backoff_factor: float = 1.5,
+):
+    """
+    Decides how long to wait before fetching the status of some pending tasks again.
+
+    * If something changed since the last fetch, it goes back to `min_interval`.
+    * Else it backs off exponentially by `backoff_factor` upto `max_interval`.
+    * If all of the tasks are queued, then none of them would start before
+      the one closest to the front of the queue, so it waits for at least `min_interval * queue_position`.
+
+    Args:
+        statuses (list): latest statuses of the pending tasks, like [{'status': 'queued', 'queue_position': 3}]
+        previous_interval (float): seconds waited before the last fetch
+        something_changed (bool): True if any of the statuses changed since the last fetch
+
+    Returns:
+        float: seconds to wait before the next fetch
+    """
+    if something_changed == True:
+        interval = min_interval
+    else:
+        interval = min(previous_interval * backoff_factor, max_interval)
+
+    queue_positions = [
+        status["queue_position"] for status in statuses if "queue_position" in status
+    ]
+
+    if len(queue_positions) > 0 and len(queue_positions) == len(statuses):
+        interval = max(interval, min(min_interval * min(queue_positions), max_interval))
+
+    return interval
 
 
 class Client(object):
     """
     Can be used to send requests to a hosted eden block on some remote (or local) server.
+    All of the requests go through a pooled `requests.Session`, so connections are kept alive and re-used.
 
     Args:
         url (str): URL which is printed on your eden block host.
         username (str, optional): Used to identify the client, for now it's only used for debugging. Defaults to 'client'.
         timeout (int, optional): Number of seconds to wait after sending a request before throwing a timeout error. Defaults to 100000.
         verify_ssl (bool, optional): Verify SSL certificate of client URL. Defaults to True
+        pool_size (int, optional): Max number of keep-alive connections to the host. Defaults to 10.
+        max_retries (int, optional): Number of times a request is retried when the connection fails.
+            Only requests which are safe to repeat are retried once they're sent, /run is only retried if it could not connect at all. Defaults to 3.
+        on_request (Callable, optional): Called after every request as `on_request(endpoint, seconds)`, useful for keeping track of latencies. Defaults to None.
+        binary (bool, optional): Send and receive msgpack with raw image bytes instead of json with base64 images.
+            Falls back to json on its own if the host does not support msgpack. Defaults to True.
     """
 
-    def __init__(self, url, username="client", timeout=100000, verify_ssl=True):
+    def __init__(
+        self,
+        url,
+        username="client",
+        timeout=100000,
+        verify_ssl=True,
+        pool_size=10,
+        max_retries=3,
+        on_request: Callable = None,
+        binary=True,
+    ):
 
         self.username = username
         self.url = url
         self.timeout = timeout
         self.verify_ssl = verify_ssl
-        self.encoder = Encoder()
+        self.max_retries = max_retries
+        self.on_request = on_request
+        self.binary = binary
+        self.encoder = Encoder(binary=binary)
         self.decoder = Decoder()
 
-    def get_generator_identity(self):
         """
-        Sends a request to the host to get the name and current commit hash of the generator.
+        the adapter itself never retries, self.send() is the only place where requests are retried
+        """
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(
+        self,
+        endpoint: str,
+        method="post",
+        data: dict = None,
+        params: dict = None,
+        idempotent=False,
+        **kwargs,
+    ):
+        """
+        Sends a request to the host through the pooled session.
 
-        Raises:
-            json.decoder.JSONDecodeError: If an invalid json is returned which cannot be decoded.
+        Args:
+            endpoint (str): something like '/fetch'
+            method (str, optional): 'post' or 'get'. Defaults to 'post'.
+            data (dict, optional): json to send. Defaults to None.
+            params (dict, optional): query params. Defaults to None.
+            idempotent (bool, optional): If set to True, the request is retried when the connection breaks midway. Defaults to False.
 
         Returns:
-            dict: {'name': 'name', 'commit': commit_hash}
+            requests.Response: response from the host
+        """
+        binary = self.binary == True and data is not None
+
+        resp = self.send(
+            endpoint, method, data, params, idempotent, binary=binary, **kwargs
+        )
+
+        if binary == True and is_unparsed_body_error(resp):
+            """
+            older hosts can't parse msgpack. the request was rejected before anything ran,
+            so it's safe to send it again as json
+            """
+            resp = self.send(
+                endpoint,
+                method,
+                encode_bytes_as_text(data),
+                params,
+                idempotent,
+                binary=False,
+                **kwargs,
+            )
+
+            if not is_unparsed_body_error(resp):
+                self.binary = False
+                self.encoder.binary = False
+
+        return resp
+
+    def send(
+        self,
+        endpoint: str,
+        method="post",
+        data: dict = None,
+        params: dict = None,
+        idempotent=False,
+        binary=False,
+        **kwargs,
+    ):
+        """
+        Sends a single request as either msgpack or json, up to max_retries + 1 times.
+        Failing to connect is always safe to retry since nothing reached the host,
+        connections which break after the request was sent are retried only for idempotent endpoints.
         """
+        num_attempts = self.max_retries + 1
+
+        headers = {}
+        if self.binary == True:
+            headers["Accept"] = MSGPACK_MEDIA_TYPE
+
+        if binary == True:
+            headers["Content-Type"] = MSGPACK_MEDIA_TYPE
+            body = {"data": packb(data)}
+        else:
+            body = {"json": data}
+
+        for attempt in range(num_attempts):
+            start = time.time()
+            try:
+                return self.session.request(
+                    method,
+                    self.url + endpoint,
+                    params=params,
+                    headers=headers,
+                    timeout=self.timeout,
+                    verify=self.verify_ssl,
+                    **body,
+                    **kwargs,
+                )
+            except requests.exceptions.ConnectionError as e:
+                if attempt == num_attempts - 1 or (
+                    idempotent == False and is_connect_error(e) == False
+                ):
+                    raise
+                time.sleep(0.1 * 2**attempt)
+            finally:
+                if self.on_request is not None:
+                    self.on_request(endpoint, time.time() - start)
+
+    def post(self, endpoint: str, data: dict = None, params: dict = None, idempotent=False):
+        """
+        Sends a POST request to the host and returns the json (or msgpack) it responded with.
 
-        resp = requests.post(
-            self.url + "/get_identity", timeout=self.timeout, verify=self.verify_ssl
+        Raises:
+            json.decoder.JSONDecodeError: If an invalid json is returned which cannot be decoded.
+        """
+        resp = self.request(
+            endpoint, data=data, params=params, idempotent=idempotent
         )
 
+        if resp.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+            return unpackb(resp.content)
+
         try:
             resp = resp.json()
         except json.decoder.JSONDecodeError:
             raise Exception("got invalid response from host: \n", str(resp))
 
+        return resp
+
+    def get_generator_identity(self):
+        """
+        Sends a request to the host to get the name and current commit hash of the generator.
+
+        Raises:
+            json.decoder.JSONDecodeError: If an invalid json is returned which cannot be decoded.
+
+        Returns:
+            dict: {'name': 'name', 'commit': commit_hash}
+        """
+
+        resp = self.post("/get_identity", idempotent=True)
+
         resp = self.decoder.decode(resp)
         return resp
 
-    def run(self, config):
+    def run(self, config, priority=None):
         """
         Sends a request to the host to run a job with the configuration mentioned in config.
         The user might get queued depending on the the number of pending jobs on the host.
 
         Args:
             config (dict): Dictionary that contains all of the necessary arguments needed to run your task. The keys should be the same as the ones found on `args` in the `@eden.Block.run()` decorator.
+            priority (str, optional): one of the host's priority lanes (i.e 'high', 'normal' or 'low'). Defaults to None (the host's default priority).
 
         There are 3 main internal steps in this function:
         * `self.encoder.encode()`: Converts `config` to json, ready to be sent to the eden host. Special wrappers found in eden.datatypes help encode special datatypes like images.
-        * `requests.post`: sends a request to the hosted block with the json containing your inputs
+        * `self.post()`: sends a request to the hosted block with the json containing your inputs
         * `seld.decoder.decode()`: converts the json received from the request back into a dictionary. If there are any special datatypes like eden.datatypes.Image, they're converted back to more "human" formats like PIL images.
 
         Raises:
@@ -69,36 +323,17 @@ class Client(object):
         config["username"] = self.username
         config = self.encoder.encode(data=config)
 
-        resp = requests.post(
-            self.url + "/run", json=config, timeout=self.timeout, verify=self.verify_ssl
-        )
-
-        try:
-            resp = resp.json()
-        except json.decoder.JSONDecodeError:
-            raise Exception("got invalid response from host: \n", str(resp))
+        ## not idempotent, retrying after the request was sent might start the same job twice
+        params = {"priority": priority} if priority is not None else None
+        resp = self.post("/run", data=config, params=params)
 
         resp = self.decoder.decode(resp)
         return resp
 
-    def fetch(self, token):
+    def decode_fetch_response(self, resp: dict):
         """
-        Tries to fetch results from the host.
-        Returns the output if the task is complete,
-        else returns the queue status.
+        Decodes the config and the output (if any) of a response from /fetch
         """
-        config = {"token": token}
-        resp = requests.post(
-            self.url + "/fetch",
-            timeout=self.timeout,
-            json=config,
-            verify=self.verify_ssl,
-        )
-        try:
-            resp = resp.json()
-        except json.decoder.JSONDecodeError:
-            raise Exception("got invalid response from host: \n", str(resp))
-
         resp_keys = list(resp.keys())
 
         if "output" in resp_keys:
@@ -108,6 +343,83 @@ class Client(object):
 
         return resp
 
+    def fetch(self, token, wait=0):
+        """
+        Tries to fetch results from the host.
+        Returns the output if the task is complete,
+        else returns the queue status.
+
+        Args:
+            token (str): token you received after running `some_client.run()`
+            wait (float, optional): if the task is not done yet, the host waits for upto `wait` seconds for something to change before responding. Defaults to 0.
+        """
+        config = {"token": token}
+        resp = self.post("/fetch", data=config, params={"wait": wait}, idempotent=True)
+
+        return self.decode_fetch_response(resp)
+
+    def stream(self, token):
+        """
+        Listens to the updates of a task as they're pushed by the host, until the task is done.
+        Progress updates only contain the status, every other update has the same schema as `fetch()`.
+        The host sends only the new frames of the videos streamed with `block.write_frame()`,
+        the outputs yielded here still have all of the frames streamed so far.
+
+        Args:
+            token (str): token you received after running `some_client.run()`
+
+        Raises:
+            NotImplementedError: If the host does not support streaming.
+
+        Yields:
+            dict: the latest status/results of the task
+        """
+        resp = self.request(
+            "/stream/" + token, method="get", idempotent=True, stream=True
+        )
+
+        if resp.status_code == 404:
+            raise NotImplementedError("the host does not support /stream")
+
+        streams = {}
+
+        with resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    resp_data = json.loads(line[len("data: ") :])
+                    merge_streamed_frames(resp_data.get("output", {}), streams)
+                    yield self.decode_fetch_response(resp_data)
+
+    def fetch_many(self, tokens: list, fields: list = ["status", "config", "output"]):
+        """
+        Same as `fetch()`, but for many tokens with a single request to the host
+        (or one per `eden.models.MAX_FETCH_MANY_TOKENS` tokens).
+
+        Args:
+            tokens (list): tokens you received after running `some_client.run()`
+            fields (list, optional): keys to include for each token, the status is always included.
+                Use ['status'] if you only want to check the status of your tasks. Defaults to ['status', 'config', 'output'].
+
+        Returns:
+            dict: {token: response} where each response has the same schema as the one from `fetch()`
+        """
+        results = {}
+
+        for i in range(0, len(tokens), MAX_FETCH_MANY_TOKENS):
+            config = {"tokens": tokens[i : i + MAX_FETCH_MANY_TOKENS], "fields": fields}
+            resp = self.post("/fetch_many", data=config, idempotent=True)
+            results.update(resp["results"])
+
+        for token in results.keys():
+            resp_keys = list(results[token].keys())
+
+            if "output" in resp_keys:
+                results[token]["output"] = self.decoder.decode(results[token]["output"])
+            if "config" in resp_keys:
+                results[token]["config"] = self.decoder.decode(results[token]["config"])
+
+        return results
+
     # still needs to be implemented
     def update_config(self, token, config):
         """
@@ -135,46 +447,87 @@ class Client(object):
             "config": config,
         }
 
-        resp = requests.post(
-            self.url + "/update",
-            timeout=self.timeout,
-            json=config,
-            verify=self.verify_ssl,
-        )
-
-        try:
-            resp = resp.json()
-        except json.decoder.JSONDecodeError:
-            raise Exception("got invalid response from host: \n", str(resp))
+        ## setting the same config twice is harmless
+        resp = self.post("/update", data=config, idempotent=True)
 
         resp = self.decoder.decode(resp)
         return resp
 
-    def await_results(self, token, fetch_interval=1, show_progress=True):
-        """Keeps pinging the server and waits until it has obtained the output/failed the job.
+    def await_results(
+        self,
+        token,
+        fetch_interval=1,
+        show_progress=True,
+        use_stream=True,
+        max_fetch_interval=30,
+    ):
+        """Waits until the host has obtained the output/failed the job.
+        Listens to the updates pushed by the host when possible, else long-polls /fetch until the task is done.
 
         Args:
             token (str): unique token used to identify the task
-            fetch_interval (int, optional): Amount of time in seconds to wait after each /fetch. Defaults to 1.
+            fetch_interval (int, optional): Min amount of time in seconds to wait for a change on each /fetch. Defaults to 1.
             show_progress (bool, optional): If set to True, it prints the status and the progress on stdout. Defaults to True.
+            use_stream (bool, optional): If set to True, listens to /stream/{token} when the host supports it. Defaults to True.
+            max_fetch_interval (int, optional): Max amount of time in seconds to wait for a change on each /fetch, see `eden.client.get_fetch_interval()`. Defaults to 30.
 
         Returns:
             dict : output/failure message of the given task
         """
 
+        if use_stream == True:
+            try:
+                resp = None
+                for resp in self.stream(token=token):
+                    if show_progress == True:
+                        print(str(resp), end="\r")
+
+                ## the host closes the stream once the task is done
+                if resp is not None and resp["status"]["status"] not in [
+                    "queued",
+                    "starting",
+                    "running",
+                ]:
+                    return resp
+
+            except (NotImplementedError, requests.exceptions.RequestException):
+                """
+                older hosts don't have /stream, and the connection might drop midway.
+                either way we can still fall back to polling
+                """
+                pass
+
+        interval = fetch_interval
+        previous_status = None
+
         while True:
-            resp = self.fetch(token=token)
+            started_at = time.time()
+            ## the host answers as soon as something changes, or after waiting for the whole interval
+            resp = self.fetch(token=token, wait=interval)
 
-            if (
-                resp["status"]["status"] == "complete"
-                or resp["status"]["status"] == "failed"
-            ):
+            ## anything else (complete, failed, expired, revoked, invalid token, removed...) won't change anymore
+            if resp["status"]["status"] not in ["queued", "starting", "running"]:
                 break
             else:
                 if show_progress == True:
                     print(str(resp), end="\r")
 
-            time.sleep(fetch_interval)
+            ## progress updates don't count as changes
+            status = (resp["status"]["status"], resp["status"].get("queue_position"))
+            something_changed = status != previous_status
+
+            if something_changed == False:
+                ## older hosts don't wait on /fetch, they answer right away
+                time.sleep(max(interval - (time.time() - started_at), 0))
+
+            interval = get_fetch_interval(
+                statuses=[resp["status"]],
+                previous_interval=interval,
+                something_changed=something_changed,
+                min_interval=fetch_interval,
+                max_interval=max_fetch_interval,
+            )
+            previous_status = status
 
         return resp
 
@@ -185,12 +538,7 @@ class Client(object):
 
         config = {"time_to_wait": time}
         try:
-            resp = requests.post(
-                self.url + "/stop",
-                timeout=self.timeout,
-                json=config,
-                verify=self.verify_ssl,
-            )
+            resp = self.request("/stop", data=config)
         except requests.exceptions.ConnectionError:
             """
             This exception is very much expected here since the host would be stopping itself.
@@ -14,8 +14,11 @@ class ConfigWrapper(object):
         data (dict): input dictionary to be fed into the `eden.block.Block.__run__()` function
         filename (str): filename of the output json file for the current run. Defined as '{results_dir}/{token}.json'
         gpu (str): 'cuda:{x}' where x is the GPU ID provided by `eden.gpu_allocator.GPUAllocator`
+        gpus (list, optional): all the GPUs of the task, like ['cuda:0', 'cuda:1'] with @block.run(num_gpus = 2). Defaults to [gpu] (or [] without a GPU).
         progress (ProgressTracker, optional): If provided, can be used to update the progress of the job. Defaults to None.
         token (str, optional): Unique identifier behind each task run. Defaults to None.
+        state (optional): whatever the function decorated with `eden.block.Block.setup` returned for this GPU. Defaults to None.
+        lazy (bool, optional): set to True to decode the images of the config as `eden.image_utils.LazyImage`s. Defaults to False.
     """
 
     def __init__(
@@ -25,16 +28,26 @@ class ConfigWrapper(object):
         progress: ProgressTracker = None,
         token: str = None,
         result_storage=None,
+        state=None,
+        gpus: list = None,
+        lazy: bool = False,
     ):
 
         self.data = data
         self.gpu = gpu
+        if gpus is None:
+            gpus = [gpu] if gpu is not None else []
+        self.gpus = gpus
         self.progress = progress
         self.token = token
+        self.state = state
 
-        self.decoder = Decoder()
+        self.decoder = Decoder(lazy=lazy)
         self.result_storage = result_storage
 
+        ## config as it was last read from the result storage, before decoding it
+        self.raw_data = None
+
         self.__key_to_look_for_in_json_file__ = "config"
 
     def __getitem__(self, idx):
@@ -47,16 +60,27 @@ class ConfigWrapper(object):
 
     def refresh(self):
         """
-        Used to refresh the input args of the function from self.filename.
+        Used to refresh the input args of the function from the result storage.
+        The config is decoded only if it changed since the last refresh.
 
         Returns:
             bool: True if something changed in the config, else False
         """
         something_changed = False
 
-        d = self.decoder.decode(self.result_storage.get(self.token))
+        d = self.result_storage.get_fields(
+            token=self.token, fields=[self.__key_to_look_for_in_json_file__]
+        )
+
+        raw_data = d[self.__key_to_look_for_in_json_file__]
+
+        if raw_data == self.raw_data:
+            return something_changed
+
+        self.raw_data = raw_data
 
-        data = d[self.__key_to_look_for_in_json_file__]
+        ## decode() replaces the images in place, so it gets a copy
+        data = self.decoder.decode(dict(raw_data))
 
         if data != self.data:
             something_changed = True
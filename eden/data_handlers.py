@@ -1,23 +1,107 @@
-from eden.image_utils import decode
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from eden.datatypes import Image
+from eden.image_utils import decode, bytes_to_text, LazyImage
+
+from eden.datatypes import Image, Video
+from eden.video_utils import LazyVideo
+
+"""
+cv2 and PIL release the GIL while encoding/decoding images,
+so a single pool of threads is shared by every Encoder and Decoder which runs in parallel
+"""
+_shared_thread_pool = None
+_shared_thread_pool_lock = threading.Lock()
+
+
+def get_shared_thread_pool():
+    """
+    Returns the thread pool shared by all of the encoders and decoders, it's created on the first call.
+    It has as many threads as there are CPUs, or None if there's a single CPU since there'd be nothing to gain.
+    """
+    global _shared_thread_pool
+
+    num_cpus = os.cpu_count() or 1
+    if num_cpus < 2:
+        return None
+
+    with _shared_thread_pool_lock:
+        if _shared_thread_pool is None:
+            _shared_thread_pool = ThreadPoolExecutor(
+                max_workers=num_cpus, thread_name_prefix="eden-codec"
+            )
+
+    return _shared_thread_pool
+
+
+def run_in_parallel(fn, items: dict):
+    """
+    Runs fn(value) for each item on the shared thread pool, or one after the other if there's no pool
+
+    Returns:
+        dict: {key: fn(value)}, in the same order as items
+    """
+    thread_pool = get_shared_thread_pool()
+    if thread_pool is None:
+        return {key: fn(value) for key, value in items.items()}
+
+    futures = {key: thread_pool.submit(fn, value) for key, value in items.items()}
+    return {key: future.result() for key, future in futures.items()}
 
 
 class Decoder(object):
-    def __init__(self):
+    def __init__(self, lazy=False, parallel=False, parallel_min_bytes=256 * 1024):
+        """
+        Args:
+            lazy (bool, optional): If set to True, images are decoded into `eden.image_utils.LazyImage`s,
+                which are decoded only when they're used. Else they're decoded into PIL images right away. Defaults to False.
+            parallel (bool, optional): If set to True (and lazy = False), images are fully decoded on the shared thread pool. Defaults to False.
+            parallel_min_bytes (int, optional): Images are decoded serially if there are fewer than 2 of them
+                or if they add up to fewer bytes than this. Defaults to 256 KB.
+        """
+        self.lazy = lazy
+        self.parallel = parallel
+        self.parallel_min_bytes = parallel_min_bytes
 
         ## when you add more datatypes,
         ## update this map and add the new method below
         self.type_name_to_method_mapping = {
-            "eden.datatypes.Image": self.decode_image_data
+            "eden.datatypes.Image": self.decode_image_data,
+            "eden.datatypes.Video": self.decode_video_data,
         }
 
     def decode_image_data(self, data: str):
         """
-        converts str to pil image
+        converts base64 str or raw bytes to a LazyImage (or a pil image if lazy = False)
         """
+        if data is None:
+            return None
+        if self.lazy == True:
+            return LazyImage(data)
         return decode(data)
 
+    def decode_video_data(self, data):
+        """
+        converts base64 str or raw bytes to a LazyVideo, its frames are decoded right away if lazy = False
+        """
+        if data is None:
+            return None
+
+        video = LazyVideo(data)
+        if self.lazy == False:
+            video.as_frames()
+        return video
+
+    def load_image_data(self, data):
+        """
+        decodes the pixels too, PIL would otherwise do it only when they're first used
+        """
+        image = decode(data)
+        if image is not None:
+            image.load()
+        return image
+
     def decode(self, data):
         """
         Looks for dicts which have a 'type' key and decodes them
@@ -29,6 +113,17 @@ class Decoder(object):
         if not isinstance(data, dict):
             data = dict(data)
 
+        images = {
+            key: value["data"]
+            for key, value in data.items()
+            if isinstance(value, dict)
+            and value.get("type") == "eden.datatypes.Image"
+            and value["data"] is not None
+        }
+
+        if self.should_run_in_parallel(images):
+            data.update(run_in_parallel(self.load_image_data, images))
+
         for key, value in data.items():
 
             if isinstance(value, dict):
@@ -39,15 +134,61 @@ class Decoder(object):
 
         return data
 
+    def should_run_in_parallel(self, images: dict):
+        return (
+            self.parallel == True
+            and self.lazy == False
+            and len(images) >= 2
+            and sum(len(image) for image in images.values()) >= self.parallel_min_bytes
+            and get_shared_thread_pool() is not None
+        )
+
+
+def encode_bytes_as_text(data):
+    """
+    Converts the raw bytes in (possibly nested) dicts and lists into base64 text so that they can be sent as json.
+    Used to send things that were stored by binary clients to json clients.
+    """
+    if isinstance(data, (bytes, memoryview)):
+        return bytes_to_text(data)
+
+    elif isinstance(data, dict):
+        return {key: encode_bytes_as_text(value) for key, value in data.items()}
+
+    elif isinstance(data, (list, tuple)):
+        return [encode_bytes_as_text(value) for value in data]
+
+    return data
+
 
 class Encoder(object):
-    def __init__(self):
+    def __init__(
+        self,
+        binary=False,
+        image_options: dict = None,
+        parallel=False,
+        parallel_min_pixels=512 * 512,
+    ):
+        """
+        Args:
+            binary (bool, optional): If set to True, datatypes are encoded into raw bytes (for msgpack) instead of base64 text (for json). Defaults to False.
+            image_options (dict, optional): default format/quality/compress_level/policy for the images which don't set their own,
+                see `eden.datatypes.Image`. Defaults to None.
+            parallel (bool, optional): If set to True, images are encoded concurrently on the shared thread pool. Defaults to False.
+            parallel_min_pixels (int, optional): Images are encoded serially if there are fewer than 2 of them
+                or if they add up to fewer pixels than this. Defaults to 512 * 512.
+        """
 
         ## when you add more datatypes,
         ## update this list
         self.datatypes_to_encode = [
             Image,
+            Video,
         ]
+        self.binary = binary
+        self.image_options = image_options
+        self.parallel = parallel
+        self.parallel_min_pixels = parallel_min_pixels
 
     def encode(self, data: dict):
         """
@@ -60,8 +201,28 @@ class Encoder(object):
         Returns:
             dict: encoded data ready to be converted into a json
         """
-        for key, value in data.items():
-            if type(value) in self.datatypes_to_encode:
-                data[key] = value.encode()
+        to_encode = {
+            key: value
+            for key, value in data.items()
+            if type(value) in self.datatypes_to_encode
+        }
+
+        if self.should_run_in_parallel(to_encode):
+            data.update(run_in_parallel(self.encode_value, to_encode))
+        else:
+            for key, value in to_encode.items():
+                data[key] = self.encode_value(value)
 
         return data
+
+    def encode_value(self, value):
+        return value.encode(binary=self.binary, defaults=self.image_options)
+
+    def should_run_in_parallel(self, to_encode: dict):
+        return (
+            self.parallel == True
+            and len(to_encode) >= 2
+            and sum(value.get_num_pixels() for value in to_encode.values())
+            >= self.parallel_min_pixels
+            and get_shared_thread_pool() is not None
+        )
@@ -1,4 +1,10 @@
-from .image_utils import encode
+from .image_utils import (
+    encode_to_bytes,
+    bytes_to_text,
+    text_to_bytes,
+    get_num_pixels,
+)
+from .video_utils import encode_video_to_bytes, LazyVideo
 
 
 class BaseDataType(object):
@@ -13,23 +19,176 @@ class BaseDataType(object):
         self.type = "eden.datatypes.BaseDataType"
         self.data = data
 
-    def encode(self):
+    def encode(self, binary=False, defaults: dict = None):
+        """
+        Args:
+            binary (bool, optional): If set to True, the data is kept as raw bytes for binary transports like msgpack. Defaults to False.
+            defaults (dict, optional): default encoding options of the encoder, if the datatype has any. Defaults to None.
+        """
         return {"data": self.data, "type": self.type}
 
+    def get_num_pixels(self):
+        return 0
+
 
 class Image(BaseDataType):
-    def __init__(self, image=None):
+    def __init__(
+        self, image=None, format=None, quality=None, compress_level=None, policy=None
+    ):
         """
         Wrapper to store/send images to and fro from an eden server.
 
+        The image is encoded only when it's sent, so the options which are not set here
+        can be filled in by the defaults of the encoder (see `eden.block.Block`'s `image_options`).
+
         Args:
-            image (numpy.array or PIL.Image or str, optional): Image to be stored. Defaults to None.
+            image (numpy.array or PIL.Image or LazyImage or str, optional): Image to be stored. Defaults to None.
+            format (str, optional): 'jpeg', 'png' or 'webp'. Defaults to None, which lets the policy decide.
+            quality (int, optional): 0-100, for jpeg and webp. Defaults to None.
+            compress_level (int, optional): 0-9 for png, the method (0-6) for webp. Higher is smaller but slower. Defaults to None.
+            policy (str, optional): 'fastest' (jpeg, or png with alpha) or 'smallest' (webp), used only if format is None. Defaults to None.
         """
         super().__init__()
 
         self.type = "eden.datatypes.Image"
+        self.image = image
+        self.options = {
+            "format": format,
+            "quality": quality,
+            "compress_level": compress_level,
+            "policy": policy,
+        }
+
+        ## raw image bytes, converted to base64 text only when it's sent as json
+        self._image_bytes = None
+
+    def encode_image(self, defaults: dict = None):
+        """
+        Encodes the image once, the options that were not set on this Image are taken from `defaults`
+        """
+        if self._image_bytes is None and self.image is not None:
+            options = dict(self.options)
+
+            if defaults is not None:
+                for key, value in defaults.items():
+                    if options.get(key) is None:
+                        options[key] = value
+
+            self._image_bytes = encode_to_bytes(self.image, **options)
 
-        if image is not None:
-            self.data = encode(image)
+        return self._image_bytes
+
+    def get_num_pixels(self):
+        """
+        Number of pixels that are yet to be encoded, used to decide whether it's worth encoding images in parallel
+        """
+        if self._image_bytes is not None:
+            return 0
+        return get_num_pixels(self.image)
+
+    @property
+    def image_bytes(self):
+        return self.encode_image()
+
+    @image_bytes.setter
+    def image_bytes(self, value):
+        self._image_bytes = value
+
+    @property
+    def data(self):
+        if self.image_bytes is None:
+            return None
+        return bytes_to_text(self.image_bytes)
+
+    @data.setter
+    def data(self, value):
+        if value is None:
+            self.image_bytes = None
         else:
-            pass
+            self.image_bytes = text_to_bytes(value)
+
+    def encode(self, binary=False, defaults: dict = None):
+        """
+        Args:
+            binary (bool, optional): If set to True, the image is kept as raw bytes for binary transports like msgpack,
+                else it's converted to base64 text for json. Defaults to False.
+            defaults (dict, optional): encoding options to use for the ones which were not set on this Image. Defaults to None.
+        """
+        image_bytes = self.encode_image(defaults=defaults)
+
+        if binary == True or image_bytes is None:
+            return {"data": image_bytes, "type": self.type}
+        return {"data": bytes_to_text(image_bytes), "type": self.type}
+
+
+class Video(BaseDataType):
+    def __init__(self, frames=None, fps=24, format="mp4", quality=None):
+        """
+        Wrapper to store/send a sequence of frames (animations, videos) as a single encoded video
+        instead of one `Image` per frame.
+
+        Args:
+            frames (list or numpy.array or LazyVideo or str, optional): list of RGB frames (numpy arrays, PIL images or LazyImages),
+                an array of shape (num_frames, height, width, channels), or the filename of a video. Defaults to None.
+            fps (float, optional): frames per second. Defaults to 24.
+            format (str, optional): 'mp4', 'webm' or 'frames' (packed jpgs). Defaults to 'mp4'.
+            quality (int, optional): jpg quality (0-100) of each frame, only for format = 'frames'. Defaults to None.
+        """
+        super().__init__()
+
+        self.type = "eden.datatypes.Video"
+        self.frames = frames
+        self.fps = fps
+        self.format = format
+        self.quality = quality
+
+        ## raw video bytes, converted to base64 text only when it's sent as json
+        self._video_bytes = None
+
+    def encode_video(self):
+        if self._video_bytes is None and self.frames is not None:
+            if isinstance(self.frames, LazyVideo) and self.frames.format == self.format:
+                self._video_bytes = self.frames.as_bytes()
+            else:
+                self._video_bytes = encode_video_to_bytes(
+                    self.frames, fps=self.fps, format=self.format, quality=self.quality
+                )
+
+        return self._video_bytes
+
+    def get_num_pixels(self):
+        ## received videos are sent as they are whenever their format does not change, decoding them just to count would defeat that
+        if (
+            self._video_bytes is not None
+            or self.frames is None
+            or type(self.frames) == str
+            or isinstance(self.frames, LazyVideo)
+        ):
+            return 0
+        return sum(get_num_pixels(frame) for frame in self.frames)
+
+    @property
+    def data(self):
+        if self.encode_video() is None:
+            return None
+        return bytes_to_text(self._video_bytes)
+
+    @data.setter
+    def data(self, value):
+        if value is None:
+            self._video_bytes = None
+        else:
+            self._video_bytes = text_to_bytes(value)
+
+    def encode(self, binary=False, defaults: dict = None):
+        """
+        Args:
+            binary (bool, optional): If set to True, the video is kept as raw bytes for binary transports like msgpack,
+                else it's converted to base64 text for json. Defaults to False.
+            defaults (dict, optional): not used by videos. Defaults to None.
+        """
+        video_bytes = self.encode_video()
+
+        if binary == True or video_bytes is None:
+            return {"data": video_bytes, "type": self.type}
+        return {"data": bytes_to_text(video_bytes), "type": self.type}
@@ -1,57 +1,631 @@
-import nvidia_smi
+import time
+import uuid
+import logging
+import socket
+import threading
 
 from .log_utils import Colors
+from .utils import run_periodically
+
+
+"""
+How close two devices are, the lower the faster data moves between them.
+These are NVML's topology levels (nvmlDeviceGetTopologyCommonAncestor), plus NVLink which beats any of them
+"""
+TOPOLOGY_NVLINK = 0
+TOPOLOGY_SINGLE_SWITCH = 10
+TOPOLOGY_MULTIPLE_SWITCHES = 20
+TOPOLOGY_HOST_BRIDGE = 30
+TOPOLOGY_NUMA_NODE = 40
+TOPOLOGY_SYSTEM = 50
+
+
+class NoGPUAvailable(Exception):
+    """
+    Raised when a task could not get a GPU in time, it should go back to the queue instead of failing
+    """
+
+    pass
+
+
+class NVMLBackend(object):
+    """
+    Reads the GPUs, their memory and how they're connected from NVML (nvidia-ml-py3)
+    """
+
+    def __init__(self):
+        import nvidia_smi
+
+        self.nvidia_smi = nvidia_smi
+        self.nvidia_smi.nvmlInit()
+
+    def get_device_count(self):
+        return self.nvidia_smi.nvmlDeviceGetCount()
+
+    def get_memory_info(self, index: int):
+        """
+        Returns:
+            tuple: (total memory, free memory) of the device in MB
+        """
+        handle = self.nvidia_smi.nvmlDeviceGetHandleByIndex(index)
+        info = self.nvidia_smi.nvmlDeviceGetMemoryInfo(handle)
+        return info.total / 2**20, info.free / 2**20
+
+    def get_topology(self):
+        """
+        Returns:
+            list: topology[i][j] is how close devices i and j are, one of the TOPOLOGY_* levels.
+                Older versions of NVML (i.e nvidia-ml-py3==7.352.0) can't tell, then all of the devices are TOPOLOGY_SYSTEM apart
+        """
+        num_devices = self.get_device_count()
+        handles = [
+            self.nvidia_smi.nvmlDeviceGetHandleByIndex(i) for i in range(num_devices)
+        ]
+        topology = [
+            [0 if i == j else TOPOLOGY_SYSTEM for j in range(num_devices)]
+            for i in range(num_devices)
+        ]
+
+        get_common_ancestor = getattr(
+            self.nvidia_smi, "nvmlDeviceGetTopologyCommonAncestor", None
+        )
+
+        if get_common_ancestor is not None:
+            for i in range(num_devices):
+                for j in range(num_devices):
+                    if i == j:
+                        continue
+                    try:
+                        topology[i][j] = get_common_ancestor(handles[i], handles[j])
+                    except Exception:
+                        ## older drivers can't tell, assume the slowest link
+                        pass
+
+        ## devices connected with NVLink, found through the PCI bus id of the other end of each link
+        max_links = getattr(self.nvidia_smi, "NVML_NVLINK_MAX_LINKS", None)
+        get_link_state = getattr(self.nvidia_smi, "nvmlDeviceGetNvLinkState", None)
+        get_remote_pci_info = getattr(
+            self.nvidia_smi, "nvmlDeviceGetNvLinkRemotePciInfo", None
+        )
+
+        if max_links is None or get_link_state is None or get_remote_pci_info is None:
+            return topology
+
+        bus_ids = [self.nvidia_smi.nvmlDeviceGetPciInfo(h).busId for h in handles]
+
+        for i in range(num_devices):
+            for link in range(max_links):
+                try:
+                    if get_link_state(handles[i], link) != 1:
+                        continue
+                    remote = get_remote_pci_info(handles[i], link)
+                except Exception:
+                    break
+
+                if remote.busId in bus_ids:
+                    j = bus_ids.index(remote.busId)
+                    topology[i][j] = TOPOLOGY_NVLINK
+                    topology[j][i] = TOPOLOGY_NVLINK
+
+        return topology
+
+
+class SimulatedNVML(object):
+    def __init__(self, memory_mb: list, latency_ms: float = 0, topology: list = None):
+        """Pretends to be NVML on machines without GPUs, i.e to test how tasks get packed onto GPUs.
+
+        Args:
+            memory_mb (list): total memory in MB of each simulated GPU, like [81920, 81920]
+            latency_ms (float, optional): time each query takes, real NVML calls let other threads run meanwhile. Defaults to 0.
+            topology (list, optional): topology[i][j] is how close GPUs i and j are, see TOPOLOGY_*.
+                Defaults to None (all of them are connected through the system, TOPOLOGY_SYSTEM).
+        """
+        self.memory_mb = list(memory_mb)
+        self.latency_ms = latency_ms
+
+        if topology is None:
+            topology = [
+                [0 if i == j else TOPOLOGY_SYSTEM for j in range(len(self.memory_mb))]
+                for i in range(len(self.memory_mb))
+            ]
+        self.topology = topology
+
+        ## memory used by processes other than eden's tasks
+        self.used_memory_mb = [0] * len(self.memory_mb)
+
+    def set_used_memory(self, index: int, memory_mb: float):
+        self.used_memory_mb[index] = memory_mb
+
+    def get_device_count(self):
+        return len(self.memory_mb)
+
+    def get_memory_info(self, index: int):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+        return self.memory_mb[index], self.memory_mb[index] - self.used_memory_mb[index]
+
+    def get_topology(self):
+        return self.topology
+
+
+"""
+Finds the best GPUs for a task among its candidates and the leases already on them, and takes a lease on all of them at once.
+Both lease stores do exactly this (see find_best_fit(), eden.gpu_allocator.RedisLeaseStore does it in lua)
+
+KEYS[1]: hash of leases, {lease id: '{gpu name}|{memory in MB},{gpu name}|{memory in MB},...'}
+KEYS[2]: sorted set of leases by the time they expire at
+
+ARGV[1]: current time
+ARGV[2]: id of the new lease
+ARGV[3]: time the new lease expires at
+ARGV[4]: '1' if the task needs whole GPUs, '0' otherwise
+ARGV[5]: number of GPUs the task needs
+ARGV[6]: number of candidate GPUs (n)
+ARGV[7:7+4n]: 4 values per candidate GPU: name, total memory, free memory (NVML), memory the task needs
+ARGV[7+4n:]: n * n distances between the candidates, row by row
+
+Returns the new lease, or false if the task does not fit
+"""
+ACQUIRE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, lease_id in ipairs(expired) do
+    redis.call('HDEL', KEYS[1], lease_id)
+    redis.call('ZREM', KEYS[2], lease_id)
+end
+
+local reserved = {}
+local num_leases = {}
+local leases = redis.call('HGETALL', KEYS[1])
+for i = 2, #leases, 2 do
+    for reservation in string.gmatch(leases[i], '[^,]+') do
+        local separator = string.find(reservation, '|', 1, true)
+        local gpu = string.sub(reservation, 1, separator - 1)
+        reserved[gpu] = (reserved[gpu] or 0) + tonumber(string.sub(reservation, separator + 1))
+        num_leases[gpu] = (num_leases[gpu] or 0) + 1
+    end
+end
+
+local num_gpus = tonumber(ARGV[5])
+local n = tonumber(ARGV[6])
+local fits = {}
+local memory_left = {}
+for c = 1, n do
+    local i = 7 + 4 * (c - 1)
+    local gpu = ARGV[i]
+    fits[c] = false
+    memory_left[c] = 0
+    if ARGV[4] == '1' then
+        fits[c] = (num_leases[gpu] or 0) == 0
+    else
+        local available = math.min(tonumber(ARGV[i + 1]) - (reserved[gpu] or 0), tonumber(ARGV[i + 2]))
+        memory_left[c] = available - tonumber(ARGV[i + 3])
+        fits[c] = memory_left[c] >= -0.000001
+    end
+end
+
+local function distance(a, b)
+    return tonumber(ARGV[6 + 4 * n + (a - 1) * n + b])
+end
+
+local best = false
+local best_score = false
+for seed = 1, n do
+    if fits[seed] then
+        local group = {seed}
+        local in_group = {}
+        in_group[seed] = true
+        while #group < num_gpus do
+            local closest = false
+            local closest_distance = 0
+            for c = 1, n do
+                if fits[c] and not in_group[c] then
+                    local d = 0
+                    for _, g in ipairs(group) do
+                        d = math.max(d, distance(c, g))
+                    end
+                    if closest == false or d < closest_distance or (d == closest_distance and memory_left[c] < memory_left[closest]) then
+                        closest = c
+                        closest_distance = d
+                    end
+                end
+            end
+            if closest == false then
+                break
+            end
+            table.insert(group, closest)
+            in_group[closest] = true
+        end
+
+        if #group == num_gpus then
+            local score = {0, 0, 0}
+            for _, a in ipairs(group) do
+                score[3] = score[3] + memory_left[a]
+                for _, b in ipairs(group) do
+                    score[1] = math.max(score[1], distance(a, b))
+                    score[2] = score[2] + distance(a, b)
+                end
+            end
+            local better = best_score == false
+            for k = 1, 3 do
+                if better or score[k] ~= best_score[k] then
+                    better = better or score[k] < best_score[k]
+                    break
+                end
+            end
+            if better then
+                best = group
+                best_score = score
+            end
+        end
+    end
+end
+
+if best == false then
+    return false
+end
+
+table.sort(best)
+local reservations = {}
+for _, c in ipairs(best) do
+    local i = 7 + 4 * (c - 1)
+    table.insert(reservations, ARGV[i] .. '|' .. ARGV[i + 3])
+end
+local lease = table.concat(reservations, ',')
+
+redis.call('HSET', KEYS[1], ARGV[2], lease)
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+return lease
+"""
+
+"""
+Extends the leases of the tasks which are still running.
+A lease which expired meanwhile (i.e the heartbeat was late) is taken again, since its task is still using the GPUs.
+
+KEYS[1]: hash of leases
+KEYS[2]: sorted set of leases by the time they expire at
+
+ARGV[1]: current time
+ARGV[2]: time the leases expire at from now on
+ARGV[3:]: 2 values per lease: its id, and the lease as it's stored on KEYS[1]
+
+Returns the ids of the leases which had expired
+"""
+RENEW_SCRIPT = """
+local lost = {}
+for i = 3, #ARGV, 2 do
+    local expires_at = redis.call('ZSCORE', KEYS[2], ARGV[i])
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 0 or not expires_at or tonumber(expires_at) <= tonumber(ARGV[1]) then
+        table.insert(lost, ARGV[i])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[i])
+end
+return lost
+"""
+
+
+def find_best_fit(
+    candidates: list,
+    leases: dict,
+    whole_gpu: bool,
+    num_gpus: int = 1,
+    distances: list = None,
+):
+    """Picks the GPUs a task fits best on.
+
+    With a single GPU, it's the one with the least memory left once the task is on it.
+    With more, each GPU which fits starts a group which grows with the closest GPU to it (by the slowest of their links),
+    and the group whose slowest link is the fastest wins (then the one with the least memory left).
+
+    Args:
+        candidates (list): (name, total memory, free memory, memory the task needs) of each GPU
+        leases (dict): {lease id: [(gpu name, memory in MB), ...]} of the tasks already running
+        whole_gpu (bool): if True, only the GPUs without any lease fit
+        num_gpus (int, optional): number of GPUs the task needs. Defaults to 1.
+        distances (list, optional): distances[i][j] is how close candidates i and j are (see TOPOLOGY_*). Defaults to None (all equally close).
+
+    Returns:
+        list or None: [(gpu name, memory in MB), ...] to take a lease on, None if the task does not fit
+    """
+    reserved = {}
+    num_leases = {}
+    for reservations in leases.values():
+        for gpu, memory_mb in reservations:
+            reserved[gpu] = reserved.get(gpu, 0) + memory_mb
+            num_leases[gpu] = num_leases.get(gpu, 0) + 1
+
+    if distances is None:
+        distances = [[0] * len(candidates) for c in candidates]
+
+    fits = []
+    memory_left = []
+
+    for name, total_memory, free_memory, required_memory in candidates:
+        if whole_gpu == True:
+            ## a whole GPU can't be shared
+            fits.append(num_leases.get(name, 0) == 0)
+            memory_left.append(0)
+        else:
+            available_memory = min(total_memory - reserved.get(name, 0), free_memory)
+            memory_left.append(available_memory - required_memory)
+            ## with some tolerance for floating point errors, i.e for 10 tasks with fraction = 0.1
+            fits.append(memory_left[-1] >= -1e-6)
+
+    best_group = None
+    best_score = None
+
+    for seed in range(len(candidates)):
+        if fits[seed] == False:
+            continue
+
+        group = [seed]
+        while len(group) < num_gpus:
+            others = [c for c in range(len(candidates)) if fits[c] == True and c not in group]
+            if len(others) == 0:
+                break
+            closest = min(
+                others,
+                key=lambda c: (max(distances[c][g] for g in group), memory_left[c]),
+            )
+            group.append(closest)
+
+        if len(group) < num_gpus:
+            continue
+
+        score = (
+            max(distances[a][b] for a in group for b in group),
+            sum(distances[a][b] for a in group for b in group),
+            sum(memory_left[c] for c in group),
+        )
+        if best_score is None or score < best_score:
+            best_group = group
+            best_score = score
+
+    if best_group is None:
+        return None
+
+    return [(candidates[c][0], candidates[c][3]) for c in sorted(best_group)]
+
+
+class Lease(object):
+    """
+    A part (or all) of one or more GPUs, held by a task until it's released
+    """
+
+    def __init__(self, id: str, reservations: list):
+        self.id = id
+        ## [(gpu name, memory in MB), ...]
+        self.reservations = reservations
+        self.gpus = [gpu for gpu, _ in reservations]
+
+        ## the first one, for tasks which need a single GPU
+        self.gpu = self.gpus[0]
+        self.memory_mb = reservations[0][1]
+
+
+class LocalLeaseStore(object):
+    """
+    Keeps the leases in memory, for the worker threads of a single process.
+    Leases never expire since they go away along with the process anyway
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        ## {lease id: [(gpu name, memory in MB), ...]}
+        self.leases = {}
+
+    def acquire(
+        self,
+        lease_id: str,
+        candidates: list,
+        whole_gpu: bool,
+        ttl: float,
+        num_gpus: int = 1,
+        distances: list = None,
+    ):
+        with self.lock:
+            reservations = find_best_fit(
+                candidates=candidates,
+                leases=self.leases,
+                whole_gpu=whole_gpu,
+                num_gpus=num_gpus,
+                distances=distances,
+            )
+            if reservations is not None:
+                self.leases[lease_id] = reservations
+            return reservations
+
+    def release(self, lease_id: str):
+        with self.lock:
+            self.leases.pop(lease_id, None)
+
+    def renew(self, leases: dict, ttl: float):
+        return []
+
+    def get_leases(self):
+        with self.lock:
+            return dict(self.leases)
+
+
+class RedisLeaseStore(object):
+    def __init__(self, redis, key: str = None):
+        """Keeps the leases on redis, so that several eden replicas (processes, containers) can share the GPUs of a machine.
+        Each lease expires unless it's renewed (see `GPUAllocator.start_heartbeat()`), so the GPUs held by a crashed worker get free on their own.
+
+        Args:
+            redis (redis.Redis): connection to redis
+            key (str, optional): identifies the machine whose GPUs are shared, it has to be the same on all of its replicas. Defaults to the hostname.
+        """
+        self.redis = redis
+        key = key if key is not None else socket.gethostname()
+        self.leases_name = "eden-gpu-leases:" + key
+        self.expiry_name = "eden-gpu-lease-expiry:" + key
+
+        self.acquire_script = self.redis.register_script(ACQUIRE_SCRIPT)
+        self.renew_script = self.redis.register_script(RENEW_SCRIPT)
+
+    def encode_lease(self, reservations: list):
+        return ",".join(f"{gpu}|{memory_mb}" for gpu, memory_mb in reservations)
+
+    def decode_lease(self, value):
+        reservations = []
+        for reservation in value.decode().split(","):
+            gpu, memory_mb = reservation.rsplit("|", 1)
+            reservations.append((gpu, float(memory_mb)))
+        return reservations
+
+    def acquire(
+        self,
+        lease_id: str,
+        candidates: list,
+        whole_gpu: bool,
+        ttl: float,
+        num_gpus: int = 1,
+        distances: list = None,
+    ):
+        if distances is None:
+            distances = [[0] * len(candidates) for c in candidates]
+
+        args = [
+            time.time(),
+            lease_id,
+            time.time() + ttl,
+            "1" if whole_gpu == True else "0",
+            num_gpus,
+            len(candidates),
+        ]
+        for candidate in candidates:
+            args.extend(candidate)
+        for row in distances:
+            args.extend(row)
+
+        lease = self.acquire_script(keys=[self.leases_name, self.expiry_name], args=args)
+
+        if lease is None:
+            return None
+        return self.decode_lease(lease)
+
+    def release(self, lease_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.leases_name, lease_id)
+        pipe.zrem(self.expiry_name, lease_id)
+        pipe.execute()
+
+    def renew(self, leases: dict, ttl: float):
+        """
+        Args:
+            leases (dict): {lease id: [(gpu name, memory in MB), ...]} of the tasks which are still running
+            ttl (float): number of seconds the leases last from now on
+
+        Returns:
+            list: ids of the leases which had expired, they're taken again
+        """
+        if len(leases) == 0:
+            return []
+
+        now = time.time()
+        args = [now, now + ttl]
+        for lease_id, reservations in leases.items():
+            args.extend([lease_id, self.encode_lease(reservations)])
+
+        lost = self.renew_script(keys=[self.leases_name, self.expiry_name], args=args)
+        return [lease_id.decode() for lease_id in lost]
+
+    def get_leases(self):
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self.leases_name)
+        pipe.zrangebyscore(self.expiry_name, time.time(), "+inf")
+        leases, alive = pipe.execute()
+
+        result = {}
+        for lease_id, value in leases.items():
+            if lease_id in alive:
+                result[lease_id.decode()] = self.decode_lease(value)
+        return result
 
 
 class GPUAllocator(object):
-    def __init__(self, exclude_gpu_ids: list = []):
+    def __init__(
+        self,
+        exclude_gpu_ids: list = [],
+        backend=None,
+        lease_store=None,
+        lease_ttl: float = 30,
+        poll_interval: float = 1,
+    ):
         """
         Usage:
 
         g = GPUAllocator()
-        gpu_id = g.get_gpu()
+        lease = g.acquire()  ## a whole GPU
+        lease = g.acquire(memory_mb = 12000)  ## or a part of one, several tasks can share a GPU
+        lease = g.acquire(num_gpus = 4)  ## or 4 whole GPUs, as close to each other as possible
+
+        ## do something with lease.gpu, which is something like 'cuda:0' (or lease.gpus, like ['cuda:0', 'cuda:1', 'cuda:2', 'cuda:3'])
+
+        g.release(lease)
 
-        ## do something with gpu_id
+        Or with the names only: gpu_name = g.get_gpu(...) and g.set_as_free(gpu_name, ...) with the same memory_mb/fraction.
 
-        g.set_as_free(gpu_id)
+        Tasks which ask for a part of a GPU are placed on the GPU they fit best on (the one with the least memory left once they're on it),
+        so that the GPUs with the most free memory stay available for bigger tasks.
+        Tasks which need several GPUs get the ones with the fastest links between them (i.e NVLink, or the same PCIe switch).
+        Finding GPUs and taking a lease on them is atomic and all or nothing, so any number of threads can share a GPUAllocator
+        and a task never holds a few GPUs while waiting for the others.
 
+        Args:
+            exclude_gpu_ids (list, optional): ids of the GPUs not to use. Defaults to [].
+            backend (optional): where the GPUs and their memory are read from, eden.gpu_allocator.NVMLBackend() if None,
+                or eden.gpu_allocator.SimulatedNVML for machines without GPUs. Defaults to None.
+            lease_store (optional): where the leases are kept, eden.gpu_allocator.LocalLeaseStore() if None,
+                or eden.gpu_allocator.RedisLeaseStore to share the GPUs with other processes. Defaults to None.
+            lease_ttl (float, optional): number of seconds a lease lasts on the RedisLeaseStore unless it's renewed. Defaults to 30.
+            poll_interval (float, optional): max number of seconds between two attempts of a task waiting for a GPU,
+                releases from this process wake it up right away but not the ones from other processes. Defaults to 1.
         """
 
-        nvidia_smi.nvmlInit()
+        self.backend = backend if backend is not None else NVMLBackend()
+        self.lease_store = lease_store if lease_store is not None else LocalLeaseStore()
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
 
-        self.num_gpus = nvidia_smi.nvmlDeviceGetCount()
         self.gpu_names = []
+        self.device_indices = {}
 
-        for i in range(self.num_gpus):
+        for i in range(self.backend.get_device_count()):
             if i in exclude_gpu_ids:
                 pass
             else:
                 self.gpu_names.append("cuda:" + str(i))
+                self.device_indices["cuda:" + str(i)] = i
 
-        self.usage = {}
+        self.num_gpus = len(self.gpu_names)
 
-        for i in range(self.num_gpus):
-            if i in exclude_gpu_ids:
-                pass
-            else:
-                self.usage[i] = False
+        ## how close each pair of GPUs is, see TOPOLOGY_*
+        topology = self.backend.get_topology()
+        self.distances = [
+            [topology[self.device_indices[a]][self.device_indices[b]] for b in self.gpu_names]
+            for a in self.gpu_names
+        ]
 
         """
-        on a good day, this is how the variables look like: 
-
-        self.num_gpus= 2
+        leases taken by this process, which get renewed by the heartbeat
 
-        self.gpu_names= [
-            'cuda:0', 
-            'cuda:1'
-        ]
+        on a good day, this is how it looks like:
 
-        self.usage= {
-            0: False,
-            1: False
+        self.leases = {
+            '3f2a...': Lease(id = '3f2a...', reservations = [('cuda:0', 20480)]),
+            '9b1c...': Lease(id = '9b1c...', reservations = [('cuda:0', 20480)]),
+            '5e7d...': Lease(id = '5e7d...', reservations = [('cuda:2', 81920), ('cuda:3', 81920)]),
         }
-        
         """
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.heartbeat = None
+
+        ## notified on each release, so that the tasks waiting for a GPU can try again
+        self.released = threading.Condition(self.lock)
+        self.num_releases = 0
 
         print(
             "["
@@ -63,44 +637,265 @@ class GPUAllocator(object):
             self.gpu_names,
         )
 
+    def get_memory_info(self, name: str):
         """
-        False: free 
-        True: occupied 
+        Returns:
+            tuple: (total memory, free memory) of a GPU in MB, as reported by the backend
         """
+        return self.backend.get_memory_info(self.device_indices[name])
 
-    def set_as_occupied(self, name: str):
+    def get_required_memory(
+        self, total_memory: float, memory_mb: float = None, fraction: float = None
+    ):
         """
-        True: occupied
+        Memory in MB that a task needs on a GPU with `total_memory` MB, all of it if neither memory_mb nor fraction are given
         """
-        index = self.gpu_names.index(name)
-        self.usage[index] = True
+        if memory_mb is not None:
+            return memory_mb
+        elif fraction is not None:
+            return fraction * total_memory
+        return total_memory
 
-    def set_as_free(self, name: str):
+    def get_available_memory(self, name: str):
         """
-        False: free
+        Memory in MB that new tasks can get on a GPU: what's not leased by eden's tasks (from any process),
+        and at most what NVML says is free (other processes might be using the GPU too)
         """
-        index = self.gpu_names.index(name)
-        self.usage[index] = False
+        total_memory, free_memory = self.get_memory_info(name)
+        reserved = sum(
+            memory_mb
+            for reservations in self.lease_store.get_leases().values()
+            for gpu, memory_mb in reservations
+            if gpu == name
+        )
+        return min(total_memory - reserved, free_memory)
+
+    def acquire(
+        self,
+        memory_mb: float = None,
+        fraction: float = None,
+        timeout: float = 0,
+        num_gpus: int = 1,
+    ):
+        """Finds GPUs for a task, and takes a lease on the memory it needs on each of them.
+
+        Args:
+            memory_mb (float, optional): memory in MB that the task needs (on each GPU). Defaults to None.
+            fraction (float, optional): fraction of the memory of a GPU that the task needs (i.e 0.25). Defaults to None.
+                If neither memory_mb nor fraction are given, the task gets whole GPUs.
+            timeout (float, optional): max number of seconds to wait for GPUs to get free. Defaults to 0.
+            num_gpus (int, optional): number of GPUs the task needs. Defaults to 1.
+
+        Returns:
+            eden.gpu_allocator.Lease or None: None if the task does not fit within the timeout
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                num_releases = self.num_releases
 
-    def get_gpu(self):
+            lease = self.try_acquire(
+                memory_mb=memory_mb, fraction=fraction, num_gpus=num_gpus
+            )
 
-        usage_values = list(self.usage.values())
+            remaining = deadline - time.monotonic()
+            if lease is not None or remaining <= 0:
+                return lease
 
-        if False not in list(usage_values):
+            with self.released:
+                ## unless something was released while trying
+                if self.num_releases == num_releases:
+                    self.released.wait(timeout=min(remaining, self.poll_interval))
+
+    def try_acquire(
+        self, memory_mb: float = None, fraction: float = None, num_gpus: int = 1
+    ):
+        candidates = []
+        for name in self.gpu_names:
+            ## a single query to the backend for each GPU, so that both numbers come from the same reading
+            total_memory, free_memory = self.get_memory_info(name)
+            required_memory = self.get_required_memory(
+                total_memory, memory_mb=memory_mb, fraction=fraction
+            )
+            candidates.append((name, total_memory, free_memory, required_memory))
+
+        lease_id = uuid.uuid4().hex
+        reservations = self.lease_store.acquire(
+            lease_id=lease_id,
+            candidates=candidates,
+            whole_gpu=memory_mb is None and fraction is None,
+            ttl=self.lease_ttl,
+            num_gpus=num_gpus,
+            distances=self.distances,
+        )
+
+        if reservations is None:
             return None
-        else:
-            for i in range(len(usage_values)):
-                if usage_values[i] == False:
 
-                    gpu_name = self.gpu_names[i]
-                    self.set_as_occupied(name=gpu_name)
+        lease = Lease(id=lease_id, reservations=reservations)
 
-                    return gpu_name
+        with self.lock:
+            self.leases[lease.id] = lease
 
-    def get_usage(self):
-        d = {}
-        usage_values = list(self.usage.values())
-        for i in range(len(usage_values)):
-            d[self.gpu_names[i]] = usage_values[i]
+        return lease
+
+    def wait_until_free(
+        self,
+        memory_mb: float = None,
+        fraction: float = None,
+        timeout: float = 0,
+        num_gpus: int = 1,
+    ):
+        """Waits until a task would fit on the GPUs, without keeping a lease on them.
+        Takes the same args as `acquire()`.
+
+        Returns:
+            bool: False if the task still does not fit after the timeout
+        """
+        lease = self.acquire(
+            memory_mb=memory_mb, fraction=fraction, timeout=timeout, num_gpus=num_gpus
+        )
+        if lease is None:
+            return False
+
+        self.release(lease)
+        return True
 
-        return d
+    def release(self, lease: Lease):
+        with self.lock:
+            self.leases.pop(lease.id, None)
+        self.lease_store.release(lease.id)
+        self.notify_release()
+
+    def notify_release(self):
+        with self.released:
+            self.num_releases += 1
+            self.released.notify_all()
+
+    def renew_leases(self):
+        """
+        Extends all the leases of this process by lease_ttl seconds.
+        The ones which expired meanwhile are taken again, the GPUs might have been given to another task in the meantime.
+
+        Returns:
+            list: ids of the leases which had expired
+        """
+        with self.lock:
+            leases = {lease.id: lease.reservations for lease in self.leases.values()}
+
+        ## not under the lock, so that a slow lease store never holds up acquire() and release()
+        lost = self.lease_store.renew(leases=leases, ttl=self.lease_ttl)
+
+        ## leases are taken out of self.leases before they're released, those which were released meanwhile
+        ## might have been renewed (or taken again) after that, so they're released once more
+        with self.lock:
+            released = [lease_id for lease_id in leases if lease_id not in self.leases]
+
+        if len(released) > 0:
+            for lease_id in released:
+                self.lease_store.release(lease_id)
+            self.notify_release()
+
+        lost = [lease_id for lease_id in lost if lease_id not in released]
+
+        for lease_id in lost:
+            gpus = [gpu for gpu, _ in leases[lease_id]]
+            logging.warning(
+                f"the lease on {gpus} expired before it was renewed, it was taken again. "
+                "Other tasks might have been given its memory meanwhile, consider a longer lease_ttl"
+            )
+
+        return lost
+
+    def start_heartbeat(self, interval: float = None):
+        """Renews the leases of this process on a daemon thread, every lease_ttl / 3 seconds by default.
+        If the process dies, its leases expire within lease_ttl seconds and its GPUs get free for the others.
+        """
+        if self.heartbeat is None:
+            interval = interval if interval is not None else self.lease_ttl / 3
+            self.heartbeat = run_periodically(fn=self.renew_leases, interval=interval)
+
+    def get_gpu(self, memory_mb: float = None, fraction: float = None, timeout: float = 0):
+        """Same as `acquire()`, but returns the name of the GPU only.
+
+        Returns:
+            str or None: something like 'cuda:0', None if the task does not fit on any GPU within the timeout
+        """
+        lease = self.acquire(memory_mb=memory_mb, fraction=fraction, timeout=timeout)
+        return lease.gpu if lease is not None else None
+
+    def set_as_free(self, name: str, memory_mb: float = None, fraction: float = None):
+        """
+        Releases a GPU obtained from `get_gpu()`, memory_mb and fraction should be the same as they were there
+        """
+        total_memory, _ = self.get_memory_info(name)
+        required_memory = self.get_required_memory(
+            total_memory, memory_mb=memory_mb, fraction=fraction
+        )
+
+        with self.lock:
+            leases = [lease for lease in self.leases.values() if lease.gpu == name]
+            matching = [lease for lease in leases if lease.memory_mb == required_memory]
+
+            if len(matching) > 0:
+                lease = matching[0]
+            elif len(leases) > 0:
+                lease = leases[-1]
+            else:
+                return
+
+            ## taken out under the lock so that two threads never release the same lease
+            self.leases.pop(lease.id)
+
+        self.lease_store.release(lease.id)
+        self.notify_release()
+
+    def get_capacity(
+        self, memory_mb: float = None, fraction: float = None, num_gpus: int = 1
+    ):
+        """
+        Max number of tasks which can run at the same time if nothing else is using the GPUs
+        """
+        if num_gpus > self.num_gpus:
+            return 0
+
+        if memory_mb is None and fraction is None:
+            return self.num_gpus // num_gpus
+
+        capacity = sum(
+            self.get_gpu_capacity(name, memory_mb=memory_mb, fraction=fraction)
+            for name in self.gpu_names
+        )
+
+        ## each task takes a share of num_gpus different GPUs
+        return capacity // num_gpus
+
+    def get_gpu_capacity(self, name: str, memory_mb: float = None, fraction: float = None):
+        """
+        Max number of tasks which can share a GPU if nothing else is using it, 1 if each task needs a whole GPU
+        """
+        if memory_mb is None and fraction is None:
+            return 1
+
+        total_memory, _ = self.get_memory_info(name)
+        required_memory = self.get_required_memory(
+            total_memory, memory_mb=memory_mb, fraction=fraction
+        )
+        if required_memory <= 0:
+            return 0
+
+        ## rounded so that i.e fraction = 0.1 fits 10 times despite floating point errors
+        return int(round(total_memory / required_memory, 6))
+
+    def get_usage(self):
+        """
+        Returns:
+            dict: {gpu name: True if some task (from any process sharing the lease store) is running on it}
+        """
+        used = set(
+            gpu
+            for reservations in self.lease_store.get_leases().values()
+            for gpu, _ in reservations
+        )
+        return {name: name in used for name in self.gpu_names}
@@ -1,9 +1,13 @@
 import os
 import git
+import time
+import json
 import warnings
 import uvicorn
 import logging
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from prometheus_client import Gauge
 from starlette_exporter import PrometheusMiddleware, handle_metrics
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,29 +15,36 @@ from fastapi.middleware.cors import CORSMiddleware
 from .datatypes import Image
 from .queue import QueueData
 from .log_utils import Colors
-from .models import Credentials, WaitFor
+from .models import Credentials, FetchMany, WaitFor
 from .result_storage import ResultStorage
+from .retention import ResultRetention
+from .result_cache import ResultCache
+from .batching import Batcher
 from .config_wrapper import ConfigWrapper
-from .data_handlers import Encoder, Decoder
+from .data_handlers import Encoder, Decoder, encode_bytes_as_text
+from .video_utils import get_video_format, unpack_frames
+from .msgpack_utils import MsgpackRoute, MsgpackResponse, accepts_msgpack
 from .threaded_server import ThreadedServer
-from .progress_tracker import fetch_progress_from_token
 from .log_utils import log_levels, celery_log_levels, PREFIX
 from .prometheus_utils import PrometheusMetrics
 
-from .utils import stop_everything_gracefully, generate_random_string
+from .utils import stop_everything_gracefully, generate_random_string, run_periodically
 
 from uvicorn.config import LOGGING_CONFIG
 
 """
 Celery+redis is needed to be able to queue tasks
 """
+from redis import Redis
 from celery import Celery
-from .celery_utils import run_celery_app
+from celery.exceptions import Reject
+from celery.signals import task_received, task_prerun, task_postrun
+from .celery_utils import run_celery_app, ConsumerGate
 
 """
 tool to allocate gpus on queued tasks
 """
-from .gpu_allocator import GPUAllocator
+from .gpu_allocator import GPUAllocator, RedisLeaseStore, NoGPUAvailable
 
 
 def host_block(
@@ -47,7 +58,21 @@ def host_block(
     log_level="warning",
     logfile="logs.log",
     exclude_gpu_ids: list = [],
-    remove_result_on_fetch = False
+    remove_result_on_fetch = False,
+    stream_keep_alive_interval=15,
+    max_fetch_wait=30,
+    blob_store=None,
+    blob_min_size=64 * 1024,
+    blob_gc_interval=3600,
+    result_ttl=None,
+    max_result_bytes=None,
+    result_sweep_interval=60,
+    gpu_lease_key=None,
+    gpu_lease_ttl=30,
+    gpu_wait_timeout=10,
+    priority_lanes: list = ["high", "normal", "low"],
+    default_priority="normal",
+    priority_max_wait: dict = {"normal": 300, "low": 1800},
 ):
     """
     Use this to host your eden.Block on a server. Supports multiple GPUs and queues tasks automatically with celery.
@@ -63,6 +88,27 @@ def host_block(
         log_level (str, optional): Can be 'debug', 'info', or 'warning'. Defaults to 'warning'
         logfile(str, optional): Name of the file where the logs would be stored. If set to None, it will show all logs on stdout. Defaults to 'logs.log'
         exclude_gpu_ids (list, optional): List of gpu ids to not use for hosting. Example: [2,3]
+        remove_result_on_fetch (bool, optional): Deletes the results of a task once they're fetched after it's complete. Defaults to False.
+        stream_keep_alive_interval (float, optional): Max number of seconds between two events on /stream/{token}. Defaults to 15.
+        max_fetch_wait (float, optional): Max number of seconds a long-poll on /fetch can wait for, whatever `wait` the client asked for. Defaults to 30.
+        blob_store (eden.blob_store.BlobStore, optional): Stores large values (i.e images) of the results outside of redis, which only keeps their keys.
+            Example: eden.blob_store.LocalBlobStore("blobs"). Defaults to None.
+        blob_min_size (int, optional): Min number of bytes of a value to be stored on the blob store. Defaults to 64 * 1024.
+        blob_gc_interval (float, optional): Number of seconds between two sweeps of the blobs which are not referenced by any result anymore. Defaults to 3600.
+        result_ttl (float, optional): Number of seconds to keep the results (and celery's task meta) of a task once it's done, then /fetch says it's 'expired'. Defaults to None (forever).
+        max_result_bytes (int, optional): Max number of bytes on redis for the results of completed tasks, the oldest ones are evicted first. Defaults to None (no limit).
+        result_sweep_interval (float, optional): Number of seconds between two sweeps of the expired results. Defaults to 60.
+        gpu_lease_key (str, optional): Set this to the same value (i.e the hostname of the machine) on all the eden replicas sharing the GPUs of a machine,
+            their leases on the GPUs are then kept on redis. Defaults to None (the GPUs belong to this process only).
+        gpu_lease_ttl (float, optional): Number of seconds after which the GPUs leased by a replica which stopped renewing them (i.e it crashed) get free. Defaults to 30.
+        gpu_wait_timeout (float, optional): Max number of seconds a task which was picked up by a worker waits for a GPU to get free,
+            before it goes back to its place in the queue. The worker then takes no more tasks until a GPU gets free. Defaults to 10.
+        priority_lanes (list, optional): Priorities which can be given to /run, most urgent first. Workers always take the jobs of the first lanes first.
+            Defaults to ['high', 'normal', 'low'].
+        default_priority (str, optional): Priority of the jobs which did not ask for one. Defaults to 'normal'.
+            Jobs go on celery's own queue only if this is the first lane, eden replicas without priority lanes don't take the jobs of the other lanes.
+        priority_max_wait (dict, optional): {priority: max number of seconds a job waits on its lane}, after that it moves to the back of the first lane
+            so that busy lanes never starve the others. Defaults to {'normal': 300, 'low': 1800}.
     """
 
     """
@@ -134,7 +180,8 @@ def host_block(
     celery_app.conf.task_default_queue = block.name
 
     """
-    set prefetch mult to 1 so that tasks dont get pre-fetched by workers 
+    set prefetch mult to 1 so that tasks dont get pre-fetched by workers.
+    there are as many worker threads as tasks that fit on the GPUs, so a task only leaves the queue once there's room for it
     """
     celery_app.conf.worker_prefetch_multiplier = 1
 
@@ -143,45 +190,101 @@ def host_block(
     """
     celery_app.conf.task_acks_late = True
 
+    """
+    task messages are serialized with msgpack so that images from binary clients stay raw bytes.
+    results stay json because eden.queue.QueueData reads them straight from redis
+    """
+    celery_app.conf.task_serializer = "msgpack"
+    celery_app.conf.accept_content = ["json", "msgpack"]
+    celery_app.conf.result_serializer = "json"
+
+    """
+    each priority lane is a priority of celery's redis transport (0 is the most urgent one),
+    the transport always pops the priorities of a queue in order
+    """
+    celery_app.conf.broker_transport_options = {
+        "priority_steps": list(range(len(priority_lanes))),
+    }
+
     """
     Initiating GPUAllocator only if requires_gpu is True
     """
     if requires_gpu == True:
-        gpu_allocator = GPUAllocator(exclude_gpu_ids=exclude_gpu_ids)
+        if gpu_lease_key is not None:
+            lease_store = RedisLeaseStore(
+                redis=Redis(host=redis_host, port=redis_port), key=gpu_lease_key
+            )
+        else:
+            lease_store = None
+
+        gpu_allocator = GPUAllocator(
+            exclude_gpu_ids=exclude_gpu_ids,
+            lease_store=lease_store,
+            lease_ttl=gpu_lease_ttl,
+        )
+        gpu_allocator.start_heartbeat()
     else:
         print(PREFIX + " Initiating server with no GPUs since requires_gpu = False")
 
+    """
+    GPU requirements of each task (or batch), each one gets num_gpus whole GPUs if neither memory_mb nor fraction are set
+    """
+    gpu_requirements = dict(
+        memory_mb=block.gpu_memory_mb,
+        fraction=block.gpu_fraction,
+        num_gpus=block.num_gpus,
+    )
+
     if requires_gpu == True:
-        if gpu_allocator.num_gpus < max_num_workers:
+        if block.num_gpus > gpu_allocator.num_gpus:
+            raise Exception(
+                f"each task needs {block.num_gpus} GPUs but only {gpu_allocator.num_gpus} were found"
+            )
+
+        gpu_capacity = gpu_allocator.get_capacity(**gpu_requirements)
+
+        if gpu_capacity < max_num_workers:
             """
-            if a task requires a gpu, and the number of workers is > the number of available gpus,
-            then max_num_workers is automatically set to the number of gpus available
-            this is because eden assumes that each task requires one gpu (all of it)
+            if a task requires a gpu, and the number of workers is > the number of tasks that fit on the gpus,
+            then max_num_workers is automatically set to the number of tasks that fit.
+            that's the number of gpus (divided by @block.run(num_gpus = ...)) unless the block declared how much memory each task needs with
+            @block.run(gpu_memory_mb = ...) or @block.run(gpu_fraction = ...)
             """
             warnings.warn(
-                "max_num_workers is greater than the number of GPUs found, overriding max_num_workers to be: "
-                + str(gpu_allocator.num_gpus)
+                "max_num_workers is greater than the number of tasks that fit on the GPUs found, overriding max_num_workers to be: "
+                + str(gpu_capacity)
             )
-            max_num_workers = gpu_allocator.num_gpus
+            max_num_workers = gpu_capacity
 
     """
     Initiating queue data to keep track of the queue
     """
     queue_data = QueueData(
-        redis_port=redis_port, redis_host=redis_host, queue_name=block.name
+        redis_port=redis_port,
+        redis_host=redis_host,
+        queue_name=block.name,
+        priority_lanes=priority_lanes,
+        default_priority=default_priority,
     )
 
     """
     Initiate encoder and decoder
+    outputs are encoded as raw bytes, they're converted to base64 text only for the clients that want json.
+    blocks with lots of output images get them encoded in parallel, so that the worker holding the GPU is freed sooner
     """
 
-    data_encoder = Encoder()
-    data_decoder = Decoder()
+    data_encoder = Encoder(
+        binary=True, image_options=block.image_options, parallel=True
+    )
+    data_decoder = Decoder(lazy=block.lazy_inputs)
 
     """
     Initiate fastAPI app
     """
     app = FastAPI()
+
+    ## accept msgpack request bodies along with json
+    app.router.route_class = MsgpackRoute
     origins = ["*"]
     app.add_middleware(
         CORSMiddleware,
@@ -200,8 +303,21 @@ def host_block(
     result_storage = ResultStorage(
         redis_host=redis_host,
         redis_port=redis_port,
+        blob_store=blob_store,
+        blob_min_size=blob_min_size,
     )
 
+    """
+    Blobs are collected in the background, those which were written during the last interval are always kept
+    """
+    if blob_store is not None:
+
+        def collect_blob_garbage():
+            num_deleted = result_storage.collect_blob_garbage(min_age=blob_gc_interval)
+            logging.info(f"Deleted {num_deleted} unreferenced blobs")
+
+        run_periodically(collect_blob_garbage, interval=blob_gc_interval)
+
     ## set up result storage and data encoder for block
     block.result_storage = result_storage
     block.data_encoder = data_encoder
@@ -215,40 +331,238 @@ def host_block(
     """
     prometheus_metrics = PrometheusMetrics()
 
+    """
+    jobs which waited too long on their lane move to the first one, replicas can all do this at the same time
+    """
+
+    def promote_starved_jobs():
+        num_promoted = queue_data.promote_starved(max_wait=priority_max_wait)
+        if num_promoted > 0:
+            prometheus_metrics.promoted.inc(num_promoted)
+            logging.info(f"Moved {num_promoted} starved jobs to the first lane")
+
+    if len(priority_lanes) > 1:
+        run_periodically(promote_starved_jobs, interval=1)
+
+    """
+    Evict the results of completed tasks after result_ttl and/or when they take more than max_result_bytes.
+    Redis expires the results by itself after result_ttl, the sweeper remembers which tokens expired
+    """
+    if result_ttl is not None or max_result_bytes is not None:
+        result_retention = ResultRetention(
+            queue_data=queue_data,
+            result_storage=result_storage,
+            result_ttl=result_ttl,
+            max_bytes=max_result_bytes,
+        )
+
+        if result_ttl is not None:
+            ## kept a bit longer than the results so that /fetch can tell they expired until the sweeper gets to them
+            celery_app.conf.result_expires = int(result_ttl + 2 * result_sweep_interval)
+
+        def sweep_results():
+            reclaimed, num_evicted = result_retention.sweep()
+            prometheus_metrics.reclaimed_bytes.inc(reclaimed)
+            prometheus_metrics.expired.inc(num_evicted)
+            prometheus_metrics.result_bytes.set(result_retention.get_total_bytes())
+
+        run_periodically(sweep_results, interval=result_sweep_interval)
+    else:
+        result_retention = None
+
+    """
+    Share the results of identical configs, if the block asked for it with @block.run(cache = True)
+    """
+    if block.cache == True:
+        if remove_result_on_fetch == True:
+            ## the first fetch would delete the results that the other requests with the same token are waiting for
+            raise Exception(
+                "@block.run(cache = True) can't be used with remove_result_on_fetch = True"
+            )
+
+        result_cache = ResultCache(
+            queue_data=queue_data,
+            result_storage=result_storage,
+            version=block.version,
+            exclude=block.cache_exclude,
+            ttl=result_ttl,
+        )
+    else:
+        result_cache = None
+
+    """
+    With @block.run(batch_size = N), each celery task hands its config over to the batcher and waits for its outputs.
+    Each batch gets a GPU of its own, and there are enough celery threads for max_num_workers full batches
+    """
+
+    def run_batch(configs: list):
+        if requires_gpu == True:
+            lease = gpu_allocator.acquire(**gpu_requirements, timeout=gpu_wait_timeout)
+            if lease == None:
+                raise NoGPUAvailable(
+                    "No GPUs are available at the moment, please try again later"
+                )
+            gpu_name = lease.gpu
+            gpu_names = lease.gpus
+        else:
+            gpu_name = None
+            gpu_names = []
+
+        ## the whole batch runs on a single slot
+        state = block.acquire_state(gpu_name)
+
+        for config in configs:
+            config.gpu = gpu_name
+            config.gpus = gpu_names
+            config.state = state
+
+        try:
+            return block.__run__(configs)
+        finally:
+            block.release_state(gpu_name, state)
+            if requires_gpu == True:
+                gpu_allocator.release(lease)
+
+    if block.batch_size > 1:
+        batcher = Batcher(
+            fn=run_batch,
+            batch_size=block.batch_size,
+            max_wait_ms=block.max_wait_ms,
+            max_concurrent_batches=max_num_workers,
+        )
+        num_celery_threads = max_num_workers * block.batch_size
+    else:
+        batcher = None
+        num_celery_threads = max_num_workers
+
+    """
+    A task which could not get a GPU means that the replicas sharing the GPUs of this machine took all of them.
+    This worker then stops taking tasks off the queue until a task would fit again,
+    instead of picking up the task it just put back over and over
+    """
+    consumer_gate = ConsumerGate(queue_name=block.name)
+
+    def wait_until_gpus_are_free():
+        return gpu_allocator.wait_until_free(**gpu_requirements, timeout=gpu_wait_timeout)
+
+    def requeue(token: str, sequence: int):
+        """
+        no GPU got free in time for a task which a worker already picked up:
+        it goes back to where it was in the queue instead of being dropped
+        """
+        prometheus_metrics.running.dec(1)
+        prometheus_metrics.queued.inc(1)
+        prometheus_metrics.requeued.inc(1)
+
+        queue_data.requeue(token=token, sequence=sequence)
+        result_storage.publish_update(token=token, event="status")
+
+        consumer_gate.pause_until(wait_until_gpus_are_free)
+
+        ## the message is back on the queue already, this only lets celery know it's done with it
+        raise Reject(requeue=False)
+
+    def observe_latency(priority: str, enqueued_at: float):
+        """
+        time from /run until the job is done, per priority lane so that the tail latency of each one can be told apart
+        """
+        if enqueued_at is not None:
+            priority = priority if priority is not None else default_priority
+            prometheus_metrics.latency.labels(priority=priority).observe(
+                time.time() - enqueued_at
+            )
+
+    def run_in_batch(
+        args, raw_args, token: str, sequence: int, priority=None, enqueued_at=None
+    ):
+        """
+        Runs a task as a part of a batch, its progress, outputs and failures are still its own
+        """
+        args = ConfigWrapper(
+            data=args,
+            token=token,
+            result_storage=result_storage,
+            gpu=None,  ## provided by run_batch
+            progress=None,
+            lazy=block.lazy_inputs,
+        )
+        args.raw_data = raw_args
+
+        if block.progress == True:
+            args.progress = block.get_progress_bar(
+                token=token, result_storage=result_storage
+            )
+
+        try:
+            output = batcher.submit(args)
+
+            prometheus_metrics.running.dec(1)
+            prometheus_metrics.succeeded.inc(1)
+
+        except NoGPUAvailable:
+            requeue(token=token, sequence=sequence)
+
+        except Exception as e:
+            prometheus_metrics.running.dec(1)
+            prometheus_metrics.failed.inc(1)
+            observe_latency(priority=priority, enqueued_at=enqueued_at)
+            raise Exception(str(e))
+
+        finally:
+            if args.progress is not None:
+                args.progress.flush()
+
+        success = block.write_results(output=output, token=token)
+        observe_latency(priority=priority, enqueued_at=enqueued_at)
+
+        return success
+
     """ 
     define celery task
     """
 
     @celery_app.task(name="run")
-    def run(args, token: str):
+    def run(
+        args, token: str, sequence: int = None, priority=None, enqueued_at=None
+    ):
 
         ## job moves from queue to running
         prometheus_metrics.queued.dec(1)
         prometheus_metrics.running.inc(1)
 
-        args = data_decoder.decode(args)
+        ## the undecoded config lets config.refresh() skip decoding it again if it did not change
+        raw_args = args
+        args = data_decoder.decode(dict(args))
+
+        if batcher is not None:
+            return run_in_batch(
+                args=args,
+                raw_args=raw_args,
+                token=token,
+                sequence=sequence,
+                priority=priority,
+                enqueued_at=enqueued_at,
+            )
         """
-        allocating a GPU ID to the tast based on usage
-        for now let's settle for max 1 GPU per task :(
+        allocating GPUs to the task based on usage, block.num_gpus of them (1 by default)
         """
 
         if requires_gpu == True:
-            # returns None if there are no gpus available
-            gpu_name = gpu_allocator.get_gpu()
+            # waits for a while if they are all taken (i.e by the replicas sharing this machine), then returns None
+            lease = gpu_allocator.acquire(**gpu_requirements, timeout=gpu_wait_timeout)
+            gpu_name = lease.gpu if lease is not None else None
         else:
             gpu_name = None  ## default value either if there are no gpus available or requires_gpu = False
 
         """
-        If there are no GPUs available, then it returns a sad message.
+        If there are no GPUs available, then the task goes back to its place in the queue.
         But if there ARE GPUs available, then it starts run()
         """
         if (
             gpu_name == None and requires_gpu == True
         ):  ## making sure there are no gpus available
 
-            status = {
-                "status": "No GPUs are available at the moment, please try again later",
-            }
+            requeue(token=token, sequence=sequence)
 
         else:
 
@@ -262,10 +576,13 @@ def host_block(
                 result_storage=result_storage,
                 gpu=None,  ## will be provided later on in the run
                 progress=None,  ## will be provided later on in the run
+                lazy=block.lazy_inputs,
             )
+            args.raw_data = raw_args
 
             if requires_gpu == True:
                 args.gpu = gpu_name
+                args.gpus = lease.gpus
 
             if block.progress == True:
                 """
@@ -275,6 +592,9 @@ def host_block(
                     token=token, result_storage=result_storage
                 )
 
+            ## warm state from @block.setup of a free slot of this GPU (the first one with num_gpus > 1)
+            args.state = block.acquire_state(gpu_name)
+
             try:
                 output = block.__run__(args)
 
@@ -289,18 +609,73 @@ def host_block(
                 prometheus_metrics.running.dec(1)
                 prometheus_metrics.failed.inc(1)
                 if requires_gpu == True:
-                    gpu_allocator.set_as_free(name=gpu_name)
+                    gpu_allocator.release(lease)
+                observe_latency(priority=priority, enqueued_at=enqueued_at)
                 raise Exception(str(e))
 
+            finally:
+                block.release_state(gpu_name, args.state)
+
+                ## write whatever progress updates were held back
+                if args.progress is not None:
+                    args.progress.flush()
+
             if requires_gpu == True:
-                gpu_allocator.set_as_free(name=gpu_name)
+                gpu_allocator.release(lease)
 
             success = block.write_results(output=output, token=token)
+            observe_latency(priority=priority, enqueued_at=enqueued_at)
 
             return success  ## return None because results go to result_storage instead
 
+    """
+    keep eden's task states in sync with celery so that /fetch never has to scan celery's internals
+    """
+
+    @task_received.connect(weak=False)
+    def on_task_received(request, **kwargs):
+        """
+        a worker just picked up the task, so it's not in the queue anymore
+        """
+        queue_data.set_as_starting(token=request.id)
+        result_storage.publish_update(token=request.id, event="status")
+
+    @task_prerun.connect(weak=False)
+    def on_task_prerun(task_id, **kwargs):
+        queue_data.set_state(token=task_id, state="running")
+        result_storage.publish_update(token=task_id, event="status")
+
+    @task_postrun.connect(weak=False)
+    def on_task_postrun(task_id, state=None, **kwargs):
+        """
+        celery has stored the task meta by now, which takes over from here
+        """
+        if state == "REJECTED":
+            ## the task went back to the queue, see requeue()
+            return
+
+        queue_data.remove_state(token=task_id)
+        if result_retention is not None:
+            result_retention.set_as_completed(token=task_id)
+        result_storage.publish_update(token=task_id, event="status")
+
+    def respond(request: Request, response: dict):
+        """
+        Sends the response as msgpack if the client asked for it, else as json with any raw bytes as base64 text
+        """
+        if accepts_msgpack(request):
+            return MsgpackResponse(content=response)
+        return encode_bytes_as_text(response)
+
     @app.post("/run")
-    def start_run(config: block.data_model):
+    def start_run(config: block.data_model, request: Request, priority: str = None):
+        """
+        Queues a job, on the lane of its priority (default_priority if None)
+        """
+        try:
+            lane = queue_data.get_lane(priority)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         ## job moves into queue
         prometheus_metrics.queued.inc(1)
@@ -311,20 +686,55 @@ def host_block(
         """
         token = generate_random_string(len=10)
 
-        kwargs = dict(args=dict(config), token=token)
+        enqueued_at = time.time()
+        sequence = queue_data.add_to_queue_index(token=token, priority=priority)
+
+        ## the sequence number lets the task get its place in the queue back if it has to be requeued
+        kwargs = dict(
+            args=dict(config),
+            token=token,
+            sequence=sequence,
+            priority=queue_data.priority_lanes[lane],
+            enqueued_at=enqueued_at,
+        )
+
+        if result_cache is not None:
+            cache_key = result_cache.get_key(dict(config))
+            cached_token = result_cache.claim(key=cache_key, token=token)
+
+            if cached_token is not None:
+                ## nothing to run, the new token leaves the queue index before anyone gets to see it
+                queue_data.remove_from_queue_index(token=token)
+                queue_data.remove_state(token=token)
+                prometheus_metrics.queued.dec(1)
+                prometheus_metrics.cache_hits.inc(1)
 
-        res = run.apply_async(kwargs=kwargs, task_id=token, queue_name=block.name)
+                return respond(request, {"token": cached_token})
+
+            prometheus_metrics.cache_misses.inc(1)
+
+        res = run.apply_async(
+            kwargs=kwargs, task_id=token, queue_name=block.name, priority=lane
+        )
 
         initial_dict = {"config": dict(config), "output": {}, "progress": "__none__"}
 
-        success = result_storage.add(token=token, encoded_results=initial_dict)
+        if result_cache is not None:
+            ## lets /update stop sharing the results once the config changes
+            initial_dict["cache_key"] = cache_key
+
+        if result_retention is not None:
+            ## results of tasks which never complete (i.e lost along with their worker) are dropped eventually
+            result_retention.add(token=token, encoded_results=initial_dict)
+        else:
+            result_storage.add(token=token, encoded_results=initial_dict)
 
         response = {"token": token}
 
-        return response
+        return respond(request, response)
 
     @app.post("/update")
-    def update(credentials: Credentials, config: block.data_model):
+    def update(credentials: Credentials, config: block.data_model, request: Request):
 
         token = credentials.token
         config = dict(config)
@@ -339,12 +749,19 @@ def host_block(
                 or status["status"] == "starting"
             ):
 
-                output_from_storage = result_storage.get(token=token)
-                output_from_storage["config"] = config
+                if result_cache is not None and result_cache.forget(token=token) == False:
+                    ## other requests got the same token, their results would change along with the config
+                    return respond(
+                        request,
+                        {
+                            "status": {
+                                "status": "could not update config because its results are shared with identical jobs",
+                            }
+                        },
+                    )
 
-                success = result_storage.add(
-                    encoded_results=output_from_storage, token=token
-                )
+                ## only the config is replaced, so this can't race with the outputs or the progress being written
+                result_storage.set_fields(token=token, fields={"config": config})
 
                 response = {
                     "status": {
@@ -352,98 +769,311 @@ def host_block(
                     }
                 }
 
-                return response
+                return respond(request, response)
 
             elif status["status"] == "failed":
 
-                return {
-                    "status": {
-                        "status": "could not update config because job failed",
-                    }
-                }
+                return respond(
+                    request,
+                    {
+                        "status": {
+                            "status": "could not update config because job failed",
+                        }
+                    },
+                )
 
             elif status["status"] == "complete":
 
-                return {
-                    "status": {
-                        "status": "could not update config because job is already complete",
-                    }
-                }
+                return respond(
+                    request,
+                    {
+                        "status": {
+                            "status": "could not update config because job is already complete",
+                        }
+                    },
+                )
+
+            elif status["status"] == "expired":
+
+                return respond(
+                    request,
+                    {
+                        "status": {
+                            "status": "could not update config because job expired",
+                        }
+                    },
+                )
+
+            elif status["status"] == "revoked":
+
+                return respond(
+                    request,
+                    {
+                        "status": {
+                            "status": "could not update config because job was revoked",
+                        }
+                    },
+                )
+
+            else:
+                ## nothing to update, tell the client where the job is at
+                response = {"status": status}
 
         else:
             response = {"status": {"status": "invalid token"}}
+        return respond(request, response)
+
+    def build_fetch_response(
+        token, status, results, fields=["status", "config", "output"]
+    ):
+        """
+        Builds the response of /fetch from the status and the stored results of a task.
+
+        Args:
+            token (str): unique identifier for each task
+            status (dict): status of the task obtained from `eden.queue.QueueData`
+            results (dict or None): results stored on `eden.result_storage.ResultStorage`
+            fields (list, optional): keys to include in the response, the status is always included.
+        """
+
+        response = {"status": status}
+
+        if status["status"] in ["invalid token", "expired"]:
+            return response
+
+        if (
+            status["status"] == "complete"
+            and remove_result_on_fetch == True
+            and "output" in fields
+        ):
+            ## if results are deleted, it still returns the same schema
+            if results == None:
+                return {"status": {"status": "removed"}}
+            else:
+                result_storage.delete(token=token)
+                ## so that max_result_bytes does not count them anymore
+                if result_retention is not None:
+                    result_retention.forget([token])
+
+        if (
+            status["status"] in ["complete", "failed"]
+            and results is None
+            and remove_result_on_fetch == False
+            and ("config" in fields or "output" in fields)
+        ):
+            ## the results expired before celery's task meta did
+            return {"status": {"status": "expired"}}
+
+        """
+        results are None when only the status was requested
+        """
+        if results is not None:
+
+            if "config" in fields:
+                response["config"] = results["config"]
+
+            if status["status"] == "running" or status["status"] == "complete":
+                if "output" in fields:
+                    response["output"] = results["output"]
+
+            if (
+                status["status"] == "running"
+                and block.progress == True
+                and "progress" not in status
+            ):
+                ## the progress was never updated
+                response["status"]["progress"] = results["progress"]
+
         return response
 
+    """
+    statuses after which nothing changes for a task anymore
+    """
+    final_statuses = ["complete", "failed", "revoked", "invalid token", "expired"]
+
+    """
+    /fetch with wait and /stream are async, so that clients waiting on their tasks don't hold any of the threads
+    which serve the other requests. Only the reads from redis run on the threadpool
+    """
+
+    def get_status_and_results(token):
+        return run_in_threadpool(
+            queue_data.get_status_and_results,
+            token=token,
+            result_storage=result_storage,
+        )
+
     @app.post("/fetch")
-    def fetch(credentials: Credentials):
+    async def fetch(credentials: Credentials, request: Request, wait: float = 0):
         """
         Returns either the status of the task or the result depending on whether it's queued, running, complete or failed.
 
         Args:
             credentials (Credentials): should contain a token that points to a task
+            wait (float, optional): long-poll, if the task is not done yet then wait for upto `wait` seconds
+                (at most max_fetch_wait) for something to change before responding. Defaults to 0.
         """
 
         token = credentials.token
+        wait = min(wait, max_fetch_wait)
 
-        status = queue_data.get_status(token=token)
+        if wait > 0:
+            ## subscribe before checking the status so that no update gets missed
+            updates = await result_storage.subscribe_to_updates_async(token=token)
 
-        if status["status"] != "invalid token":
+        try:
+            """
+            status, config, outputs and progress are all obtained in a single round-trip to redis
+            """
+            status, results = await get_status_and_results(token)
 
-            if status["status"] == "running":
+            if wait > 0 and status["status"] not in final_statuses:
+                event = await result_storage.wait_for_update_async(
+                    pubsub=updates, timeout=wait
+                )
 
-                results = result_storage.get(token=token)
+                if event is not None:
+                    status, results = await get_status_and_results(token)
+        finally:
+            if wait > 0:
+                await updates.close()
 
-                response = {
-                    "status": status,
-                    "config": results["config"],
-                    "output": results["output"],
-                }
+        response = await run_in_threadpool(
+            build_fetch_response, token=token, status=status, results=results
+        )
+        return respond(request, response)
 
-                if block.progress == True:
-                    progress_value = fetch_progress_from_token(
-                        result_storage=result_storage, token=token
+    @app.get("/stream/{token}")
+    async def stream(token: str):
+        """
+        Streams the updates of a task as server-sent events until it's done.
+        Progress updates only contain the status, every other update has the same schema as /fetch.
+        Frames streamed with `block.write_frame()` are sent as 'frames' events with the status and only the new frames:
+        {'output': {name: {'data': packed frames, 'type': 'eden.datatypes.Video', 'first_frame': index of the first one}}}
+
+        Args:
+            token (str): unique identifier for each task
+        """
+
+        async def event_stream():
+            updates = await result_storage.subscribe_to_updates_async(token=token)
+
+            ## {name: number of frames already sent} for each output whose frames are being streamed
+            frames_sent = {}
+
+            try:
+                event = "status"
+
+                while True:
+                    if event.startswith("frames:"):
+                        name = event[len("frames:") :]
+                        start = frames_sent.get(name, 0)
+
+                        ((status, _),) = await run_in_threadpool(
+                            queue_data.get_status_and_results_many,
+                            tokens=[token],
+                            result_storage=result_storage,
+                            fields=["status"],
+                        )
+                        frames, num_frames = await run_in_threadpool(
+                            result_storage.get_frames, token, name, start
+                        )
+
+                        if status["status"] == "running" and num_frames > start:
+                            frames_sent[name] = num_frames
+                            response = {
+                                "status": status,
+                                "output": {
+                                    name: {
+                                        "data": frames,
+                                        "type": "eden.datatypes.Video",
+                                        "first_frame": start,
+                                    }
+                                },
+                            }
+                            yield f"event: frames\ndata: {json.dumps(encode_bytes_as_text(response))}\n\n"
+
+                            event = await result_storage.wait_for_update_async(
+                                pubsub=updates, timeout=stream_keep_alive_interval
+                            )
+                            if event is None:
+                                event = "progress"
+                            continue
+
+                        ## nothing new, or the task is not running anymore
+                        event = "progress"
+
+                    status, results = await get_status_and_results(token)
+
+                    if event == "progress" and status["status"] not in final_statuses:
+                        fields = ["status"]
+                    else:
+                        fields = ["status", "config", "output"]
+
+                    response = await run_in_threadpool(
+                        build_fetch_response,
+                        token=token,
+                        status=status,
+                        results=results,
+                        fields=fields,
                     )
-                    response["status"]["progress"] = progress_value
 
-            elif status["status"] == "complete":
+                    ## streamed frames which were sent in full don't have to be sent again
+                    for name, value in response.get("output", {}).items():
+                        if (
+                            isinstance(value, dict)
+                            and value.get("type") == "eden.datatypes.Video"
+                            and isinstance(value.get("data"), bytes)
+                            and get_video_format(value["data"]) == "frames"
+                        ):
+                            frames_sent[name] = len(unpack_frames(value["data"])[1])
 
-                results = result_storage.get(token=token)
-                    
-                ## if results are deleted, it still returns the same schema
-                if results == None and remove_result_on_fetch == True:
-                    response = {
-                        "status": {
-                            "status": "removed"
-                        },
-                    }
-                else:
-                    response = {
-                        "status": status,
-                        "config": results["config"],
-                        "output": results["output"],
-                    }
+                    yield f"event: {event}\ndata: {json.dumps(encode_bytes_as_text(response))}\n\n"
 
+                    if response["status"]["status"] in final_statuses + ["removed"]:
+                        break
 
+                    event = await result_storage.wait_for_update_async(
+                        pubsub=updates, timeout=stream_keep_alive_interval
+                    )
 
-                if remove_result_on_fetch == True:
-                    result_storage.delete(token=token)
+                    if event is None:
+                        ## nothing happened for a while, re-check the status in case an update got lost
+                        event = "progress"
+            finally:
+                await updates.close()
 
-            elif (
-                status["status"] == "queued"
-                or status["status"] == "starting"
-                or status["status"] == "failed"
-                or status["status"] == "revoked"
-            ):
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
 
-                results = result_storage.get(token=token)
+    @app.post("/fetch_many")
+    def fetch_many(fetch_many_request: FetchMany, request: Request):
+        """
+        Same as /fetch, but for many tokens at once. All of the statuses and results
+        are obtained in a single round-trip to redis.
+
+        Args:
+            fetch_many_request (FetchMany): tokens to fetch, and the fields to include for each of them.
+                Use fields = ['status'] to skip reading the config and outputs altogether.
+        """
 
-                response = {"status": status, "config": results["config"]}
+        tokens = fetch_many_request.tokens
+        fields = fetch_many_request.fields
 
-        else:
+        """
+        only the parts of the results that were asked for are read from redis
+        """
+        statuses_and_results = queue_data.get_status_and_results_many(
+            tokens=tokens, result_storage=result_storage, fields=fields
+        )
 
-            response = {"status": status}  ## invalid token
+        response = {"results": {}}
 
-        return response
+        for token, (status, results) in zip(tokens, statuses_and_results):
+            response["results"][token] = build_fetch_response(
+                token=token, status=status, results=results, fields=fields
+            )
+
+        return respond(request, response)
 
     @app.post("/stop")
     async def stop(wait_for: WaitFor):
@@ -474,6 +1104,32 @@ def host_block(
         return response
 
 
+    """
+    run @block.setup once for each worker slot of each GPU before any task is accepted,
+    its time is reported on its own metric instead of adding up to the first tasks.
+    there are as many slots on a GPU as tasks (or batches) which can run on it at the same time
+    """
+    if requires_gpu == True:
+        setup_times = block.run_setup(
+            gpus=gpu_allocator.gpu_names,
+            num_slots={
+                gpu: min(
+                    gpu_allocator.get_gpu_capacity(
+                        gpu, memory_mb=block.gpu_memory_mb, fraction=block.gpu_fraction
+                    ),
+                    max_num_workers,
+                )
+                for gpu in gpu_allocator.gpu_names
+            },
+        )
+    else:
+        setup_times = block.run_setup(gpus=[None], num_slots=max_num_workers)
+
+    for gpu, setup_time in setup_times.items():
+        device = gpu if gpu is not None else "cpu"
+        prometheus_metrics.setup_time.labels(gpu=device).set(setup_time)
+        print(PREFIX + f" Setup done on: {device} in {setup_time:.2f}s")
+
     ## overriding the boring old [INFO] thingy
     LOGGING_CONFIG["formatters"]["default"]["fmt"] = (
         "[" + Colors.CYAN + "EDEN" + Colors.END + "] %(asctime)s %(message)s"
@@ -500,7 +1156,7 @@ def host_block(
         ## starts celery app
         run_celery_app(
             celery_app,
-            max_num_workers=max_num_workers,
+            max_num_workers=num_celery_threads,
             loglevel=celery_log_levels[log_level],
             logfile=logfile,
             queue_name=block.name,
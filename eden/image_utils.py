@@ -7,7 +7,55 @@ from PIL import Image
 from io import BytesIO
 
 
-def _encode_numpy_array_image(image):
+"""
+defaults for each format, jpg and png have the same defaults as cv2.imencode, which was used for everything before
+"""
+JPEG_QUALITY = 95
+PNG_COMPRESS_LEVEL = 1
+WEBP_QUALITY = 90
+WEBP_METHOD = 4
+
+"""
+format picked by each policy when no format is given, as (for RGB images, for RGBA images)
+* fastest: fastest to encode (and decode), this is the default
+* smallest: smallest payloads, webp is usually less than half the size of a jpg at about the same quality
+"""
+POLICIES = {
+    "fastest": ("jpeg", "png"),
+    "smallest": ("webp", "webp"),
+}
+
+FORMAT_ALIASES = {"jpg": "jpeg", "jpeg": "jpeg", "png": "png", "webp": "webp"}
+
+
+def resolve_format(format=None, policy=None, has_alpha=False):
+    """
+    Decides which format an image should be encoded into
+
+    Args:
+        format (str, optional): 'jpeg', 'png' or 'webp', overrides the policy. Defaults to None.
+        policy (str, optional): 'fastest' or 'smallest', see POLICIES. Defaults to 'fastest'.
+        has_alpha (bool, optional): True if the image has an alpha channel. Defaults to False.
+    """
+    if format is not None:
+        if format.lower() not in FORMAT_ALIASES:
+            raise Exception(
+                f"expected format to be one of {list(FORMAT_ALIASES.keys())}, not: {format}"
+            )
+        return FORMAT_ALIASES[format.lower()]
+
+    if policy is None:
+        policy = "fastest"
+
+    if policy not in POLICIES:
+        raise Exception(
+            f"expected policy to be one of {list(POLICIES.keys())}, not: {policy}"
+        )
+
+    return POLICIES[policy][1 if has_alpha == True else 0]
+
+
+def _encode_numpy_array_image_with_cv2(image):
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
     if image.shape[-1] == 3:
@@ -16,25 +64,173 @@ def _encode_numpy_array_image(image):
     elif image.shape[-1] == 4:
         _, buffer = cv2.imencode(".png", image)
 
-    image_as_text = base64.b64encode(buffer)
+    return buffer.tobytes()
+
+
+def _encode_numpy_array_image(
+    image, format=None, quality=None, compress_level=None, policy=None
+):
+    """
+    expects RGB(A) arrays, like the ones obtained from np.array(pil_image)
+    """
+    if image.dtype != np.uint8 or image.ndim not in [2, 3] or (
+        image.ndim == 3 and image.shape[-1] not in [3, 4]
+    ):
+        return _encode_numpy_array_image_with_cv2(image)
+
+    has_alpha = image.ndim == 3 and image.shape[-1] == 4
+    format = resolve_format(format=format, policy=policy, has_alpha=has_alpha)
+
+    if format == "png":
+        return _encode_png(image, compress_level=compress_level)
+
+    ## no-op for C-contiguous arrays, frombuffer then wraps the array's memory without copying it
+    image = np.ascontiguousarray(image)
+
+    if image.ndim == 2:
+        mode = "L"
+    elif has_alpha == True:
+        mode = "RGBA"
+    else:
+        mode = "RGB"
+
+    pil_image = Image.frombuffer(
+        mode, (image.shape[1], image.shape[0]), image, "raw", mode, 0, 1
+    )
+
+    return _encode_pil_image(
+        pil_image, format=format, quality=quality, compress_level=compress_level
+    )
+
+
+def _encode_png(image, compress_level=None):
+    """
+    cv2's png encoder is a lot faster than PIL's, so it's worth the channel swap
+    """
+    if compress_level is None:
+        compress_level = PNG_COMPRESS_LEVEL
+
+    if image.ndim == 3 and image.shape[-1] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+    elif image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    _, buffer = cv2.imencode(
+        ".png", image, [cv2.IMWRITE_PNG_COMPRESSION, compress_level]
+    )
+    return buffer.tobytes()
+
+
+def _encode_pil_image(
+    image, format=None, quality=None, compress_level=None, policy=None
+):
+    """
+    jpg and webp are encoded by PIL directly, png by cv2
+
+    compress_level is the zlib level (0-9) for png and the method (0-6) for webp, higher is smaller but slower
+    """
+    if image.mode not in ["RGB", "RGBA"]:
+        if image.mode in ["LA", "PA"] or "transparency" in image.info:
+            image = image.convert("RGBA")
+        else:
+            image = image.convert("RGB")
+
+    format = resolve_format(format=format, policy=policy, has_alpha=image.mode == "RGBA")
+
+    if format == "png":
+        return _encode_png(np.asarray(image), compress_level=compress_level)
+
+    buffer = BytesIO()
+
+    if format == "webp":
+        image.save(
+            buffer,
+            format="WEBP",
+            quality=quality if quality is not None else WEBP_QUALITY,
+            method=compress_level if compress_level is not None else WEBP_METHOD,
+        )
+    else:
+        if image.mode == "RGBA":
+            ## jpg has no alpha channel
+            image = image.convert("RGB")
+        image.save(
+            buffer,
+            format="JPEG",
+            quality=quality if quality is not None else JPEG_QUALITY,
+        )
+
+    return buffer.getvalue()
 
-    return image_as_text
 
+def _encode_image_file(
+    image, format=None, quality=None, compress_level=None, policy=None
+):
+    ## only reads the header, pixels are decoded only if they need to be re-encoded
+    with Image.open(image) as pil_image:
 
-def _encode_pil_image(image):
-    opencv_image = np.array(image)
-    image_as_text = _encode_numpy_array_image(image=opencv_image)
+        target_format = resolve_format(
+            format=format, policy=policy, has_alpha=pil_image.mode == "RGBA"
+        )
 
-    return image_as_text
+        if _can_pass_through(pil_image, target_format, quality, compress_level):
+            ## already in the format it would've been encoded into, so the file is sent as it is
+            with open(image, "rb") as f:
+                return f.read()
 
+        return _encode_pil_image(
+            pil_image, format=target_format, quality=quality, compress_level=compress_level
+        )
 
-def _encode_image_file(image):
-    pil_image = Image.open(image)
 
-    return _encode_pil_image(pil_image)
+def _encode_lazy_image(
+    image, format=None, quality=None, compress_level=None, policy=None
+):
+    """
+    images received from a client/host are sent back without decoding them, if they're in the right format
+    """
+    target_format = resolve_format(
+        format=format, policy=policy, has_alpha=image.mode == "RGBA"
+    )
 
+    if _can_pass_through(image, target_format, quality, compress_level):
+        return image.as_bytes()
 
-def encode(image):
+    return _encode_pil_image(
+        image.as_pil(), format=target_format, quality=quality, compress_level=compress_level
+    )
+
+
+def _can_pass_through(image, target_format, quality, compress_level):
+    """
+    True if an encoded image is already what it would be encoded into
+    """
+    return (
+        quality is None
+        and compress_level is None
+        and image.mode in ["RGB", "RGBA"]
+        and image.format is not None
+        and image.format.lower() == target_format
+        and not (target_format == "jpeg" and image.mode == "RGBA")
+    )
+
+
+def encode_to_bytes(image, format=None, quality=None, compress_level=None, policy=None):
+    """
+    Encodes an image into raw bytes, by default jpg (or png if it has an alpha channel)
+
+    Args:
+        image (numpy.array or PIL.Image or LazyImage or str): image, or the filename of an image
+        format (str, optional): 'jpeg', 'png' or 'webp'. Defaults to None, which lets the policy decide.
+        quality (int, optional): 0-100 for jpeg and webp. Defaults to None.
+        compress_level (int, optional): 0-9 for png, the method (0-6) for webp. Defaults to None.
+        policy (str, optional): 'fastest' or 'smallest', used only when format is None. Defaults to 'fastest'.
+    """
+    options = dict(
+        format=format, quality=quality, compress_level=compress_level, policy=policy
+    )
+
+    if isinstance(image, LazyImage):
+        return _encode_lazy_image(image, **options)
 
     if (
         type(image) == np.ndarray
@@ -50,15 +246,15 @@ def encode(image):
     ):
 
         if type(image) == np.ndarray:
-            image_as_text = _encode_numpy_array_image(image)
+            image_bytes = _encode_numpy_array_image(image, **options)
 
         elif type(image) == str:
-            image_as_text = _encode_image_file(image)
+            image_bytes = _encode_image_file(image, **options)
 
         else:
-            image_as_text = _encode_pil_image(image)
+            image_bytes = _encode_pil_image(image, **options)
 
-        return image_as_text.decode("ascii")
+        return image_bytes
 
     else:
         raise Exception(
@@ -66,8 +262,162 @@ def encode(image):
         )
 
 
+def get_num_pixels(image):
+    """
+    Number of pixels of a numpy/PIL image, 0 for filenames and LazyImages since they're usually passed through without encoding
+    """
+    if type(image) == np.ndarray:
+        return image.shape[0] * image.shape[1]
+    elif isinstance(image, PIL.Image.Image):
+        return image.size[0] * image.size[1]
+    return 0
+
+
+def encode(image, **kwargs):
+    """
+    Encodes an image into base64 text, for json. Takes the same kwargs as `encode_to_bytes()`
+    """
+    return bytes_to_text(encode_to_bytes(image, **kwargs))
+
+
+def bytes_to_text(image_bytes):
+    return base64.b64encode(image_bytes).decode("ascii")
+
+
+def text_to_bytes(image_as_text):
+    return base64.b64decode(image_as_text)
+
+
 def decode(jpg_as_text):
+    """
+    Decodes either raw image bytes (binary transport) or base64 text (json) into a PIL image
+    """
     if jpg_as_text is None:
         return None
-    pil_image = Image.open(BytesIO(base64.b64decode(jpg_as_text)))
+
+    if isinstance(jpg_as_text, str):
+        image_bytes = text_to_bytes(jpg_as_text)
+    else:
+        image_bytes = jpg_as_text
+
+    pil_image = Image.open(BytesIO(image_bytes))
     return pil_image
+
+
+def get_format(image_bytes):
+    """
+    Reads the format of encoded image bytes from their first few bytes, without decoding anything
+
+    Returns:
+        str or None: 'JPEG', 'PNG' or 'WEBP' (same names as PIL.Image.format), None if it's something else
+    """
+    if image_bytes[:3] == b"\xff\xd8\xff":
+        return "JPEG"
+    elif image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    elif image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+class LazyImage(object):
+    """
+    Image received from an eden client/host, which is decoded only when (and if) it's used.
+
+    * `as_bytes()`: the encoded bytes, nothing is decoded
+    * `as_pil()`: PIL image, decoded once and cached
+    * `as_numpy()`: contiguous uint8 RGB(A) array (like np.array(pil_image)) decoded with cv2.imdecode, cached
+
+    Everything else (like `.size` or `.resize()`) is forwarded to the PIL image, so it can be used like one.
+    Two LazyImages are equal if their encoded bytes are equal.
+
+    Args:
+        data (bytes or str): encoded image, either raw bytes or base64 text
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._image_bytes = None
+        self._pil_image = None
+        self._numpy_image = None
+
+    def as_bytes(self):
+        if self._image_bytes is None:
+            if isinstance(self._data, str):
+                self._image_bytes = text_to_bytes(self._data)
+            else:
+                self._image_bytes = bytes(self._data)
+            self._data = None
+        return self._image_bytes
+
+    def as_pil(self):
+        if self._pil_image is None:
+            self._pil_image = Image.open(BytesIO(self.as_bytes()))
+        return self._pil_image
+
+    def as_numpy(self):
+        if self._numpy_image is None:
+            image = cv2.imdecode(
+                np.frombuffer(self.as_bytes(), dtype=np.uint8), cv2.IMREAD_UNCHANGED
+            )
+
+            if image.ndim == 3 and image.shape[-1] == 4:
+                image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+            elif image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+            self._numpy_image = image
+        return self._numpy_image
+
+    @property
+    def format(self):
+        format = get_format(self.as_bytes())
+        if format is None:
+            format = self.as_pil().format
+        return format
+
+    def save(self, fp, format=None, **params):
+        """
+        Same as PIL.Image.save(), but if the image is already in the format it's being saved as,
+        the encoded bytes are written as they are
+        """
+        if format is None and isinstance(fp, str):
+            format = Image.registered_extensions().get(
+                "." + fp.rsplit(".", 1)[-1].lower()
+            )
+
+        if (
+            len(params) == 0
+            and format is not None
+            and format.upper() == self.format
+        ):
+            if isinstance(fp, str):
+                with open(fp, "wb") as f:
+                    f.write(self.as_bytes())
+            else:
+                fp.write(self.as_bytes())
+        else:
+            self.as_pil().save(fp, format=format, **params)
+
+    def __array__(self, dtype=None, copy=None):
+        ## the decoded array is cached for every reader of this image, so it's shared only if numpy asked for no copy
+        image = self.as_numpy()
+        if dtype is not None:
+            return image.astype(dtype, copy=copy is not False)
+        if copy is False:
+            return image
+        return image.copy()
+
+    def __getattr__(self, name):
+        ## only called for attributes that LazyImage does not have
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.as_pil(), name)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyImage):
+            return self.as_bytes() == other.as_bytes()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"<eden LazyImage format={self.format} bytes={len(self.as_bytes())}>"
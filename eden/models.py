@@ -1,9 +1,29 @@
-from pydantic import BaseModel
+from typing import List
+from pydantic import BaseModel, validator
+
+"""
+max number of tokens of a single /fetch_many request, the host reads all of them in one lua script which blocks redis while it runs.
+clients send more tokens than this in several requests
+"""
+MAX_FETCH_MANY_TOKENS = 1000
 
 
 class Credentials(BaseModel):
     token: str
 
 
+class FetchMany(BaseModel):
+    tokens: List[str]
+    fields: List[str] = ["status", "config", "output"]
+
+    @validator("tokens")
+    def check_num_tokens(cls, tokens):
+        if len(tokens) > MAX_FETCH_MANY_TOKENS:
+            raise ValueError(
+                f"at most {MAX_FETCH_MANY_TOKENS} tokens can be fetched at once, got {len(tokens)}"
+            )
+        return tokens
+
+
 class WaitFor(BaseModel):
     seconds: int = 5
@@ -0,0 +1,74 @@
+import msgpack
+from typing import Callable
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+"""
+Binary transport for eden's HTTP endpoints.
+
+Clients which send `Content-Type: application/msgpack` get their request bodies parsed as msgpack,
+and clients which send `Accept: application/msgpack` get msgpack responses.
+This way images travel as raw bytes instead of base64 text, everyone else keeps using json.
+"""
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def packb(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpackb(data_bytes, ext_hook=None):
+    if ext_hook is None:
+        return msgpack.unpackb(data_bytes, raw=False)
+    return msgpack.unpackb(data_bytes, raw=False, ext_hook=ext_hook)
+
+
+def accepts_msgpack(request: Request):
+    """
+    Returns True if the client asked for msgpack responses
+    """
+    return MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+class MsgpackRequest(Request):
+    """
+    fastAPI only parses json bodies into pydantic models, so the msgpack body is
+    handed over to it as if it were already parsed json
+    """
+
+    def __init__(self, scope, receive):
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"] if name != b"content-type"
+        ] + [(b"content-type", b"application/json")]
+
+        super().__init__(scope, receive)
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = unpackb(await self.body())
+        return self._json
+
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content) -> bytes:
+        return packb(content)
+
+
+class MsgpackRoute(APIRoute):
+    """
+    Route class which accepts msgpack request bodies along with json.
+    Use it with `app.router.route_class = MsgpackRoute` before defining any routes.
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if request.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+                request = MsgpackRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return route_handler
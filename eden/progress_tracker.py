@@ -1,27 +1,68 @@
+import time
 from tqdm import tqdm
 from .result_storage import ResultStorage
 
 
 class ProgressTracker:
-    def __init__(self, token: str, result_storage: ResultStorage):
+    """
+    Keeps track of the progress of a task, available as `config.progress` within `eden.block.Block.run()`
+
+    Updates are coalesced: all of the calls to `update()` within `min_update_interval` seconds
+    end up as a single write to redis. Whatever is left gets written with `flush()` at the end of the task.
+
+    Args:
+        token (str): unique identifier for each task
+        result_storage (ResultStorage): where the progress gets stored
+        min_update_interval (float, optional): min number of seconds between two writes to redis. Defaults to 0.5.
+    """
+
+    def __init__(
+        self, token: str, result_storage: ResultStorage, min_update_interval=0.5
+    ):
         self.value = 0.0
         self.token = token
         self.result_storage = result_storage
+        self.min_update_interval = min_update_interval
+
+        self.unwritten_value = 0.0
+        self.last_write_time = None
 
     def update(self, n):
 
         self.value += n
+        self.unwritten_value += n
+
+        if (
+            self.last_write_time is None
+            or time.time() - self.last_write_time >= self.min_update_interval
+        ):
+            return self.flush()
 
-        output_from_storage = self.result_storage.get(token=self.token)
-        output_from_storage["progress"] = self.value
+        return None
 
-        success = self.result_storage.add(
-            encoded_results=output_from_storage, token=self.token
+    def flush(self):
+        """
+        Writes the progress which has not been written to redis yet
+        """
+        self.last_write_time = time.time()
+
+        if self.unwritten_value == 0.0:
+            return None
+
+        success = self.result_storage.increment_progress(
+            token=self.token, amount=self.unwritten_value
         )
+        self.unwritten_value = 0.0
+        self.result_storage.publish_update(token=self.token, event="progress")
 
         return success
 
 
 def fetch_progress_from_token(result_storage: ResultStorage, token: str):
-    progress_value = result_storage.get(token=token)["progress"]
+    progress_value = result_storage.get_progress(token=token)
+
+    if progress_value is None:
+        ## the progress was never updated, or the results are gone (i.e expired)
+        progress_value = 0.0
+
     return progress_value
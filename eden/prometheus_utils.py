@@ -1,4 +1,4 @@
-from prometheus_client import Gauge
+from prometheus_client import Gauge, Counter, Histogram
 
 
 class PrometheusMetrics:
@@ -19,6 +19,17 @@ class PrometheusMetrics:
     pm.running.inc(4) ## defaults to 1, can also use dec
     pm.failed.inc(3) ## defaults to 1, can also use dec
     pm.succeeded.inc(5) ## defaults to 1, can also use dec
+
+    pm.result_bytes.set(1024) ## bytes taken by the results of completed jobs
+    pm.reclaimed_bytes.inc(512) ## counters can only go up
+    pm.expired.inc(2)
+    pm.cache_hits.inc(1)
+    pm.cache_misses.inc(1)
+    pm.requeued.inc(1)
+
+    pm.setup_time.labels(gpu="cuda:0").set(12.5) ## seconds taken by @block.setup on each GPU
+    pm.promoted.inc(1)
+    pm.latency.labels(priority="high").observe(3.2) ## seconds from /run until the job is done, per priority lane
     ```
     """
 
@@ -29,8 +40,22 @@ class PrometheusMetrics:
             "num_running_jobs": "number of running jobs",
             "num_failed_jobs": "number of failed jobs",
             "num_succeeded_jobs": "number of succeeded jobs",
+            "result_bytes": "number of bytes taken on redis by the results of completed jobs",
+            "result_bytes_reclaimed": "number of bytes reclaimed by evicting results",
+            "num_expired_results": "number of results evicted after their TTL or to fit in the memory budget",
+            "num_cache_hits": "number of requests which got the token of an identical task (complete or still running)",
+            "num_cache_misses": "number of cacheable requests which had to be queued",
+            "block_setup_seconds": "number of seconds taken by the setup of the block on each GPU, before accepting any task",
+            "num_requeued_jobs": "number of jobs which went back to the queue because no GPU got free in time",
+            "num_promoted_jobs": "number of jobs which waited too long on their priority lane and were moved to the first one",
+            "job_latency_seconds": "number of seconds from /run until the job is done (or failed), for each priority",
         }
 
+        """
+        buckets of job_latency_seconds, from interactive jobs to long batch jobs
+        """
+        self.latency_buckets = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
         self.names = list(self.name_description_mapping.keys())
 
         """
@@ -48,3 +73,36 @@ class PrometheusMetrics:
         self.succeeded = Gauge(
             "num_succeeded_jobs", self.name_description_mapping["num_succeeded_jobs"]
         )
+        self.result_bytes = Gauge(
+            "result_bytes", self.name_description_mapping["result_bytes"]
+        )
+        self.reclaimed_bytes = Counter(
+            "result_bytes_reclaimed",
+            self.name_description_mapping["result_bytes_reclaimed"],
+        )
+        self.expired = Counter(
+            "num_expired_results", self.name_description_mapping["num_expired_results"]
+        )
+        self.cache_hits = Counter(
+            "num_cache_hits", self.name_description_mapping["num_cache_hits"]
+        )
+        self.cache_misses = Counter(
+            "num_cache_misses", self.name_description_mapping["num_cache_misses"]
+        )
+        self.setup_time = Gauge(
+            "block_setup_seconds",
+            self.name_description_mapping["block_setup_seconds"],
+            ["gpu"],
+        )
+        self.requeued = Counter(
+            "num_requeued_jobs", self.name_description_mapping["num_requeued_jobs"]
+        )
+        self.promoted = Counter(
+            "num_promoted_jobs", self.name_description_mapping["num_promoted_jobs"]
+        )
+        self.latency = Histogram(
+            "job_latency_seconds",
+            self.name_description_mapping["job_latency_seconds"],
+            ["priority"],
+            buckets=self.latency_buckets,
+        )
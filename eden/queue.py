@@ -2,6 +2,7 @@ import os
 import time
 import json
 from .log_utils import Colors
+from .result_storage import READ_RECORD_LUA
 import warnings
 
 """
@@ -9,6 +10,122 @@ redis stuff so that different eden replicas can stay in sync
 """
 from redis import Redis
 
+"""
+Fetches everything /fetch needs for a list of tokens in a single round-trip:
+queue rank, celery's task meta, eden's own task state (or 'expired' if its results were evicted)
+and optionally the stored results (see eden.result_storage).
+Only the fields which are needed get read, outputs are never read for queued tasks.
+Since the script runs atomically, all of the tokens see the same snapshot of the queue.
+
+KEYS: [queue index, task states, expired tokens, celery task meta for each token..., results for each token...]
+ARGV: [result storage db, queue db, '1' to read results else '0', '1' to read configs, '1' to read outputs, tokens...]
+
+note: lua tables get truncated at the first nil, so missing values are returned as false (nil on the python side)
+"""
+FETCH_SCRIPT = (
+    READ_RECORD_LUA
+    + """
+local num_tokens = #ARGV - 5
+local reply = {}
+for i = 1, num_tokens do
+    local token = ARGV[5 + i]
+    local rank = redis.call('ZRANK', KEYS[1], token)
+    local meta = false
+    local state = false
+    if not rank then
+        meta = redis.call('GET', KEYS[3 + i])
+        if not meta then
+            state = redis.call('HGET', KEYS[2], token)
+            if not state and redis.call('ZSCORE', KEYS[3], token) then
+                state = 'expired'
+            end
+        end
+    end
+    reply[4 * i - 3] = rank
+    reply[4 * i - 2] = meta
+    reply[4 * i - 1] = state
+    reply[4 * i] = false
+end
+if ARGV[3] == '1' then
+    redis.call('SELECT', ARGV[1])
+    for i = 1, num_tokens do
+        local read_output = ARGV[5]
+        if reply[4 * i - 3] then
+            read_output = '0'
+        end
+        reply[4 * i] = read_record(KEYS[3 + num_tokens + i], ARGV[4], read_output)
+    end
+    redis.call('SELECT', ARGV[2])
+end
+return reply
+"""
+)
+
+"""
+Celery's redis transport keeps each priority of a queue on its own list, named '{queue}{separator}{priority}'
+(just '{queue}' for priority 0) and workers pop from the lowest priority number first.
+Each lane of QueueData is one of these priorities, the first lane being the most urgent.
+"""
+LANE_SEPARATOR = "\x06\x16"
+
+"""
+Score of a queued token on the queue index: lane * LANE_SIZE + sequence number.
+Workers drain the lanes in order and each lane in the order it was filled,
+so the rank of a token on the queue index is its real position across all of the lanes
+"""
+LANE_SIZE = 10**12
+
+"""
+Moves the jobs which waited too long on a lane to the back of the first lane, so that they're never starved by a busy lane ahead of them.
+Jobs leave each lane from its right end (the oldest one), so only the right end of each lane has to be looked at.
+A job which was not enqueued by add_to_queue_index (i.e by an older eden replica) can't tell how long it waited,
+it's moved right away so that it never holds up the ones behind it.
+The priority of the message is rewritten in place (the rest of it is left as it is) so that the transport
+restores it on the first lane, and not on the one it came from, if its worker goes away before acking it.
+
+KEYS: [queue index, enqueued tokens, queue counter, lanes...]
+ARGV: [current time, max number of seconds to wait on each lane but the first one (negative for no limit)...]
+
+Returns the number of jobs which were moved
+"""
+PROMOTE_SCRIPT = """
+local num_moved = 0
+for lane = 2, #KEYS - 3 do
+    local max_wait = tonumber(ARGV[lane])
+    while max_wait >= 0 do
+        local message = redis.call('LINDEX', KEYS[3 + lane], -1)
+        if not message then
+            break
+        end
+        local token = cjson.decode(message)['headers']['id']
+        local entry = redis.call('HGET', KEYS[2], token)
+        local enqueued_at = nil
+        if entry then
+            enqueued_at = string.sub(entry, string.find(entry, '|', 1, true) + 1)
+            if tonumber(ARGV[1]) - tonumber(enqueued_at) < max_wait then
+                break
+            end
+        end
+        redis.call('RPOP', KEYS[3 + lane])
+        local properties_at = string.find(message, '"properties":', 1, true)
+        if properties_at then
+            local properties = string.gsub(string.sub(message, properties_at), '"priority":%s*%d+', '"priority": 0', 1)
+            message = string.sub(message, 1, properties_at - 1) .. properties
+        end
+        redis.call('LPUSH', KEYS[4], message)
+        local score = redis.call('INCR', KEYS[3])
+        if entry then
+            redis.call('ZADD', KEYS[1], score, token)
+            redis.call('HSET', KEYS[2], token, score .. '|' .. enqueued_at)
+        else
+            redis.call('ZADD', KEYS[1], 'XX', score, token)
+        end
+        num_moved = num_moved + 1
+    end
+end
+return num_moved
+"""
+
 
 class QueueData(object):
     """
@@ -17,14 +134,26 @@ class QueueData(object):
 
     """
 
-    def __init__(self, redis_port: int, redis_host: str, queue_name: str, redis_db=0):
+    def __init__(
+        self,
+        redis_port: int,
+        redis_host: str,
+        queue_name: str,
+        redis_db=0,
+        priority_lanes: list = None,
+        default_priority: str = None,
+    ):
 
         """
         to wipe all redis stuff, use:
         $ redis-cli flushall
+
+        priority_lanes is the list of priorities of the jobs, most urgent first, like ['high', 'normal', 'low'].
+        Jobs get default_priority (the first one if None) unless they ask for another one.
         """
 
         self.redis = Redis(host=redis_host, port=str(redis_port), db=redis_db)
+        self.redis_db = redis_db
 
         self.queue = []  ## used to find position on the queue
 
@@ -38,22 +167,227 @@ class QueueData(object):
 
         self.queue_name = queue_name
 
+        """
+        sorted set which maps each queued token to the order in which it was enqueued.
+        Celery's own list can only be scanned from end to end, so we keep our own index
+        which makes queue position lookups O(log N) instead of O(queue length)
+        """
+        self.queue_index_name = queue_name + "-queue-index"
+        self.queue_counter_name = queue_name + "-queue-counter"
+
+        """
+        hash which maps each token to its state until celery writes its own task meta.
+        it lets us tell if a job is 'starting' without having to decode celery's 'unacked' hash
+        """
+        self.states_name = queue_name + "-states"
+
+        """
+        sorted set which maps the tokens whose results were evicted (see eden.retention) to when they were evicted,
+        so that they can be told apart from tokens which never existed
+        """
+        self.expired_name = queue_name + "-expired"
+
+        """
+        priority lanes, each one is a list of celery's messages.
+        with a single lane everything goes on celery's own queue, like it always did
+        """
+        self.priority_lanes = (
+            list(priority_lanes) if priority_lanes is not None else ["normal"]
+        )
+        self.default_priority = (
+            default_priority if default_priority is not None else self.priority_lanes[0]
+        )
+        self.lane_names = [queue_name] + [
+            queue_name + LANE_SEPARATOR + str(lane)
+            for lane in range(1, len(self.priority_lanes))
+        ]
+
+        """
+        hash which maps each token to '{score on the queue index}|{time it was enqueued at}',
+        so that a requeued task gets its place back and starved tasks can be found
+        """
+        self.enqueued_name = queue_name + "-enqueued"
+
+        self.fetch_script = self.redis.register_script(FETCH_SCRIPT)
+        self.promote_script = self.redis.register_script(PROMOTE_SCRIPT)
+
+    def get_lane(self, priority: str = None):
+        """Finds the lane of a priority.
+
+        Args:
+            priority (str, optional): one of priority_lanes. Defaults to None (default_priority).
+
+        Raises:
+            ValueError: if it's not one of priority_lanes
+
+        Returns:
+            int: index of the lane, 0 is the most urgent one
+        """
+        if priority is None:
+            priority = self.default_priority
+
+        if priority not in self.priority_lanes:
+            raise ValueError(
+                f"invalid priority: {priority}, should be one of {self.priority_lanes}"
+            )
+
+        return self.priority_lanes.index(priority)
+
+    def add_to_queue_index(self, token, priority: str = None):
+        """Registers a token on the queue index. Should be called right before the
+        task is sent to celery (with priority = `get_lane(priority)`) so that the token is never in the queue without being indexed.
+
+        Args:
+            token (str): unique identifier for each task
+            priority (str, optional): one of priority_lanes. Defaults to None (default_priority).
+
+        Returns:
+            int: sequence number of the token, increases with each enqueued task and sorts the lanes in order
+        """
+        lane = self.get_lane(priority)
+        sequence = lane * LANE_SIZE + self.redis.incr(self.queue_counter_name)
+
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.queue_index_name, {token: sequence})
+        pipe.hset(self.states_name, token, "queued")
+        pipe.hset(self.enqueued_name, token, f"{sequence}|{time.time()}")
+        pipe.execute()
+
+        return sequence
+
+    def promote_starved(self, max_wait: dict):
+        """Moves the jobs which waited too long on their lane to the back of the first lane, see PROMOTE_SCRIPT.
+        Their position on the queue index moves along with them. Any number of replicas can call this at the same time.
+
+        Args:
+            max_wait (dict): {priority: max number of seconds a job waits on its lane}, lanes which are not in there are never moved.
+
+        Returns:
+            int: number of jobs which were moved
+        """
+        args = [time.time()]
+        for priority in self.priority_lanes[1:]:
+            args.append(max_wait.get(priority, -1))
+
+        return self.promote_script(
+            keys=[self.queue_index_name, self.enqueued_name, self.queue_counter_name]
+            + self.lane_names,
+            args=args,
+        )
+
+    def remove_from_queue_index(self, token):
+        """Removes a token from the queue index, should be called as soon as a worker picks up the task.
+
+        Args:
+            token (str): unique identifier for each task
+        """
+        self.redis.zrem(self.queue_index_name, token)
+
+    def set_as_starting(self, token):
+        """Moves a token out of the queue index and marks it as 'starting'.
+        Should be called as soon as a worker picks up the task.
+
+        Args:
+            token (str): unique identifier for each task
+        """
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.queue_index_name, token)
+        pipe.hset(self.states_name, token, "starting")
+        pipe.execute()
+
+    def requeue(self, token, sequence: int):
+        """Puts a task which a worker picked up but could not run yet (i.e no GPU was free) back where it was:
+        its message goes back to the front of celery's queue, and the token gets its original sequence number on the queue index
+        so that its queue position does not change.
+
+        Celery's own requeue (Reject(requeue = True)) would send it to the back of the queue instead,
+        so the worker should raise Reject(requeue = False) after this to let go of the message.
+
+        Args:
+            token (str): unique identifier for each task
+            sequence (int): sequence number from `add_to_queue_index()`, used only if the task
+                was enqueued without a priority lane (i.e by an older eden replica)
+
+        Returns:
+            bool: True if the message was found on celery's 'unacked' hash and put back on the queue
+        """
+
+        def restore(pipe):
+            delivery_tag = None
+            payload = None
+
+            ## the task might have been moved to the first lane while it was queued
+            entry = pipe.hget(self.enqueued_name, token)
+            score = int(entry.decode().split("|")[0]) if entry is not None else sequence
+            lane = min(score // LANE_SIZE, len(self.lane_names) - 1)
+
+            for tag, message in pipe.hgetall("unacked").items():
+                message_payload = json.loads(message.decode("utf-8"))[0]
+                if message_payload["headers"]["id"] == token:
+                    delivery_tag = tag
+                    payload = message_payload
+
+            pipe.multi()
+
+            if payload is not None:
+                payload["headers"]["redelivered"] = True
+                payload["properties"]["delivery_info"]["redelivered"] = True
+                payload["properties"]["priority"] = lane
+
+                ## workers pop from the right of the list, new tasks are pushed on the left
+                pipe.rpush(self.lane_names[lane], json.dumps(payload))
+                pipe.hdel("unacked", delivery_tag)
+                pipe.zrem("unacked_index", delivery_tag)
+
+            pipe.zadd(self.queue_index_name, {token: score})
+            pipe.hset(self.states_name, token, "queued")
+
+            return payload is not None
+
+        return self.redis.transaction(
+            restore, "unacked", self.enqueued_name, value_from_callable=True
+        )
+
+    def set_state(self, token, state: str):
+        """Sets the state of a token on the task states hash.
+
+        Args:
+            token (str): unique identifier for each task
+            state (str): something like 'starting' or 'running'
+        """
+        self.redis.hset(self.states_name, token, state)
+
+    def remove_state(self, token):
+        """Removes a token from the task states hash, should be called once celery has stored the task meta.
+
+        Args:
+            token (str): unique identifier for each task
+        """
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.states_name, token)
+        pipe.hdel(self.enqueued_name, token)
+        pipe.execute()
+
     def get_queue(self):
         tokens_in_queue = []
 
-        queue_stuff = self.redis.lrange(self.queue_name, 0, -1)
+        for lane_name in self.lane_names:
+            queue_stuff = self.redis.lrange(lane_name, 0, -1)
 
-        if queue_stuff is not None:
+            if queue_stuff is not None:
 
-            for stuff in queue_stuff:
-                stuff = self.decode_response_bytes(stuff)
-                token_standing_in_queue = stuff["headers"]["id"]
-                tokens_in_queue.append(token_standing_in_queue)
+                for stuff in queue_stuff:
+                    stuff = self.decode_response_bytes(stuff)
+                    token_standing_in_queue = stuff["headers"]["id"]
+                    tokens_in_queue.append(token_standing_in_queue)
 
         return tokens_in_queue
 
     def get_queue_length(self):
-        length = self.redis.llen(self.queue_name)
+        pipe = self.redis.pipeline(transaction=False)
+        for lane_name in self.lane_names:
+            pipe.llen(lane_name)
+        length = sum(pipe.execute())
         return length
 
     def check_if_token_in_queue(self, token):
@@ -80,7 +414,7 @@ class QueueData(object):
         result = self.decode_response_bytes(response_bytes=response_bytes)["result"]
         return result
 
-    def check_if_token_in_unacked(self, token):
+    def get_tokens_in_unacked(self):
         tokens_in_unacked = []
 
         unacked_stuff = self.redis.hgetall("unacked")
@@ -96,6 +430,11 @@ class QueueData(object):
 
                 tokens_in_unacked.append(token_standing_in_queue)
 
+        return tokens_in_unacked
+
+    def check_if_token_in_unacked(self, token):
+        tokens_in_unacked = self.get_tokens_in_unacked()
+
         if token in tokens_in_unacked:
             return True
         else:
@@ -112,27 +451,170 @@ class QueueData(object):
         source: https://redis.io/topics/latency
         """
 
-        in_queue = self.check_if_token_in_queue(token=token)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrank(self.queue_index_name, token)
+        pipe.get("celery-task-meta-" + token)
+        pipe.hget(self.states_name, token)
+        pipe.zscore(self.expired_name, token)
+        rank, response_bytes, state, expired_at = pipe.execute()
+
+        if rank is None and response_bytes is None and state is None and expired_at is not None:
+            state = b"expired"
+
+        return self.resolve_status(
+            token=token, rank=rank, response_bytes=response_bytes, state=state
+        )
+
+    def get_status_and_results(self, token, result_storage):
+        """Obtains the status of a task along with its stored results in a single round-trip to redis.
+        The stored results are decoded only once, so they can be used to read the progress too.
+
+        Args:
+            token (str): unique identifier for each task
+            result_storage (eden.result_storage.ResultStorage): should be on the same redis server as the queue
 
-        if in_queue == True:
+        Returns:
+            tuple: (status, results) where results is None if nothing was stored for the token
+        """
+        return self.get_status_and_results_many(
+            tokens=[token], result_storage=result_storage
+        )[0]
+
+    def get_status_many(self, tokens: list, result_storage=None):
+        """Obtains the status of many tasks in a single round-trip to redis.
+
+        Args:
+            tokens (list): list of unique identifiers, one for each task
+            result_storage (eden.result_storage.ResultStorage, optional): if provided, the status of running tasks includes their progress. Defaults to None.
+
+        Returns:
+            list: statuses in the same order as tokens
+        """
+        return [
+            status
+            for status, _ in self.get_status_and_results_many(
+                tokens=tokens, result_storage=result_storage, fields=["status"]
+            )
+        ]
+
+    def get_status_and_results_many(
+        self, tokens: list, result_storage=None, fields=["status", "config", "output"]
+    ):
+        """Obtains the statuses of many tasks along with their stored results in a single round-trip to redis.
+
+        Args:
+            tokens (list): list of unique identifiers, one for each task
+            result_storage (eden.result_storage.ResultStorage, optional): should be on the same redis server as the queue.
+                If set to None, only the statuses are fetched. Defaults to None.
+            fields (list, optional): which parts of the results to read, any of 'config' and 'output'.
+                Outputs are never read for queued tasks. Defaults to ['status', 'config', 'output'].
+
+        Returns:
+            list: (status, results) tuples in the same order as tokens.
+                results is None if neither 'config' nor 'output' were requested, or if nothing was stored for the token.
+                The status of running tasks includes their 'progress' if it was ever updated.
+        """
+        if len(tokens) == 0:
+            return []
+
+        if result_storage is not None:
+            result_db = result_storage.redis_db
+            read_record = "1"
+        else:
+            result_db = self.redis_db
+            read_record = "0"
+
+        read_config = "1" if "config" in fields else "0"
+        read_output = "1" if "output" in fields else "0"
+
+        reply = self.fetch_script(
+            keys=[self.queue_index_name, self.states_name, self.expired_name]
+            + ["celery-task-meta-" + token for token in tokens]
+            + tokens,
+            args=[result_db, self.redis_db, read_record, read_config, read_output]
+            + tokens,
+        )
+
+        """
+        reply has 4 items for each token: rank, meta, state and the stored record
+        """
+        replies = [reply[4 * i : 4 * i + 4] for i in range(len(tokens))]
+
+        """
+        scan 'unacked' at most once, and only for tokens which are nowhere else to be found
+        """
+        if any(r[0] is None and r[1] is None and r[2] is None for r in replies):
+            tokens_in_unacked = self.get_tokens_in_unacked()
+        else:
+            tokens_in_unacked = []
+
+        statuses_and_results = []
+
+        for token, (rank, response_bytes, state, record) in zip(tokens, replies):
+            status = self.resolve_status(
+                token=token,
+                rank=rank,
+                response_bytes=response_bytes,
+                state=state,
+                tokens_in_unacked=tokens_in_unacked,
+            )
+
+            results = None
+
+            if record is not None:
+                if rank is not None:
+                    record_fields = [f for f in fields if f != "output"]
+                else:
+                    record_fields = fields
+
+                results = result_storage.decode_record(
+                    reply=record, fields=record_fields
+                )
+
+            if results is not None:
+                if status["status"] == "running" and isinstance(
+                    results["progress"], float
+                ):
+                    status["progress"] = results["progress"]
+
+                if read_config == "0" and read_output == "0":
+                    results = None
+
+            statuses_and_results.append((status, results))
+
+        return statuses_and_results
+
+    def resolve_status(
+        self, token, rank, response_bytes, state=None, tokens_in_unacked=None
+    ):
+        """Builds the status of a task from its rank on the queue index, celery's task meta and eden's task state.
+
+        Args:
+            token (str): unique identifier for each task
+            rank (int or None): rank of the token on the queue index, None if it's not queued
+            response_bytes (bytes or None): value of celery-task-meta-{token}
+            state (bytes or None): value of the token on the task states hash
+            tokens_in_unacked (list, optional): tokens found in 'unacked', scanned only if needed when set to None
+
+        Returns:
+            dict: {'status': some_status} and 'queue_position' if the task is queued
+        """
+
+        if rank is not None:
             """
-            The job is in queue
+            The job is in queue, and the queue starts at 1, not 0
             """
             status_to_return = {
                 "status": "queued",
+                "queue_position": rank + 1,
             }
 
-            queue_pos = self.get_queue_position(token=token)
-            status_to_return["queue_position"] = queue_pos
-
         else:
             """
             The job is either complete or running or revoked,
             these can be found on the redis keys
             """
 
-            response_bytes = self.get_from_redis(token=token)
-
             if response_bytes is not None:
 
                 status = self.decode_response_bytes(response_bytes=response_bytes)[
@@ -144,8 +626,23 @@ class QueueData(object):
                     "status": status,
                 }
 
-            elif self.check_if_token_in_unacked(token=token):
+            elif state is not None:
+                """
+                celery has not written the task meta yet,
+                generally happens when the job is just about to start
+                """
+
+                status_to_return = {
+                    "status": state.decode("utf-8"),
+                }
+
+            elif (
+                token in tokens_in_unacked
+                if tokens_in_unacked is not None
+                else self.check_if_token_in_unacked(token=token)
+            ):
                 """
+                fallback for tasks which were queued without a state (for example by an older eden replica),
                 check if job is in key 'unacked'
                 'unacked' generally stores the jobs which are just about to start
                 """
@@ -165,12 +662,7 @@ class QueueData(object):
         return self.get_status(token=token)
 
     def get_queue_position(self, token):
-        try:
-            all_tokens = self.get_queue()
-            pos = len(all_tokens) - all_tokens.index(
-                token
-            )  ## reversing the index, and queue starts at 1, not 0
-        except:
-            pos = None
-            raise Exception(f"token: {token} not found in {self.get_queue()}")
-        return pos
+        rank = self.redis.zrank(self.queue_index_name, token)
+        if rank is None:
+            raise Exception(f"token: {token} not found in {self.queue_index_name}")
+        return rank + 1  ## queue starts at 1, not 0
@@ -0,0 +1,183 @@
+import hashlib
+
+from .image_utils import text_to_bytes
+from .msgpack_utils import packb
+
+"""
+Points a cache key to a token, unless it already points to another token which is still valid.
+A token which gets handed out to another request is marked as shared, see FORGET_SCRIPT.
+
+KEYS[1]: cache key
+ARGV: [new token, token which turned out to be stale (or ''), ttl in seconds ('0' for none), prefix of the shared marks]
+
+returns the token the key already points to, or false if it now points to the new token
+"""
+CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[2] then
+    local shared = ARGV[4] .. current
+    redis.call('SET', shared, 1)
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('EXPIRE', shared, ARGV[3])
+    end
+    return current
+end
+redis.call('SET', KEYS[1], ARGV[1])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return false
+"""
+
+"""
+Deletes KEYS[1] only if it still points to ARGV[1], unless the token was shared (KEYS[2] exists).
+Since claims and forgets are atomic, a token is either shared before it's forgotten or never handed out after.
+
+returns 1 if the token is not shared (anymore), 0 if it's shared
+"""
+FORGET_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+"""
+statuses of the tasks whose results can be shared. Failed, revoked and expired tasks are run again
+"""
+REUSABLE_STATUSES = ["queued", "starting", "running", "complete"]
+
+
+def canonicalize(value):
+    """
+    Turns a config into something which packs into the same bytes whenever two configs are the same:
+    dicts are sorted, and the base64 text sent by json clients becomes the same raw bytes that binary clients send
+    """
+    if isinstance(value, dict):
+        if (
+            str(value.get("type", "")).startswith("eden.datatypes.")
+            and isinstance(value.get("data"), str)
+        ):
+            value = dict(value, data=text_to_bytes(value["data"]))
+
+        return [[key, canonicalize(value[key])] for key in sorted(value.keys())]
+
+    elif isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+
+    elif isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+
+    return value
+
+
+def get_config_hash(config: dict, exclude: list = []):
+    """
+    sha256 hex digest of a config, ignoring the keys in `exclude`
+    """
+    config = {key: value for key, value in config.items() if key not in exclude}
+    return hashlib.sha256(packb(canonicalize(config))).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(
+        self,
+        queue_data,
+        result_storage,
+        version: str = None,
+        exclude: list = ["username"],
+        ttl: float = None,
+    ):
+        """Shares the results of identical configs between tasks, so that each of them runs only once.
+
+        A config which is identical to the one of a task that is complete returns its token (a hit),
+        and so does a config identical to the one of a task that is still queued or running (single-flight).
+        Only the first one of many identical requests gets queued.
+
+        Args:
+            queue_data (eden.queue.QueueData): queue of the tasks, the cache keys are stored next to it
+            result_storage (eden.result_storage.ResultStorage): where the results are stored
+            version (str, optional): version of the block, results of a different version are never shared. Defaults to None.
+            exclude (list, optional): keys of the config which are ignored when comparing configs. Defaults to ['username'].
+            ttl (float, optional): number of seconds for which a config is remembered. Defaults to None (forever).
+        """
+        self.queue_data = queue_data
+        self.result_storage = result_storage
+        self.version = version if version is not None else ""
+        self.exclude = exclude
+        self.ttl = ttl
+
+        self.redis = queue_data.redis
+        self.key_prefix = queue_data.queue_name + "-cache:"
+        self.shared_prefix = queue_data.queue_name + "-cache-shared:"
+
+        self.claim_script = self.redis.register_script(CLAIM_SCRIPT)
+        self.forget_script = self.redis.register_script(FORGET_SCRIPT)
+
+    def get_key(self, config: dict):
+        return f"{self.key_prefix}{self.version}:{get_config_hash(config, exclude=self.exclude)}"
+
+    def claim(self, key: str, token: str):
+        """Makes `key` point to `token`, unless it already points to a task whose results can be shared.
+        The task of `token` should already be on the queue index, so that nobody takes it for a stale one.
+
+        Args:
+            key (str): obtained from `get_key()`
+            token (str): token of the new task
+
+        Returns:
+            str or None: token of the task to share the results of, None if `token` has to run
+        """
+        stale_token = ""
+
+        while True:
+            current_token = self.claim_script(
+                keys=[key],
+                args=[
+                    token,
+                    stale_token,
+                    int(self.ttl) if self.ttl is not None else 0,
+                    self.shared_prefix,
+                ],
+            )
+
+            if current_token is None:
+                return None
+
+            current_token = current_token.decode("utf-8")
+            status = self.queue_data.get_status(token=current_token)
+
+            ## results might have been removed on fetch, or expired before the sweeper noticed
+            if status["status"] == "complete":
+                reusable = self.result_storage.redis.exists(current_token) == 1
+            else:
+                reusable = status["status"] in REUSABLE_STATUSES
+
+            if reusable == True:
+                return current_token
+
+            stale_token = current_token
+
+    def forget(self, token: str):
+        """Stops sharing the results of a task, i.e when its config gets updated.
+        Results which were already handed out to other requests can't be taken back, so their config should not change.
+
+        Args:
+            token (str): unique identifier for each task
+
+        Returns:
+            bool: False if the token was already shared with other requests
+        """
+        key = self.result_storage.redis.hget(token, "cache_key")
+
+        if key is None:
+            return True
+
+        not_shared = self.forget_script(
+            keys=[self.result_storage.decode_value(key), self.shared_prefix + token],
+            args=[token],
+        )
+        return not_shared == 1
@@ -1,21 +1,199 @@
+import json
+import time
 import redis
+import msgpack
 from redis import Redis
-from .utils import dict_to_bytes, bytes_to_dict
+from redis.asyncio import Redis as AsyncRedis
+from .utils import bytes_to_dict
+from .msgpack_utils import packb, unpackb
+from .video_utils import frames_header, pack_frame
+
+"""
+Each task's results are stored as a redis hash on the key `token`:
+    config         -> msgpack
+    progress       -> float (or '__none__' if it was never updated)
+    output         -> marks that the outputs were written, even if there are none
+    output:{name}  -> msgpack, one field per output
+    frames:{name}  -> header of the frames streamed one at a time on the output `name` (see eden.video_utils),
+                      they show up as an eden.datatypes.Video output until an output with the same name is written
+    frames-count:{name} -> number of frames streamed on `name`
+    frames-{i}:{name}   -> i-th streamed frame, packed. Each frame gets its own field so that appending one never copies the others
+    blobs:{key}    -> marks that some value of the record references the blob `key` of the blob store (see eden.blob_store)
+any other top level key of a record gets a msgpack field of its own.
+
+Splitting things up like this lets /update, the progress tracker and Block.write_results
+change their own fields without having to read-modify-write (and race on) the whole record.
+"""
+OUTPUT_PREFIX = "output:"
+FRAMES_PREFIX = "frames:"
+FRAMES_COUNT_PREFIX = "frames-count:"
+BLOBS_PREFIX = "blobs:"
+
+"""
+Each blob of the blob store has a redis hash `blob-refs:{key}` which maps the tokens whose records reference it
+to when they last wrote that reference, so that the garbage collector only has to look at the blobs and not at every record.
+A token stays there until its record is deleted, or until the collector finds out that the record is gone (i.e it expired).
+"""
+BLOB_REFS_PREFIX = "blob-refs:"
+
+"""
+msgpack keeps images as raw bytes instead of base64 text.
+msgpack values are prefixed with 0xc1 (which msgpack never uses) to tell them apart from the json values written by older versions of eden
+"""
+MSGPACK_MARKER = b"\xc1"
+
+"""
+When there's a blob store, large bytes/str values (i.e images) are replaced by msgpack extension types
+holding the sha256 digest of their content, which is stored on the blob store instead of redis
+"""
+BLOB_EXT_CODE = 1
+BLOB_TEXT_EXT_CODE = 2
+
+"""
+Lua function which reads a record stored either as a hash or as a json string (written by older versions of eden).
+Shared between the scripts of ResultStorage and the fetch script of eden.queue.QueueData.
+
+returns {'hash', config, progress, {field, value, field, value...}}, {'string', whole_record} or {'none'}
+where the fields are the 'output:{name}' and 'frames:{name}' fields, the value of the latter is the whole packed stream of frames.
+config is only read if read_config == '1' and the outputs only if read_output == '1'
+"""
+READ_RECORD_LUA = """
+local function read_record(key, read_config, read_output)
+    local key_type = redis.call('TYPE', key).ok
+    if key_type == 'string' then
+        return {'string', redis.call('GET', key)}
+    elseif key_type ~= 'hash' then
+        return {'none'}
+    end
+    local config = false
+    if read_config == '1' then
+        config = redis.call('HGET', key, 'config')
+    end
+    local progress = redis.call('HGET', key, 'progress')
+    local outputs = {}
+    if read_output == '1' then
+        for _, field in ipairs(redis.call('HKEYS', key)) do
+            local prefix = string.sub(field, 1, 7)
+            if prefix == 'output:' then
+                table.insert(outputs, field)
+                table.insert(outputs, redis.call('HGET', key, field))
+            elseif prefix == 'frames:' then
+                local name = string.sub(field, 8)
+                local count = tonumber(redis.call('HGET', key, 'frames-count:' .. name)) or 0
+                local parts = {redis.call('HGET', key, field)}
+                for i = 0, count - 1 do
+                    table.insert(parts, redis.call('HGET', key, 'frames-' .. i .. ':' .. name) or '')
+                end
+                table.insert(outputs, field)
+                table.insert(outputs, table.concat(parts))
+            end
+        end
+    end
+    return {'hash', config, progress, outputs}
+end
+"""
+
+READ_RECORD_SCRIPT = (
+    READ_RECORD_LUA
+    + """
+return read_record(KEYS[1], ARGV[1], ARGV[2])
+"""
+)
+
+"""
+Sets some of the fields of a record at once. If ARGV[1] is '1', all of the outputs (including the streamed frames) are removed first
+so that the new ones replace them.
+KEYS[1]: token, ARGV: ['1' or '0', field, value, field, value...]
+"""
+SET_FIELDS_SCRIPT = """
+if ARGV[1] == '1' then
+    for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+        if string.sub(field, 1, 7) == 'output:' or string.sub(field, 1, 6) == 'frames' then
+            redis.call('HDEL', KEYS[1], field)
+        end
+    end
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+"""
+Appends a packed frame (ARGV[3]) to the frames streamed on the output ARGV[1] of KEYS[1] as a field of its own,
+the header ARGV[2] is written along with the first frame
+
+returns the index of the frame
+"""
+APPEND_FRAME_SCRIPT = """
+redis.call('HSETNX', KEYS[1], 'frames:' .. ARGV[1], ARGV[2])
+local index = redis.call('HINCRBY', KEYS[1], 'frames-count:' .. ARGV[1], 1) - 1
+redis.call('HSET', KEYS[1], 'frames-' .. index .. ':' .. ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[1], 'output', '1')
+return index
+"""
+
+"""
+Adds ARGV[1] to the progress of KEYS[1], '__none__' counts as 0
+"""
+INCREMENT_PROGRESS_SCRIPT = """
+local progress = tonumber(redis.call('HGET', KEYS[1], 'progress')) or 0
+progress = progress + tonumber(ARGV[1])
+redis.call('HSET', KEYS[1], 'progress', tostring(progress))
+return tostring(progress)
+"""
+
+"""
+Number of bytes taken by the fields and values of KEYS[1], 0 if there's no such record
+"""
+RECORD_SIZE_SCRIPT = """
+local key_type = redis.call('TYPE', KEYS[1]).ok
+if key_type == 'string' then
+    return redis.call('STRLEN', KEYS[1])
+elseif key_type ~= 'hash' then
+    return 0
+end
+local size = 0
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    size = size + string.len(field) + redis.call('HSTRLEN', KEYS[1], field)
+end
+return size
+"""
 
 
 class ResultStorage(object):
-    def __init__(self, redis_host, redis_port, redis_db=1):
+    def __init__(
+        self,
+        redis_host,
+        redis_port,
+        redis_db=1,
+        blob_store=None,
+        blob_min_size: int = 64 * 1024,
+    ):
         """Wrapper over redis to fetch and store results.
 
         Args:
             redis_host (str): url to redis host, generally something like "localhost"
             redis_port (int): port number
             db (int, optional): DB number to look at within redis. Defaults to 1.
+            blob_store (eden.blob_store.BlobStore, optional): if provided, large values are stored there and redis only keeps their keys.
+                Should not be shared with a ResultStorage on another redis db, since its garbage collector would not see the other's records. Defaults to None.
+            blob_min_size (int, optional): bytes/str values at least this long go to the blob store. Defaults to 64 * 1024.
         """
 
         self.redis = self.redis = Redis(
             host=redis_host, port=str(redis_port), db=redis_db
         )
+        self.redis_db = redis_db
+
+        ## for the async endpoints which wait on updates without holding a thread, connects on first use
+        self.async_redis = AsyncRedis(host=redis_host, port=str(redis_port), db=redis_db)
+
+        self.blob_store = blob_store
+        self.blob_min_size = blob_min_size
+
+        ## updates are published on "eden-updates:{token}"
+        self.updates_channel_prefix = "eden-updates:"
 
         try:
             self.redis.ping()
@@ -27,17 +205,207 @@ class ResultStorage(object):
                 $ sudo service redis-server start'''
             ) from e
 
-    def add(self, token, encoded_results: dict):
-        """Adds in json-like results into the redis storage.
+        self.read_record_script = self.redis.register_script(READ_RECORD_SCRIPT)
+        self.set_fields_script = self.redis.register_script(SET_FIELDS_SCRIPT)
+        self.increment_progress_script = self.redis.register_script(
+            INCREMENT_PROGRESS_SCRIPT
+        )
+        self.append_frame_script = self.redis.register_script(APPEND_FRAME_SCRIPT)
+        self.record_size_script = self.redis.register_script(RECORD_SIZE_SCRIPT)
+
+    def encode_value(self, value, blob_keys: set = None):
+        """Encodes a value to be stored on a field of a record.
+
+        Args:
+            value: anything msgpack can handle
+            blob_keys (set, optional): the keys of the blobs the value references are added here,
+                they should be written on the record as `blobs:{key}` fields so that the garbage collector keeps them. Defaults to None.
+        """
+        if self.blob_store is not None:
+            if blob_keys is None:
+                blob_keys = set()
+            value = self.move_to_blob_store(value, blob_keys=blob_keys)
+        return MSGPACK_MARKER + packb(value)
+
+    def decode_value(self, value_bytes):
+        if value_bytes.startswith(MSGPACK_MARKER):
+            return unpackb(
+                value_bytes[len(MSGPACK_MARKER) :], ext_hook=self.read_from_blob_store
+            )
+        return json.loads(value_bytes.decode("utf-8"))
+
+    def move_to_blob_store(self, value, blob_keys: set):
+        """
+        Replaces the large bytes/str in (possibly nested) dicts and lists by references to the blob store
+        """
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            if len(value) >= self.blob_min_size:
+                key = self.blob_store.put(value)
+                blob_keys.add(key)
+                return msgpack.ExtType(BLOB_EXT_CODE, bytes.fromhex(key))
+
+        elif isinstance(value, str):
+            if len(value) >= self.blob_min_size:
+                key = self.blob_store.put(value.encode("utf-8"))
+                blob_keys.add(key)
+                return msgpack.ExtType(BLOB_TEXT_EXT_CODE, bytes.fromhex(key))
+
+        elif isinstance(value, dict):
+            return {
+                key: self.move_to_blob_store(item, blob_keys=blob_keys)
+                for key, item in value.items()
+            }
+
+        elif isinstance(value, (list, tuple)):
+            return [self.move_to_blob_store(item, blob_keys=blob_keys) for item in value]
+
+        return value
+
+    def read_from_blob_store(self, code, data):
+        """
+        ext_hook for msgpack, resolves the references written by `move_to_blob_store`
+        """
+        if code not in [BLOB_EXT_CODE, BLOB_TEXT_EXT_CODE]:
+            return msgpack.ExtType(code, data)
+
+        if self.blob_store is None:
+            raise Exception(
+                "found a value stored on a blob store, but this ResultStorage has no blob_store"
+            )
+
+        value = self.blob_store.get(data.hex())
+
+        if code == BLOB_TEXT_EXT_CODE:
+            return str(value, "utf-8")
+        return value
+
+    def encode_blob_keys(self, blob_keys: set):
+        return {BLOBS_PREFIX + key: b"1" for key in blob_keys}
+
+    def reference_blobs(self, token, mapping: dict):
+        """
+        Adds `token` to the references of the blobs of the `blobs:{key}` fields of `mapping`.
+        Should be called once they're written on the record, so that the collector never sees a reference which is not there yet
+        """
+        blob_keys = [
+            field[len(BLOBS_PREFIX) :] for field in mapping if field.startswith(BLOBS_PREFIX)
+        ]
+        if len(blob_keys) == 0:
+            return
+
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for key in blob_keys:
+            pipe.hset(BLOB_REFS_PREFIX + key, token, now)
+        pipe.execute()
+
+    def decode_progress(self, progress_bytes):
+        if progress_bytes is None:
+            return "__none__"
+        try:
+            return float(progress_bytes)
+        except ValueError:
+            return progress_bytes.decode("utf-8")
+
+    def encode_fields(self, fields: dict):
+        """
+        Converts {'config': ..., 'output': {...}, 'progress': ...} into hash fields
+        """
+        mapping = {}
+        blob_keys = set()
+
+        for key, value in fields.items():
+            if key == "output":
+                mapping["output"] = b"1"
+                for name, output_value in value.items():
+                    mapping[OUTPUT_PREFIX + name] = self.encode_value(
+                        output_value, blob_keys=blob_keys
+                    )
+            elif key == "progress":
+                mapping["progress"] = str(value)
+            else:
+                mapping[key] = self.encode_value(value, blob_keys=blob_keys)
+
+        mapping.update(self.encode_blob_keys(blob_keys))
+
+        return mapping
+
+    def decode_record(self, reply, fields: list = ["config", "output", "progress"]):
+        """Converts the reply of the `read_record` lua function back into a dict.
+
+        Args:
+            reply (list): reply of `read_record`
+            fields (list, optional): fields which were read. Defaults to ['config', 'output', 'progress'].
+
+        Returns:
+            dict or None: None if there's no such record
+        """
+        kind = reply[0].decode("utf-8")
+
+        if kind == "none":
+            return None
+
+        if kind == "string":
+            ## stored by an older version of eden
+            return bytes_to_dict(reply[1])
+
+        config, progress, outputs = reply[1], reply[2], reply[3]
+
+        record = {"progress": self.decode_progress(progress)}
+
+        if "config" in fields:
+            record["config"] = (
+                self.decode_value(config) if config is not None else None
+            )
+
+        if "output" in fields:
+            record["output"] = self.decode_outputs(
+                [
+                    (outputs[i].decode("utf-8"), outputs[i + 1])
+                    for i in range(0, len(outputs), 2)
+                ]
+            )
+
+        return record
+
+    def decode_outputs(self, fields: list):
+        """
+        Builds the outputs from [(field, value)] where each field is either 'output:{name}' or 'frames:{name}'.
+        Streamed frames look like encoded eden.datatypes.Video outputs, written outputs take precedence over them.
+        """
+        output = {}
+
+        for field, value in fields:
+            if field.startswith(FRAMES_PREFIX):
+                output.setdefault(
+                    field[len(FRAMES_PREFIX) :],
+                    {"data": value, "type": "eden.datatypes.Video"},
+                )
+            elif field.startswith(OUTPUT_PREFIX):
+                output[field[len(OUTPUT_PREFIX) :]] = self.decode_value(value)
+
+        return output
+
+    def add(self, token, encoded_results: dict, ttl: float = None):
+        """Adds in json-like results into the redis storage, replacing anything that was stored for the token before.
 
         Args:
             token (str): unique identifier for each task
             encoded_results (dict): your results encoded using something like: eden.data_handlers.Encoder
+            ttl (float, optional): number of seconds after which redis drops the results. Defaults to None (forever).
 
         Returns:
             None
         """
-        self.redis.set(token, dict_to_bytes(encoded_results))
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(token)
+        mapping = self.encode_fields(encoded_results)
+        if len(mapping) > 0:
+            pipe.hset(token, mapping=mapping)
+            if ttl is not None:
+                pipe.expire(token, int(ttl))
+        pipe.execute()
+        self.reference_blobs(token=token, mapping=mapping)
         return None
 
     def get(self, token):
@@ -50,11 +418,142 @@ class ResultStorage(object):
         Returns:
             dict or None: results from redis
         """
+        key_type = self.redis.type(token).decode("utf-8")
+
+        if key_type == "string":
+            ## stored by an older version of eden
+            return bytes_to_dict(self.redis.get(token))
+
+        elif key_type != "hash":
+            return None
+
+        record = {}
+        output_fields = []
+
+        for field, value in self.redis.hgetall(token).items():
+            field = field.decode("utf-8")
+
+            if field == "progress":
+                record["progress"] = self.decode_progress(value)
+            elif field == "output":
+                record.setdefault("output", {})
+            elif field.startswith(OUTPUT_PREFIX) or field.startswith(FRAMES_PREFIX):
+                output_fields.append((field, value))
+            elif field.startswith(BLOBS_PREFIX):
+                continue
+            else:
+                record[field] = self.decode_value(value)
+
+        if len(output_fields) > 0:
+            record["output"] = self.decode_outputs(output_fields)
+
+        return record
+
+    def get_fields(self, token, fields: list = ["config", "output", "progress"]):
+        """Fetches only some of the fields of a record, in a single round-trip to redis.
+
+        Args:
+            token (str): unique identifier for each task
+            fields (list, optional): any of 'config', 'output' and 'progress'. Defaults to ['config', 'output', 'progress'].
+
+        Returns:
+            dict or None: {field: value} for each field, None if there's no such record
+        """
+        reply = self.read_record_script(
+            keys=[token],
+            args=["1" if "config" in fields else "0", "1" if "output" in fields else "0"],
+        )
+        record = self.decode_record(reply=reply, fields=fields)
+
+        if record is not None:
+            record = {key: value for key, value in record.items() if key in fields}
+
+        return record
+
+    def set_fields(self, token, fields: dict):
+        """Atomically sets some of the fields of a record without touching the rest.
+        If 'output' is one of the fields, all of the previous outputs are replaced.
+
+        Args:
+            token (str): unique identifier for each task
+            fields (dict): something like {'config': new_config}
+        """
+        args = ["1" if "output" in fields else "0"]
+        mapping = self.encode_fields(fields)
+        for field, value in mapping.items():
+            args += [field, value]
+
+        self.set_fields_script(keys=[token], args=args)
+        self.reference_blobs(token=token, mapping=mapping)
+
+    def set_output(self, token, output: dict):
+        """Atomically replaces all of the outputs of a task, the config and the progress are left untouched.
+
+        Args:
+            token (str): unique identifier for each task
+            output (dict): outputs encoded using something like: eden.data_handlers.Encoder
+        """
+        self.set_fields(token=token, fields={"output": output})
+
+    def update_output(self, token, output: dict):
+        """Atomically adds/overwrites some of the outputs of a task, the other outputs are left untouched.
+
+        Args:
+            token (str): unique identifier for each task
+            output (dict): outputs encoded using something like: eden.data_handlers.Encoder
+        """
+        mapping = {"output": b"1"}
+        blob_keys = set()
+        for name, value in output.items():
+            mapping[OUTPUT_PREFIX + name] = self.encode_value(value, blob_keys=blob_keys)
+
+        mapping.update(self.encode_blob_keys(blob_keys))
+        self.redis.hset(token, mapping=mapping)
+        self.reference_blobs(token=token, mapping=mapping)
+
+    def append_frame(self, token, name: str, frame_bytes: bytes, fps: float = 24):
+        """Atomically appends an encoded frame to the frames streamed on the output `name`,
+        without re-sending or re-encoding the frames before it.
+
+        Args:
+            token (str): unique identifier for each task
+            name (str): name of the output
+            frame_bytes (bytes): encoded frame (jpg)
+            fps (float, optional): frames per second, only used when the first frame is appended. Defaults to 24.
+
+        Returns:
+            int: index of the frame
+        """
+        return self.append_frame_script(
+            keys=[token], args=[name, frames_header(fps), pack_frame(frame_bytes)]
+        )
+
+    def get_frames(self, token, name: str, start: int = 0):
+        """Reads the frames streamed on the output `name`, from the `start`-th one on.
 
-        results = self.redis.get(token)
-        if results is not None:
-            results = bytes_to_dict(results)
-        return results
+        Args:
+            token (str): unique identifier for each task
+            name (str): name of the output
+            start (int, optional): index of the first frame to read. Defaults to 0.
+
+        Returns:
+            tuple: (packed stream of the frames from `start` on, number of frames streamed so far), (None, 0) if nothing was streamed on `name`
+        """
+        header, count = self.redis.hmget(
+            token, [FRAMES_PREFIX + name, FRAMES_COUNT_PREFIX + name]
+        )
+        if header is None:
+            return None, 0
+
+        count = int(count or 0)
+        if start >= count:
+            return header, count
+
+        frames = self.redis.hmget(
+            token, [f"frames-{i}:{name}" for i in range(start, count)]
+        )
+        ## the frames might have been replaced by the final outputs meanwhile
+        return header + b"".join(frame for frame in frames if frame is not None), count
 
     def delete(self, token):
         """Deletes a result from redis. Useful when we'll have tons of outputs
@@ -63,4 +562,161 @@ class ResultStorage(object):
         Args:
             token (str):  unique identifier for each task
         """
-        self.redis.delete(token)
+        if self.blob_store is None:
+            self.redis.delete(token)
+            return
+
+        fields = []
+        if self.redis.type(token) == b"hash":
+            fields = [field.decode("utf-8") for field in self.redis.hkeys(token)]
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(token)
+        for field in fields:
+            if field.startswith(BLOBS_PREFIX):
+                pipe.hdel(BLOB_REFS_PREFIX + field[len(BLOBS_PREFIX) :], token)
+        pipe.execute()
+
+    def get_size(self, token):
+        """Number of bytes stored on redis for a task, values on the blob store are not counted.
+
+        Args:
+            token (str): unique identifier for each task
+
+        Returns:
+            int: 0 if there's no such record
+        """
+        return int(self.record_size_script(keys=[token]))
+
+    def is_blob_referenced(self, key):
+        """Checks if any record still references a blob, and drops the references of the records which are gone (i.e they expired).
+
+        Args:
+            key (str): key of the blob
+
+        Returns:
+            bool: True if some record references it
+        """
+        refs_name = BLOB_REFS_PREFIX + key
+
+        def check(pipe):
+            tokens = pipe.hkeys(refs_name)
+
+            ## a write which lands meanwhile updates the references, and the whole check runs again
+            reads = self.redis.pipeline(transaction=False)
+            for token in tokens:
+                reads.hexists(token, BLOBS_PREFIX + key)
+            stale = [token for token, exists in zip(tokens, reads.execute()) if not exists]
+
+            pipe.multi()
+            if len(stale) > 0:
+                pipe.hdel(refs_name, *stale)
+
+            return len(stale) < len(tokens)
+
+        return self.redis.transaction(check, refs_name, value_from_callable=True)
+
+    def collect_blob_garbage(self, min_age: float = 3600):
+        """Deletes the blobs which are not referenced by any record anymore, see BLOB_REFS_PREFIX.
+        A blob which is still referenced by a field that was overwritten is kept until its record is deleted.
+
+        Args:
+            min_age (float, optional): blobs which were written (or re-used) less than `min_age` seconds ago are kept,
+                so that the ones whose references are being written right now are safe. Defaults to 3600.
+
+        Returns:
+            int: number of blobs deleted
+        """
+        if self.blob_store is None:
+            return 0
+
+        now = time.time()
+        num_deleted = 0
+
+        for key, last_modified in list(self.blob_store.list_blobs()):
+            if now - last_modified < min_age or self.is_blob_referenced(key):
+                continue
+
+            ## listing all of the blobs takes a while, put() might have re-used this one since then
+            last_modified = self.blob_store.get_last_modified(key)
+            if last_modified is None or time.time() - last_modified < min_age:
+                continue
+
+            self.blob_store.delete(key)
+            num_deleted += 1
+
+        return num_deleted
+
+    def increment_progress(self, token, amount: float):
+        """Atomically adds `amount` to the progress of a task.
+
+        Args:
+            token (str): unique identifier for each task
+            amount (float): value to add to the progress
+
+        Returns:
+            float: progress after the increment
+        """
+        return float(self.increment_progress_script(keys=[token], args=[amount]))
+
+    def get_progress(self, token):
+        """Fetches the progress of a task.
+
+        Args:
+            token (str): unique identifier for each task
+
+        Returns:
+            float or None: None if the progress was never updated
+        """
+        progress = self.decode_progress(self.redis.hget(token, "progress"))
+        if progress == "__none__":
+            progress = None
+        return progress
+
+    def publish_update(self, token, event: str):
+        """Notifies anyone waiting on a task that something changed.
+        Note that redis pub/sub is not bound to a db, so any eden replica on the same redis server would be notified.
+
+        Args:
+            token (str): unique identifier for each task
+            event (str): what changed, can be 'status', 'progress', 'output' or 'frames:{name}' (a frame was streamed on the output `name`)
+        """
+        self.redis.publish(self.updates_channel_prefix + token, event)
+
+    async def subscribe_to_updates_async(self, token):
+        """Subscribes to the updates published for a task, on asyncio so that waiting does not hold a thread.
+        Make sure you subscribe before checking the status of the task so that no update gets missed.
+
+        Args:
+            token (str): unique identifier for each task
+
+        Returns:
+            redis.asyncio.client.PubSub: should be closed with `await pubsub.close()` when you're done with it
+        """
+        pubsub = self.async_redis.pubsub()
+        await pubsub.subscribe(self.updates_channel_prefix + token)
+        return pubsub
+
+    async def wait_for_update_async(self, pubsub, timeout: float):
+        """Waits until an update is published on a subscription or until the timeout runs out.
+
+        Args:
+            pubsub (redis.asyncio.client.PubSub): obtained from `subscribe_to_updates_async()`
+            timeout (float): max number of seconds to wait
+
+        Returns:
+            str or None: the event that was published, None if nothing was published within the timeout
+        """
+        deadline = time.time() + timeout
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=remaining
+            )
+
+            if message is not None:
+                return message["data"].decode("utf-8")
@@ -0,0 +1,238 @@
+import time
+
+"""
+Evicts the results of a list of tokens from the queue's bookkeeping, atomically so that
+sweepers running on many eden replicas never count the same token twice.
+
+Each evicted token moves from the completed tokens to the expired tokens, and its celery task meta is deleted.
+
+KEYS: [completed tokens, result sizes, total result bytes, expired tokens, celery task meta for each token...]
+ARGV: [current time, tokens...]
+
+returns [number of bytes reclaimed, evicted tokens...]
+"""
+EVICT_SCRIPT = """
+local reply = {0}
+for i = 2, #ARGV do
+    local token = ARGV[i]
+    if redis.call('ZREM', KEYS[1], token) == 1 then
+        local size = tonumber(redis.call('HGET', KEYS[2], token)) or 0
+        redis.call('HDEL', KEYS[2], token)
+        redis.call('DECRBY', KEYS[3], size)
+        redis.call('DEL', KEYS[3 + i])
+        redis.call('ZADD', KEYS[4], ARGV[1], token)
+        reply[1] = reply[1] + size
+        table.insert(reply, token)
+    end
+end
+return reply
+"""
+
+"""
+Stops counting the results of a list of tokens which were deleted some other way (i.e removed on fetch),
+they don't show up as expired and their celery task meta stays.
+
+KEYS: [completed tokens, result sizes, total result bytes]
+ARGV: [tokens...]
+
+returns the number of bytes which are not counted anymore
+"""
+FORGET_SCRIPT = """
+local forgotten = 0
+for i = 1, #ARGV do
+    local token = ARGV[i]
+    if redis.call('ZREM', KEYS[1], token) == 1 then
+        local size = tonumber(redis.call('HGET', KEYS[2], token)) or 0
+        redis.call('HDEL', KEYS[2], token)
+        redis.call('DECRBY', KEYS[3], size)
+        forgotten = forgotten + size
+    end
+end
+return forgotten
+"""
+
+
+class ResultRetention(object):
+    def __init__(
+        self,
+        queue_data,
+        result_storage,
+        result_ttl: float = None,
+        max_bytes: int = None,
+        expired_status_ttl: float = 7 * 24 * 3600,
+        unfinished_ttl: float = 7 * 24 * 3600,
+    ):
+        """Keeps the results of completed tasks from piling up on redis forever.
+
+        Results are evicted once they're older than `result_ttl`, and the oldest completed results are evicted
+        whenever the results take more than `max_bytes`. Tasks which are still queued or running are never evicted.
+        Evicted tokens show up with the status 'expired' on `eden.queue.QueueData` for `expired_status_ttl` seconds.
+        Tasks which never complete (i.e they were lost along with their worker) are never evicted, their results
+        get dropped by redis `unfinished_ttl` seconds after they were created instead.
+
+        Args:
+            queue_data (eden.queue.QueueData): queue of the tasks, the bookkeeping is stored next to it
+            result_storage (eden.result_storage.ResultStorage): where the results are stored
+            result_ttl (float, optional): number of seconds to keep the results of a task once it's done. Defaults to None (forever).
+            max_bytes (int, optional): max number of bytes taken by the results of completed tasks. Defaults to None (no limit).
+            expired_status_ttl (float, optional): number of seconds for which evicted tokens are remembered. Defaults to 7 * 24 * 3600.
+            unfinished_ttl (float, optional): number of seconds to keep the results of a task which is not done yet, see `add()`. Defaults to 7 * 24 * 3600.
+        """
+        self.queue_data = queue_data
+        self.result_storage = result_storage
+        self.result_ttl = result_ttl
+        self.max_bytes = max_bytes
+        self.expired_status_ttl = expired_status_ttl
+        self.unfinished_ttl = unfinished_ttl
+
+        self.redis = queue_data.redis
+
+        """
+        sorted set which maps each completed token to when it was completed, oldest ones get evicted first
+        """
+        self.completed_name = queue_data.queue_name + "-completed"
+
+        """
+        number of bytes taken by the results of each completed token, and in total
+        """
+        self.sizes_name = queue_data.queue_name + "-result-sizes"
+        self.total_bytes_name = queue_data.queue_name + "-result-bytes"
+
+        self.expired_name = queue_data.expired_name
+
+        self.evict_script = self.redis.register_script(EVICT_SCRIPT)
+        self.forget_script = self.redis.register_script(FORGET_SCRIPT)
+
+    def add(self, token, encoded_results: dict):
+        """Stores the initial results of a task when it's queued, they're dropped after `unfinished_ttl` unless it completes before that.
+
+        Args:
+            token (str): unique identifier for each task
+            encoded_results (dict): initial results, see `eden.result_storage.ResultStorage.add()`
+        """
+        self.result_storage.add(
+            token=token, encoded_results=encoded_results, ttl=self.unfinished_ttl
+        )
+
+    def set_as_completed(self, token):
+        """Starts tracking the results of a task, should be called once it's done (whether it succeeded or failed).
+
+        Args:
+            token (str): unique identifier for each task
+        """
+        size = self.result_storage.get_size(token)
+
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.completed_name, {token: time.time()})
+        pipe.hset(self.sizes_name, token, size)
+        pipe.incrby(self.total_bytes_name, size)
+        pipe.execute()
+
+        ## redis drops the results by itself even if no sweeper is running, else they're kept until they're evicted
+        if self.result_ttl is not None:
+            self.result_storage.redis.expire(token, int(self.result_ttl))
+        else:
+            self.result_storage.redis.persist(token)
+
+    def get_total_bytes(self):
+        """
+        Returns:
+            int: number of bytes taken by the results of completed tasks
+        """
+        return int(self.redis.get(self.total_bytes_name) or 0)
+
+    def evict(self, tokens: list):
+        """Deletes the results of some completed tasks, along with their celery task meta.
+
+        Args:
+            tokens (list): tokens to evict, those which are not completed (or already evicted) are skipped
+
+        Returns:
+            tuple: (number of bytes reclaimed, list of evicted tokens)
+        """
+        if len(tokens) == 0:
+            return 0, []
+
+        reply = self.evict_script(
+            keys=[
+                self.completed_name,
+                self.sizes_name,
+                self.total_bytes_name,
+                self.expired_name,
+            ]
+            + ["celery-task-meta-" + token for token in tokens],
+            args=[time.time()] + list(tokens),
+        )
+        reclaimed, evicted = int(reply[0]), [token.decode("utf-8") for token in reply[1:]]
+
+        for token in evicted:
+            self.result_storage.delete(token)
+
+        return reclaimed, evicted
+
+    def forget(self, tokens: list):
+        """Stops counting the results of some completed tasks, should be called whenever they're deleted by anything but `evict()`.
+
+        Args:
+            tokens (list): tokens whose results were deleted, those which are not completed (or already evicted) are skipped
+
+        Returns:
+            int: number of bytes which are not counted anymore
+        """
+        if len(tokens) == 0:
+            return 0
+
+        return int(
+            self.forget_script(
+                keys=[self.completed_name, self.sizes_name, self.total_bytes_name],
+                args=list(tokens),
+            )
+        )
+
+    def sweep(self, batch_size: int = 100):
+        """Evicts the results which are older than the TTL, then the oldest results until they fit in the budget.
+        Also forgets the expired tokens which were evicted more than `expired_status_ttl` seconds ago.
+
+        Args:
+            batch_size (int, optional): max number of tokens evicted at once. Defaults to 100.
+
+        Returns:
+            tuple: (number of bytes reclaimed, number of evicted results)
+        """
+        reclaimed = 0
+        num_evicted = 0
+
+        if self.result_ttl is not None:
+            while True:
+                tokens = self.redis.zrangebyscore(
+                    self.completed_name,
+                    "-inf",
+                    time.time() - self.result_ttl,
+                    start=0,
+                    num=batch_size,
+                )
+                if len(tokens) == 0:
+                    break
+
+                batch_reclaimed, evicted = self.evict(
+                    [token.decode("utf-8") for token in tokens]
+                )
+                reclaimed += batch_reclaimed
+                num_evicted += len(evicted)
+
+        if self.max_bytes is not None:
+            while self.get_total_bytes() > self.max_bytes:
+                ## one at a time so that no more results than needed get evicted
+                tokens = self.redis.zrange(self.completed_name, 0, 0)
+                if len(tokens) == 0:
+                    break
+
+                batch_reclaimed, evicted = self.evict([tokens[0].decode("utf-8")])
+                reclaimed += batch_reclaimed
+                num_evicted += len(evicted)
+
+        self.redis.zremrangebyscore(
+            self.expired_name, "-inf", time.time() - self.expired_status_ttl
+        )
+
+        return reclaimed, num_evicted
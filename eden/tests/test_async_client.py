@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+
+from eden.async_client import AsyncClient
+from eden.datatypes import Image
+
+
+async def run_and_await_many(num_tasks: int):
+
+    filename = "images/cloud.jpg"
+
+    async with AsyncClient(
+        url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+    ) as c:
+
+        configs = [
+            {
+                "prompt": "let there be tests",
+                "number": i,
+                "input_image": Image(
+                    filename
+                ),  ## Image() supports jpg, png filenames, np.array or PIL.Image
+            }
+            for i in range(num_tasks)
+        ]
+
+        run_responses = await asyncio.gather(*[c.run(config) for config in configs])
+        tokens = [resp["token"] for resp in run_responses]
+
+        results = await c.await_many(tokens=tokens)
+
+    return tokens, results
+
+
+class TestAsyncClient(unittest.TestCase):
+    def test_await_many(self):
+
+        tokens, results = asyncio.run(run_and_await_many(num_tasks=2))
+
+        self.assertTrue(sorted(list(results.keys())) == sorted(tokens))
+
+        for i in range(len(tokens)):
+            resp = results[tokens[i]]
+            self.assertTrue(resp["status"]["status"] == "complete")
+            self.assertTrue(resp["output"]["number"] == i)
+
+
+if __name__ == "__main__":
+    unittest.main()
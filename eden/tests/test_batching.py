@@ -0,0 +1,75 @@
+import time
+import threading
+import unittest
+
+from eden.batching import Batcher
+
+
+def submit_from_threads(batcher, values):
+    """
+    submits each value from a thread of its own, returns {value: result or exception}
+    """
+    results = {}
+
+    def submit(value):
+        try:
+            results[value] = batcher.submit(value)
+        except Exception as e:
+            results[value] = e
+
+    threads = [threading.Thread(target=submit, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestBatching(unittest.TestCase):
+    def test_batches(self):
+
+        batch_sizes = []
+
+        def double(values):
+            batch_sizes.append(len(values))
+            time.sleep(0.05)
+            return [value * 2 for value in values]
+
+        batcher = Batcher(fn=double, batch_size=4, max_wait_ms=200)
+        results = submit_from_threads(batcher, list(range(10)))
+
+        self.assertTrue(results == {value: value * 2 for value in range(10)})
+        self.assertTrue(sum(batch_sizes) == 10)
+        self.assertTrue(max(batch_sizes) == 4)
+        self.assertTrue(len(batch_sizes) <= 4)
+
+    def test_failures(self):
+
+        def fail_on_odd_values(values):
+            return [
+                Exception(f"odd value: {value}") if value % 2 == 1 else value
+                for value in values
+            ]
+
+        batcher = Batcher(fn=fail_on_odd_values, batch_size=4, max_wait_ms=100)
+        results = submit_from_threads(batcher, list(range(6)))
+
+        ## only the failed values raise
+        for value, result in results.items():
+            if value % 2 == 1:
+                self.assertTrue(isinstance(result, Exception))
+            else:
+                self.assertTrue(result == value)
+
+        def fail(values):
+            raise Exception("the whole batch failed")
+
+        batcher = Batcher(fn=fail, batch_size=4, max_wait_ms=100)
+        results = submit_from_threads(batcher, list(range(3)))
+
+        self.assertTrue(all(isinstance(result, Exception) for result in results.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
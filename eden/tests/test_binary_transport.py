@@ -0,0 +1,112 @@
+import json
+import unittest
+from unittest import mock
+
+import PIL
+import requests
+
+from eden.client import Client
+from eden.datatypes import Image
+from eden.msgpack_utils import MSGPACK_MEDIA_TYPE, packb, unpackb
+
+
+class TestBinaryTransport(unittest.TestCase):
+    def test_binary_and_json_clients(self):
+
+        filename = "images/cloud.jpg"
+        pil_image = PIL.Image.open(filename)
+
+        binary_client = Client(
+            url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+        )
+        json_client = Client(
+            url="http://127.0.0.1:5656",
+            username="test_abraham",
+            verify_ssl=False,
+            binary=False,
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 2233,
+            "input_image": Image(filename),
+        }
+
+        token = binary_client.run(config)["token"]
+
+        ## the host should not have fallen back to json
+        self.assertTrue(binary_client.binary == True)
+
+        binary_resp = binary_client.await_results(
+            token=token, show_progress=False, use_stream=False
+        )
+        self.assertTrue(binary_resp["status"] == {"status": "complete"})
+
+        ## json clients can read what binary clients sent, and vice versa
+        json_resp = json_client.fetch(token=token)
+
+        for resp in [binary_resp, json_resp]:
+            self.assertTrue(resp["config"]["input_image"].size == pil_image.size)
+            self.assertTrue(resp["output"]["image"].size == pil_image.size)
+
+    def test_json_fallback(self):
+
+        def make_response(status_code, content):
+            resp = requests.Response()
+            resp.status_code = status_code
+            resp._content = json.dumps(content).encode()
+            resp.headers["content-type"] = "application/json"
+            return resp
+
+        ok = make_response(200, {"token": "some token"})
+
+        ## what older hosts say about a msgpack body, the request is sent again as json
+        rejected_bodies = [
+            make_response(415, {"detail": "Unsupported Media Type"}),
+            make_response(422, {"detail": [{"loc": ["body"], "msg": "value is not a valid dict", "type": "type_error.dict"}]}),
+            make_response(422, {"detail": [{"loc": ["body", 0], "msg": "Expecting value", "type": "value_error.jsondecode"}]}),
+        ]
+        for rejected in rejected_bodies:
+            client = Client(url="http://127.0.0.1:5656", username="test_abraham")
+            with mock.patch.object(client, "send", side_effect=[rejected, ok]) as send:
+                self.assertTrue(client.run({"prompt": "let there be tests"}) == {"token": "some token"})
+            self.assertTrue(send.call_count == 2)
+            self.assertTrue(send.call_args.kwargs["binary"] == False)
+            self.assertTrue(client.binary == False)
+
+        ## the body was parsed, sending it again could run /run twice
+        parsed_bodies = [
+            make_response(422, {"detail": [{"loc": ["body", "config", "prompt"], "msg": "field required", "type": "value_error.missing"}]}),
+            make_response(422, {"detail": "rejected by the block"}),
+        ]
+        for parsed in parsed_bodies:
+            client = Client(url="http://127.0.0.1:5656", username="test_abraham")
+            with mock.patch.object(client, "send", side_effect=[parsed, ok]) as send:
+                client.run({"prompt": "let there be tests"})
+            self.assertTrue(send.call_count == 1)
+            self.assertTrue(client.binary == True)
+
+    def test_msgpack_response(self):
+
+        resp = requests.post(
+            "http://127.0.0.1:5656/fetch",
+            data=packb({"token": "totally not a valid token"}),
+            headers={"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": MSGPACK_MEDIA_TYPE},
+        )
+
+        self.assertTrue(resp.headers["content-type"].startswith(MSGPACK_MEDIA_TYPE))
+        self.assertTrue(
+            unpackb(resp.content) == {"status": {"status": "invalid token"}}
+        )
+
+        ## json is still the default
+        resp = requests.post(
+            "http://127.0.0.1:5656/fetch",
+            json={"token": "totally not a valid token"},
+        )
+
+        self.assertTrue(resp.json() == {"status": {"status": "invalid token"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from eden.result_storage import ResultStorage
+from eden.blob_store import LocalBlobStore
+from eden.datatypes import Image
+
+
+def get_result_storage(**kwargs):
+    ## first try connecting to 0.0.0.0 (works for local machines) and if that does not work then connect to 172.17.0.1 (gh actions)
+    try:
+        return ResultStorage(redis_host="0.0.0.0", redis_port=6379, redis_db=0, **kwargs)
+    except Exception:
+        return ResultStorage(
+            redis_host="172.17.0.1", redis_port=6379, redis_db=0, **kwargs
+        )
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_local_blob_store(self):
+
+        blob_store = LocalBlobStore(self.directory)
+
+        key = blob_store.put(b"some bytes")
+        self.assertTrue(blob_store.put(b"some bytes") == key)
+        self.assertTrue(bytes(blob_store.get(key)) == b"some bytes")
+        self.assertTrue(len(list(blob_store.list_blobs())) == 1)
+
+        blob_store.delete(key)
+        self.assertTrue(blob_store.exists(key) == False)
+
+    def test_result_storage_with_blob_store(self):
+
+        blob_store = LocalBlobStore(self.directory)
+        result_storage = get_result_storage(blob_store=blob_store, blob_min_size=1024)
+
+        image = Image("images/cloud.jpg").encode(binary=True)
+        tokens = ["test_blob_token_0", "test_blob_token_1"]
+
+        ## the same image is stored only once, redis only gets its key
+        for i, token in enumerate(tokens):
+            config = {"prompt": f"prompt {i}", "image": image}
+            result_storage.add(token=token, encoded_results={"config": config})
+
+            self.assertTrue(len(result_storage.redis.hget(token, "config")) < 1024)
+            self.assertTrue(result_storage.get(token)["config"] == config)
+            self.assertTrue(result_storage.get_fields(token, ["config"])["config"] == config)
+
+        self.assertTrue(len(list(blob_store.list_blobs())) == 1)
+
+        ## json clients' base64 text goes to the blob store too
+        text_image = Image("images/cloud.jpg").encode()
+        result_storage.set_output(token=tokens[0], output={"image": text_image})
+        self.assertTrue(result_storage.get(tokens[0])["output"] == {"image": text_image})
+        self.assertTrue(len(list(blob_store.list_blobs())) == 2)
+
+        ## blobs which are still referenced are kept
+        result_storage.delete(tokens[0])
+        result_storage.collect_blob_garbage(min_age=0)
+        self.assertTrue(len(list(blob_store.list_blobs())) == 1)
+        self.assertTrue(result_storage.get(tokens[1])["config"]["image"] == image)
+
+        result_storage.delete(tokens[1])
+        self.assertTrue(result_storage.collect_blob_garbage(min_age=0) == 1)
+        self.assertTrue(len(list(blob_store.list_blobs())) == 0)
+
+    def test_blob_garbage_of_expired_records(self):
+
+        blob_store = LocalBlobStore(self.directory)
+        result_storage = get_result_storage(blob_store=blob_store, blob_min_size=1024)
+
+        token = "test_blob_expired_token"
+        result_storage.add(token=token, encoded_results={"config": {"data": b"x" * 2048}})
+        ((key, _),) = blob_store.list_blobs()
+
+        self.assertTrue(result_storage.is_blob_referenced(key))
+        self.assertTrue(result_storage.collect_blob_garbage(min_age=0) == 0)
+
+        ## redis drops the record by itself (i.e after result_ttl), the collector finds out that its reference is gone
+        result_storage.redis.delete(token)
+        self.assertTrue(result_storage.collect_blob_garbage(min_age=0) == 1)
+        self.assertTrue(result_storage.redis.exists("blob-refs:" + key) == 0)
+
+    def test_blob_garbage_reused_while_listing(self):
+
+        blob_store = LocalBlobStore(self.directory)
+        result_storage = get_result_storage(blob_store=blob_store, blob_min_size=1024)
+
+        ## an unreferenced blob written a day ago
+        data = b"x" * 2048
+        key = blob_store.put(data)
+        os.utime(blob_store.get_filename(key), (0, 0))
+
+        ## which a task re-uses right after the collector listed it, before its record references it
+        list_blobs = blob_store.list_blobs
+
+        def list_blobs_then_reuse():
+            blobs = list(list_blobs())
+            blob_store.put(data)
+            return blobs
+
+        with mock.patch.object(blob_store, "list_blobs", list_blobs_then_reuse):
+            self.assertTrue(result_storage.collect_blob_garbage(min_age=60) == 0)
+        self.assertTrue(blob_store.exists(key))
+
+        os.utime(blob_store.get_filename(key), (0, 0))
+        self.assertTrue(result_storage.collect_blob_garbage(min_age=60) == 1)
+        self.assertTrue(blob_store.exists(key) == False)
+
+
+if __name__ == "__main__":
+    unittest.main()
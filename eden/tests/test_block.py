@@ -62,6 +62,41 @@ class TestBlock(unittest.TestCase):
             f"expected {pydantic_model.input_image} to be equal to {my_args['input_image']}",
         )
 
+    def test_block_setup(self):
+
+        eden_block = Block(progress=True, name="some_block_name")
+
+        self.assertTrue(eden_block.run_setup(gpus=["cuda:0"]) == {})
+
+        num_setups = []
+
+        @eden_block.setup
+        def load_model(gpu):
+            num_setups.append(gpu)
+            return {"model": f"model on {gpu}", "slot": len(num_setups)}
+
+        self.assertTrue(eden_block.__setup__ == load_model)
+
+        setup_times = eden_block.run_setup(
+            gpus=["cuda:0", "cuda:1"], num_slots={"cuda:0": 1, "cuda:1": 2}
+        )
+
+        ## each slot of each GPU gets its own state
+        self.assertTrue(list(setup_times.keys()) == ["cuda:0", "cuda:1"])
+        self.assertTrue(num_setups == ["cuda:0", "cuda:1", "cuda:1"])
+
+        ## two tasks running side by side on cuda:1 never share a state
+        first_state = eden_block.acquire_state("cuda:1")
+        second_state = eden_block.acquire_state("cuda:1")
+        self.assertTrue(first_state["model"] == "model on cuda:1")
+        self.assertTrue(first_state is not second_state)
+
+        ## the next task gets a state back once one of them is done
+        eden_block.release_state("cuda:1", second_state)
+        self.assertTrue(eden_block.acquire_state("cuda:1") is second_state)
+
+        self.assertTrue(eden_block.acquire_state("cuda:2") == None)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from unittest import mock
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from eden.client import Client, get_fetch_interval
+
+
+class TestClient(unittest.TestCase):
+    def test_on_request(self):
+
+        latencies = []
+
+        def on_request(endpoint, seconds):
+            latencies.append((endpoint, seconds))
+
+        c = Client(
+            url="http://127.0.0.1:5656",
+            username="test_abraham",
+            verify_ssl=False,
+            on_request=on_request,
+        )
+
+        config = {"prompt": "let there be tests", "number": 2233}
+        token = c.run(config)["token"]
+        resp = c.fetch(token=token)
+
+        self.assertTrue("status" in list(resp.keys()))
+        self.assertTrue([l[0] for l in latencies] == ["/run", "/fetch"])
+        self.assertTrue(all(l[1] >= 0 for l in latencies))
+
+        ## don't leave the job behind for the other tests
+        c.await_results(token=token, show_progress=False)
+
+    def test_retries(self):
+
+        c = Client(url="http://127.0.0.1:5656", username="test_abraham", max_retries=2)
+
+        ## the session never retries on its own, so a request is sent at most max_retries + 1 times
+        self.assertTrue(c.session.get_adapter(c.url).max_retries.total == 0)
+
+        could_not_connect = requests.exceptions.ConnectionError(
+            MaxRetryError(None, "/run", reason=NewConnectionError(None, "refused"))
+        )
+        broke_midway = requests.exceptions.ConnectionError(
+            ProtocolError("Connection aborted.")
+        )
+        ok = requests.Response()
+        ok.status_code = 200
+        ok._content = b'{"token": "some token"}'
+
+        ## nothing reached the host, even /run is safe to send again
+        with mock.patch.object(
+            c.session, "request", side_effect=[could_not_connect, could_not_connect, ok]
+        ) as request:
+            self.assertTrue(c.run({"prompt": "let there be tests"}) == {"token": "some token"})
+        self.assertTrue(request.call_count == 3)
+
+        ## but /run might be running already once it was sent
+        with mock.patch.object(c.session, "request", side_effect=[broke_midway, ok]) as request:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                c.run({"prompt": "let there be tests"})
+        self.assertTrue(request.call_count == 1)
+
+        ## while /fetch is retried
+        with mock.patch.object(c.session, "request", side_effect=[broke_midway] * 3) as request:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                c.fetch(token="some token")
+        self.assertTrue(request.call_count == 3)
+
+    def test_await_results_polling(self):
+
+        c = Client(url="http://127.0.0.1:5656", username="test_abraham")
+
+        running = {"status": {"status": "running"}}
+        revoked = {"status": {"status": "revoked"}}
+
+        ## long-polls /fetch, and stops on any status which won't change anymore
+        with mock.patch.object(c, "fetch", side_effect=[running, running, revoked]) as fetch:
+            resp = c.await_results(
+                token="some token", fetch_interval=0.01, show_progress=False, use_stream=False
+            )
+        self.assertTrue(resp == revoked)
+        self.assertTrue(fetch.call_count == 3)
+        self.assertTrue(all(call.kwargs["wait"] > 0 for call in fetch.call_args_list))
+
+    def test_get_fetch_interval(self):
+
+        ## backs off while nothing changes
+        interval = get_fetch_interval(
+            statuses=[{"status": "running"}],
+            previous_interval=1,
+            something_changed=False,
+            min_interval=1,
+            max_interval=30,
+        )
+        self.assertTrue(interval == 1.5)
+
+        interval = get_fetch_interval(
+            statuses=[{"status": "running"}],
+            previous_interval=25,
+            something_changed=False,
+            min_interval=1,
+            max_interval=30,
+        )
+        self.assertTrue(interval == 30)
+
+        ## goes back to the min interval as soon as something changes
+        interval = get_fetch_interval(
+            statuses=[{"status": "running"}],
+            previous_interval=25,
+            something_changed=True,
+            min_interval=1,
+            max_interval=30,
+        )
+        self.assertTrue(interval == 1)
+
+        ## tasks far back in the queue are checked less often
+        interval = get_fetch_interval(
+            statuses=[
+                {"status": "queued", "queue_position": 8},
+                {"status": "queued", "queue_position": 12},
+            ],
+            previous_interval=1,
+            something_changed=True,
+            min_interval=1,
+            max_interval=30,
+        )
+        self.assertTrue(interval == 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,18 @@
 import time
 import unittest
 from unittest import TestCase
+from unittest import mock
 
 from eden.client import Client
 from eden.datatypes import Image
 
-from eden.datatypes import (
-    Image,
+from eden.datatypes import Image
+from eden.image_utils import LazyImage
+from eden.data_handlers import (
+    Encoder,
+    Decoder,
+    get_shared_thread_pool,
+    run_in_parallel,
 )
 
 # misc imports
@@ -58,6 +64,119 @@ class TestDataTypes(unittest.TestCase):
         ## check if theyre the same
         self.assertTrue(PIL.Image.open(test_filename), PIL.Image.open(filename))
 
+    def test_image_formats(self):
+
+        filename = "images/cloud.jpg"
+        pil_image = PIL.Image.open(filename)
+
+        encoder = Encoder(binary=True, image_options={"policy": "smallest"})
+        decoder = Decoder()
+
+        data = {
+            "default": Image(filename),
+            "jpeg": Image(pil_image, format="jpeg", quality=50),
+            "png": Image(np.array(pil_image), format="png", compress_level=9),
+            "webp": Image(pil_image, format="webp"),
+        }
+        data = decoder.decode(encoder.encode(data))
+
+        ## the block's defaults only apply to the images which don't set their own format
+        ideal_formats = {
+            "default": "WEBP",
+            "jpeg": "JPEG",
+            "png": "PNG",
+            "webp": "WEBP",
+        }
+
+        for key, value in data.items():
+            self.assertTrue(value.format == ideal_formats[key], msg=f"got {value.format} for {key}")
+            self.assertTrue(value.size == pil_image.size)
+
+    def test_lazy_image(self):
+
+        filename = "images/cloud.jpg"
+        pil_image = PIL.Image.open(filename)
+        test_filename = "test_image.jpg"
+
+        encoded = Encoder(binary=True).encode({"image": Image(filename)})
+
+        ## clients get PIL images unless they ask for lazy ones
+        self.assertTrue(isinstance(Decoder().decode(dict(encoded))["image"], PIL.Image.Image))
+
+        lazy_image = Decoder(lazy=True).decode(dict(encoded))["image"]
+
+        self.assertTrue(isinstance(lazy_image, LazyImage))
+
+        ## saving it in the same format and sending it back don't decode anything
+        lazy_image.save(test_filename)
+        self.assertTrue(Image(lazy_image).encode(binary=True)["data"] == lazy_image.as_bytes())
+
+        with open(test_filename, "rb") as f:
+            self.assertTrue(f.read() == lazy_image.as_bytes())
+
+        ## decodes into the same pixels as PIL
+        self.assertTrue(lazy_image.as_numpy().flags["C_CONTIGUOUS"])
+        self.assertTrue(np.array_equal(lazy_image.as_numpy(), np.array(pil_image)))
+        self.assertTrue(lazy_image.size == pil_image.size)
+
+        ## changing an array made from it leaves the image as it was
+        array = np.array(lazy_image)
+        array[...] = 0
+        self.assertTrue(np.array_equal(np.asarray(lazy_image), np.array(pil_image)))
+        self.assertTrue(np.array(lazy_image, dtype=np.float32).dtype == np.float32)
+
+    def test_parallel_codecs(self):
+
+        def make_data():
+            ## images of different sizes between other values, so that they'd finish out of order
+            data = {}
+            for i in range(6):
+                image = np.zeros((64 * (6 - i), 96, 3), dtype=np.uint8)
+                image[:, : 16 * (i + 1)] = (255, 128, 0)
+                data[f"image_{i}"] = Image(image)
+                data[f"number_{i}"] = i
+            return data
+
+        ## a machine with a single CPU has no pool, everything runs serially
+        with mock.patch("eden.data_handlers.os.cpu_count", return_value=1):
+            self.assertTrue(get_shared_thread_pool() is None)
+            self.assertTrue(run_in_parallel(lambda x: x * 2, {"a": 1, "b": 2}) == {"a": 2, "b": 4})
+
+        with mock.patch("eden.data_handlers.os.cpu_count", return_value=4):
+            self.assertTrue(get_shared_thread_pool() is not None)
+
+            ## results come back in the order of the items, not the one they finished in
+            def wait_and_double(x):
+                time.sleep(0.05 * (3 - x))
+                return x * 2
+
+            results = run_in_parallel(wait_and_double, {"a": 0, "b": 1, "c": 2})
+            self.assertTrue(list(results.items()) == [("a", 0), ("b", 2), ("c", 4)])
+
+            serial = Encoder(binary=True).encode(make_data())
+
+            parallel_encoder = Encoder(binary=True, parallel=True, parallel_min_pixels=0)
+            data = make_data()
+            images = {key: value for key, value in data.items() if isinstance(value, Image)}
+            self.assertTrue(parallel_encoder.should_run_in_parallel(images))
+            parallel = parallel_encoder.encode(data)
+
+            self.assertTrue(list(parallel.keys()) == list(serial.keys()))
+            self.assertTrue(parallel == serial)
+
+            serial_images = Decoder().decode(dict(serial))
+            parallel_decoder = Decoder(parallel=True, parallel_min_bytes=0)
+            images = {key: value["data"] for key, value in serial.items() if isinstance(value, dict)}
+            self.assertTrue(parallel_decoder.should_run_in_parallel(images))
+            parallel_images = parallel_decoder.decode(dict(serial))
+
+            self.assertTrue(list(parallel_images.keys()) == list(serial_images.keys()))
+            for key, value in serial_images.items():
+                if key.startswith("image_"):
+                    self.assertTrue(np.array_equal(np.array(parallel_images[key]), np.array(value)))
+                else:
+                    self.assertTrue(parallel_images[key] == value)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from pydantic import ValidationError
+
+from eden.client import Client
+from eden.datatypes import Image
+from eden.models import FetchMany, MAX_FETCH_MANY_TOKENS
+
+
+class TestFetchMany(unittest.TestCase):
+    def test_fetch_many(self):
+
+        filename = "images/cloud.jpg"
+
+        c = Client(
+            url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 2233,
+            "input_image": Image(
+                filename
+            ),  ## Image() supports jpg, png filenames, np.array or PIL.Image
+        }
+
+        tokens = []
+        for i in range(3):
+            tokens.append(c.run(config)["token"])
+
+        tokens.append("totally not a valid token")
+
+        resp = c.fetch_many(tokens=tokens)
+
+        self.assertTrue(sorted(list(resp.keys())) == sorted(tokens))
+
+        for token in tokens[:-1]:
+            self.assertTrue("status" in list(resp[token].keys()))
+            self.assertTrue("config" in list(resp[token].keys()))
+            self.assertTrue(resp[token]["config"]["prompt"] == config["prompt"])
+
+        self.assertTrue(resp[tokens[-1]] == {"status": {"status": "invalid token"}})
+
+        ## dashboards only need the status
+        resp = c.fetch_many(tokens=tokens, fields=["status"])
+
+        for token in tokens:
+            self.assertTrue(list(resp[token].keys()) == ["status"])
+
+
+    def test_batch_size(self):
+
+        ## hosts refuse to read too many tokens at once
+        tokens = [f"token_{i}" for i in range(MAX_FETCH_MANY_TOKENS * 2 + 500)]
+        FetchMany(tokens=tokens[:MAX_FETCH_MANY_TOKENS])
+        with self.assertRaises(ValidationError):
+            FetchMany(tokens=tokens[: MAX_FETCH_MANY_TOKENS + 1])
+
+        ## so clients send them in several requests
+        def post(endpoint, data, idempotent):
+            self.assertTrue(len(data["tokens"]) <= MAX_FETCH_MANY_TOKENS)
+            return {
+                "results": {t: {"status": {"status": "invalid token"}} for t in data["tokens"]}
+            }
+
+        c = Client(url="http://127.0.0.1:5656", username="test_abraham")
+        with mock.patch.object(c, "post", side_effect=post) as send:
+            results = c.fetch_many(tokens=tokens, fields=["status"])
+
+        self.assertTrue(send.call_count == 3)
+        self.assertTrue(list(results.keys()) == tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
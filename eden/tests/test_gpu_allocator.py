@@ -0,0 +1,435 @@
+import sys
+import time
+import types
+import threading
+import unittest
+from unittest import mock
+
+from redis import Redis
+
+from eden.gpu_allocator import (
+    GPUAllocator,
+    NVMLBackend,
+    SimulatedNVML,
+    RedisLeaseStore,
+    TOPOLOGY_NVLINK,
+    TOPOLOGY_SINGLE_SWITCH,
+    TOPOLOGY_HOST_BRIDGE,
+    TOPOLOGY_SYSTEM,
+)
+
+
+def get_redis_lease_store(key):
+    ## first try connecting to 0.0.0.0 (works for local machines) and if that does not work then connect to 172.17.0.1 (gh actions)
+    try:
+        redis = Redis(host="0.0.0.0", port=6379)
+        redis.ping()
+    except Exception:
+        redis = Redis(host="172.17.0.1", port=6379)
+
+    lease_store = RedisLeaseStore(redis=redis, key=key)
+    redis.delete(lease_store.leases_name, lease_store.expiry_name)
+    return lease_store
+
+
+def get_topology():
+    """
+    8 GPUs on 2 CPUs: 0 and 1 share a PCIe switch, so do 2 and 3, and 6 and 7. 4 and 5 are connected with NVLink
+    """
+    groups = [[0, 1], [2, 3], [4, 5], [6, 7]]
+    topology = [[TOPOLOGY_SYSTEM] * 8 for i in range(8)]
+
+    for i in range(8):
+        for j in range(8):
+            if i == j:
+                topology[i][j] = 0
+            elif [g for g in groups if i in g] == [g for g in groups if j in g]:
+                topology[i][j] = TOPOLOGY_NVLINK if i in [4, 5] else TOPOLOGY_SINGLE_SWITCH
+            elif (i < 4) == (j < 4):
+                topology[i][j] = TOPOLOGY_HOST_BRIDGE
+
+    return topology
+
+
+def get_stub_nvidia_smi(num_devices, nvlinks=None):
+    """
+    nvidia_smi as found in nvidia-ml-py3==7.352.0, which knows nothing about the topology.
+    With nvlinks (like [(0, 1)]), it's a newer one which also has the NVLink and topology queries
+    """
+    nvidia_smi = types.ModuleType("nvidia_smi")
+    nvidia_smi.nvmlInit = lambda: None
+    nvidia_smi.nvmlDeviceGetCount = lambda: num_devices
+    nvidia_smi.nvmlDeviceGetHandleByIndex = lambda i: i
+    nvidia_smi.nvmlDeviceGetMemoryInfo = lambda h: types.SimpleNamespace(
+        total=40000 * 2**20, free=40000 * 2**20
+    )
+    nvidia_smi.nvmlDeviceGetPciInfo = lambda h: types.SimpleNamespace(busId=f"bus-{h}")
+
+    if nvlinks is not None:
+        ## each device has one link, to the other end of its pair if it's in one
+        remote = {}
+        for a, b in nvlinks:
+            remote[a] = b
+            remote[b] = a
+
+        nvidia_smi.NVML_NVLINK_MAX_LINKS = 1
+        nvidia_smi.nvmlDeviceGetTopologyCommonAncestor = (
+            lambda a, b: TOPOLOGY_HOST_BRIDGE
+        )
+        nvidia_smi.nvmlDeviceGetNvLinkState = lambda h, link: 1 if h in remote else 0
+        nvidia_smi.nvmlDeviceGetNvLinkRemotePciInfo = (
+            lambda h, link: types.SimpleNamespace(busId=f"bus-{remote[h]}")
+        )
+
+    return nvidia_smi
+
+
+def hammer(gpu_allocators, max_tasks_per_gpu, num_threads=32, num_iterations=50, **requirements):
+    """
+    many threads getting and freeing GPUs as fast as they can,
+    returns the max number of tasks that were ever running on each GPU at the same time
+    """
+    lock = threading.Lock()
+    running = {}
+    max_running = {}
+    errors = []
+
+    def worker(gpu_allocator):
+        for i in range(num_iterations):
+            name = gpu_allocator.get_gpu(**requirements)
+            if name is None:
+                continue
+
+            with lock:
+                running[name] = running.get(name, 0) + 1
+                max_running[name] = max(max_running.get(name, 0), running[name])
+                if running[name] > max_tasks_per_gpu:
+                    errors.append(name)
+
+            time.sleep(0.001)
+
+            with lock:
+                running[name] -= 1
+            gpu_allocator.set_as_free(name, **requirements)
+
+    threads = [
+        threading.Thread(target=worker, args=(gpu_allocators[i % len(gpu_allocators)],))
+        for i in range(num_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return max_running, errors
+
+
+class TestGPUAllocator(unittest.TestCase):
+    def test_whole_gpus(self):
+
+        gpu_allocator = GPUAllocator(
+            exclude_gpu_ids=[1], backend=SimulatedNVML(memory_mb=[16000, 16000, 16000])
+        )
+
+        self.assertTrue(gpu_allocator.gpu_names == ["cuda:0", "cuda:2"])
+        self.assertTrue(gpu_allocator.get_capacity() == 2)
+
+        self.assertTrue(gpu_allocator.get_gpu() == "cuda:0")
+        self.assertTrue(gpu_allocator.get_gpu() == "cuda:2")
+        self.assertTrue(gpu_allocator.get_gpu() == None)
+
+        gpu_allocator.set_as_free("cuda:2")
+        self.assertTrue(gpu_allocator.get_usage() == {"cuda:0": True, "cuda:2": False})
+        self.assertTrue(gpu_allocator.get_gpu() == "cuda:2")
+
+    def test_best_fit(self):
+
+        gpu_allocator = GPUAllocator(backend=SimulatedNVML(memory_mb=[81920, 24000]))
+
+        self.assertTrue(gpu_allocator.get_capacity(memory_mb=20000) == 5)
+
+        ## the small GPU is the best fit, which keeps the big one free for bigger tasks
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=20000) == "cuda:1")
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=40000) == "cuda:0")
+
+        ## 4000 MB left on cuda:1, 41920 MB on cuda:0, then nothing on cuda:1 and 1920 MB on cuda:0
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=4000) == "cuda:1")
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=40000) == "cuda:0")
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=1900) == "cuda:0")
+        self.assertTrue(gpu_allocator.get_gpu(memory_mb=1000) == None)
+
+        ## a whole GPU is only given when nobody is using it
+        self.assertTrue(gpu_allocator.get_gpu() == None)
+
+        gpu_allocator.set_as_free("cuda:1", memory_mb=20000)
+        gpu_allocator.set_as_free("cuda:1", memory_mb=4000)
+        self.assertTrue(gpu_allocator.get_gpu() == "cuda:1")
+
+    def test_fractions_and_live_memory(self):
+
+        backend = SimulatedNVML(memory_mb=[80000, 80000])
+        gpu_allocator = GPUAllocator(backend=backend)
+
+        self.assertTrue(gpu_allocator.get_capacity(fraction=0.1) == 20)
+
+        names = [gpu_allocator.get_gpu(fraction=0.1) for i in range(20)]
+        self.assertTrue(names.count("cuda:0") == 10 and names.count("cuda:1") == 10)
+        self.assertTrue(gpu_allocator.get_gpu(fraction=0.1) == None)
+
+        for name in names:
+            gpu_allocator.set_as_free(name, fraction=0.1)
+
+        ## memory used by other processes is not available
+        backend.set_used_memory(0, 75000)
+        names = [gpu_allocator.get_gpu(fraction=0.25) for i in range(5)]
+        self.assertTrue(names == ["cuda:1"] * 4 + [None])
+
+        ## each attempt reads the memory of each GPU once
+        with mock.patch.object(
+            backend, "get_memory_info", wraps=backend.get_memory_info
+        ) as get_memory_info:
+            gpu_allocator.get_gpu(fraction=0.25)
+        self.assertTrue(get_memory_info.call_count == 2)
+
+    def test_many_threads(self):
+
+        ## NVML queries which take a while leave room for other threads to grab the same GPU
+        gpu_allocator = GPUAllocator(
+            backend=SimulatedNVML(memory_mb=[80000, 80000], latency_ms=0.5)
+        )
+
+        max_running, errors = hammer([gpu_allocator], max_tasks_per_gpu=1)
+        self.assertTrue(errors == [])
+        self.assertTrue(max_running == {"cuda:0": 1, "cuda:1": 1})
+
+        max_running, errors = hammer([gpu_allocator], max_tasks_per_gpu=4, fraction=0.25)
+        self.assertTrue(errors == [])
+
+        ## every lease was released
+        self.assertTrue(gpu_allocator.get_usage() == {"cuda:0": False, "cuda:1": False})
+        self.assertTrue(gpu_allocator.get_capacity(fraction=0.25) == 8)
+
+    def test_shared_between_processes(self):
+
+        lease_store = get_redis_lease_store("test-shared-gpus")
+
+        ## like 3 eden replicas on the same machine
+        gpu_allocators = [
+            GPUAllocator(
+                backend=SimulatedNVML(memory_mb=[80000, 80000], latency_ms=0.5),
+                lease_store=RedisLeaseStore(redis=lease_store.redis, key="test-shared-gpus"),
+            )
+            for i in range(3)
+        ]
+
+        max_running, errors = hammer(gpu_allocators, max_tasks_per_gpu=1, num_iterations=20)
+        self.assertTrue(errors == [])
+
+        max_running, errors = hammer(
+            gpu_allocators, max_tasks_per_gpu=4, num_iterations=20, fraction=0.25
+        )
+        self.assertTrue(errors == [])
+        self.assertTrue(lease_store.get_leases() == {})
+
+        ## a replica's leases are seen by the others
+        names = [gpu_allocators[0].get_gpu(fraction=0.25) for i in range(6)]
+        self.assertTrue(names == ["cuda:0"] * 4 + ["cuda:1"] * 2)
+        self.assertTrue(gpu_allocators[1].get_available_memory("cuda:0") == 0)
+        self.assertTrue(gpu_allocators[1].get_gpu(fraction=0.5) == "cuda:1")
+        self.assertTrue(gpu_allocators[2].get_gpu(fraction=0.25) == None)
+
+    def test_crashed_worker(self):
+
+        lease_store = get_redis_lease_store("test-crashed-worker")
+        backend = SimulatedNVML(memory_mb=[16000])
+
+        crashed = GPUAllocator(backend=backend, lease_store=lease_store, lease_ttl=1)
+        alive = GPUAllocator(backend=backend, lease_store=lease_store, lease_ttl=1)
+        alive.start_heartbeat(interval=0.2)
+
+        self.assertTrue(crashed.get_gpu(memory_mb=8000) == "cuda:0")
+        self.assertTrue(alive.get_gpu(memory_mb=8000) == "cuda:0")
+        self.assertTrue(alive.get_gpu(memory_mb=8000) == None)
+
+        ## the lease of the worker which stopped renewing it expires, the other one is kept alive by the heartbeat
+        time.sleep(1.5)
+        self.assertTrue(alive.get_available_memory("cuda:0") == 8000)
+        self.assertTrue(alive.get_gpu(memory_mb=8000) == "cuda:0")
+        self.assertTrue(alive.get_gpu(memory_mb=8000) == None)
+
+    def test_lost_lease(self):
+
+        lease_store = get_redis_lease_store("test-lost-lease")
+        backend = SimulatedNVML(memory_mb=[16000])
+
+        late = GPUAllocator(backend=backend, lease_store=lease_store, lease_ttl=0.5)
+        other = GPUAllocator(backend=backend, lease_store=lease_store, lease_ttl=30)
+
+        lease = late.acquire(memory_mb=8000)
+
+        ## the heartbeat was late, so the lease expired and the other replica got rid of it
+        time.sleep(0.7)
+        self.assertTrue(other.get_gpu(memory_mb=8000) == "cuda:0")
+        self.assertTrue(lease.id not in lease_store.get_leases())
+
+        ## its task is still running, so it's taken again and nothing else gets its memory
+        with self.assertLogs(level="WARNING"):
+            self.assertTrue(late.renew_leases() == [lease.id])
+        self.assertTrue(lease_store.get_leases()[lease.id] == [("cuda:0", 8000.0)])
+        self.assertTrue(other.get_gpu(memory_mb=8000) == None)
+        self.assertTrue(late.renew_leases() == [])
+
+        ## a released lease is never taken again
+        late.release(lease)
+        self.assertTrue(late.renew_leases() == [])
+        self.assertTrue(lease.id not in lease_store.get_leases())
+
+        ## even if it's released while the renewal is on its way to redis
+        lease = late.acquire(memory_mb=8000)
+        renew = lease_store.renew
+
+        def release_then_renew(leases, ttl):
+            late.release(lease)
+            return renew(leases=leases, ttl=ttl)
+
+        with mock.patch.object(lease_store, "renew", release_then_renew):
+            self.assertTrue(late.renew_leases() == [])
+        self.assertTrue(lease.id not in lease_store.get_leases())
+
+    def test_contention(self):
+
+        ## 2 GPUs shared by 8 workers, like celery threads which picked up tasks before any GPU got free
+        gpu_allocator = GPUAllocator(backend=SimulatedNVML(memory_mb=[16000, 16000]))
+        jobs = list(range(40))
+        done = []
+        timed_out = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if len(jobs) == 0:
+                        return
+                    job = jobs.pop(0)
+
+                ## tasks that time out go back to the queue, see test_queue.TestQueue.test_requeue_under_contention
+                lease = gpu_allocator.acquire(timeout=5)
+                if lease is None:
+                    with lock:
+                        timed_out.append(job)
+                    continue
+
+                time.sleep(0.02)
+                gpu_allocator.release(lease)
+                with lock:
+                    done.append(job)
+
+        start = time.time()
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        ## every job waited for its turn, and the GPUs were kept busy: 20 rounds of 20ms on each GPU
+        self.assertTrue(timed_out == [])
+        self.assertTrue(sorted(done) == list(range(40)))
+        self.assertTrue(elapsed < 0.02 * 20 * 2)
+
+        ## waiting gives up after the timeout
+        leases = [gpu_allocator.acquire(), gpu_allocator.acquire()]
+        start = time.time()
+        self.assertTrue(gpu_allocator.acquire(timeout=0.2) == None)
+        self.assertTrue(time.time() - start >= 0.2)
+
+        ## and wakes up as soon as a GPU is released
+        threading.Timer(0.1, gpu_allocator.release, args=(leases[0],)).start()
+        start = time.time()
+        self.assertTrue(gpu_allocator.get_gpu(timeout=5) == leases[0].gpu)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def check_multi_gpu_placement(self, lease_store=None):
+
+        gpu_allocator = GPUAllocator(
+            backend=SimulatedNVML(memory_mb=[40000] * 8, topology=get_topology()),
+            lease_store=lease_store,
+        )
+        self.assertTrue(gpu_allocator.get_capacity(num_gpus=2) == 4)
+        self.assertTrue(gpu_allocator.get_capacity(num_gpus=3) == 2)
+
+        ## the fastest links first, then the first of the groups which are as good as each other
+        leases = [gpu_allocator.acquire(num_gpus=2) for i in range(4)]
+        self.assertTrue(
+            [lease.gpus for lease in leases]
+            == [
+                ["cuda:4", "cuda:5"],
+                ["cuda:0", "cuda:1"],
+                ["cuda:2", "cuda:3"],
+                ["cuda:6", "cuda:7"],
+            ]
+        )
+        self.assertTrue(leases[0].gpu == "cuda:4")
+        self.assertTrue(gpu_allocator.acquire(num_gpus=2) == None)
+
+        ## all or nothing: with 2 GPUs free, a task which needs 4 takes none of them
+        gpu_allocator.release(leases[1])
+        self.assertTrue(gpu_allocator.acquire(num_gpus=4) == None)
+        self.assertTrue(gpu_allocator.get_usage()["cuda:0"] == False)
+
+        ## 4 GPUs behind the same host bridge beat 4 GPUs spread over both CPUs
+        gpu_allocator.release(leases[0])
+        gpu_allocator.release(leases[2])
+        lease = gpu_allocator.acquire(num_gpus=4)
+        self.assertTrue(lease.gpus == ["cuda:0", "cuda:1", "cuda:2", "cuda:3"])
+
+        ## shares of several GPUs
+        gpu_allocator.release(lease)
+        gpu_allocator.release(leases[3])
+        self.assertTrue(gpu_allocator.get_capacity(fraction=0.5, num_gpus=2) == 8)
+        leases = [gpu_allocator.acquire(fraction=0.5, num_gpus=2) for i in range(8)]
+        self.assertTrue(leases[0].gpus == ["cuda:4", "cuda:5"])
+        self.assertTrue(leases[0].reservations == [("cuda:4", 20000), ("cuda:5", 20000)])
+        self.assertTrue(None not in leases)
+        self.assertTrue(gpu_allocator.acquire(fraction=0.5, num_gpus=2) == None)
+
+        for lease in leases:
+            gpu_allocator.release(lease)
+
+    def test_multi_gpu_placement(self):
+        self.check_multi_gpu_placement()
+
+        ## the lua version of the placement on redis does the same
+        self.check_multi_gpu_placement(
+            lease_store=get_redis_lease_store("test-multi-gpu-placement")
+        )
+
+    def test_nvml_topology(self):
+
+        ## without any topology queries all of the GPUs are equally far apart, and it still starts
+        with mock.patch.dict(sys.modules, {"nvidia_smi": get_stub_nvidia_smi(3)}):
+            gpu_allocator = GPUAllocator(backend=NVMLBackend())
+
+        self.assertTrue(
+            gpu_allocator.distances
+            == [
+                [0, TOPOLOGY_SYSTEM, TOPOLOGY_SYSTEM],
+                [TOPOLOGY_SYSTEM, 0, TOPOLOGY_SYSTEM],
+                [TOPOLOGY_SYSTEM, TOPOLOGY_SYSTEM, 0],
+            ]
+        )
+        self.assertTrue(gpu_allocator.acquire(num_gpus=2).gpus == ["cuda:0", "cuda:1"])
+
+        ## with NVLink between 1 and 2, they're picked together
+        with mock.patch.dict(
+            sys.modules, {"nvidia_smi": get_stub_nvidia_smi(3, nvlinks=[(1, 2)])}
+        ):
+            gpu_allocator = GPUAllocator(backend=NVMLBackend())
+
+        self.assertTrue(gpu_allocator.distances[1][2] == TOPOLOGY_NVLINK)
+        self.assertTrue(gpu_allocator.distances[0][1] == TOPOLOGY_HOST_BRIDGE)
+        self.assertTrue(gpu_allocator.acquire(num_gpus=2).gpus == ["cuda:1", "cuda:2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,15 @@
 import time
+import json
 import unittest
 from redis import Redis
 import redis
 from unittest import TestCase
 
+import threading
+
 from eden.queue import QueueData
+from eden.celery_utils import ConsumerGate
+from eden.gpu_allocator import GPUAllocator, SimulatedNVML, RedisLeaseStore
 from eden.client import Client
 from eden.result_storage import ResultStorage
 
@@ -80,6 +85,372 @@ class TestQueue(unittest.TestCase):
             self.assertTrue(type(resp) == dict)
             self.assertTrue("status" in list(resp.keys()))
 
+    def test_queue_index(self):
+
+        try:
+            queue_data = QueueData(
+                redis_host="0.0.0.0",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_queue_index",
+            )
+        except redis.exceptions.ConnectionError:
+            queue_data = QueueData(
+                redis_host="172.17.0.1",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_queue_index",
+            )
+
+        queue_data.redis.delete(queue_data.queue_index_name, queue_data.states_name)
+
+        tokens = ["first_token", "second_token", "third_token"]
+        for t in tokens:
+            queue_data.add_to_queue_index(token=t)
+
+        for i in range(len(tokens)):
+            resp = queue_data.get_status(token=tokens[i])
+            self.assertTrue(resp == {"status": "queued", "queue_position": i + 1})
+
+        ## a worker picks up the first task, everyone else moves up
+        queue_data.set_as_starting(token=tokens[0])
+        self.assertTrue(queue_data.get_status(token=tokens[0]) == {"status": "starting"})
+        self.assertTrue(queue_data.get_queue_position(token=tokens[1]) == 1)
+        self.assertTrue(queue_data.get_queue_position(token=tokens[2]) == 2)
+
+        queue_data.remove_state(token=tokens[0])
+        self.assertTrue(
+            queue_data.get_status(token=tokens[0]) == {"status": "invalid token"}
+        )
+
+        queue_data.redis.delete(queue_data.queue_index_name, queue_data.states_name)
+
+    def test_requeue(self):
+
+        try:
+            queue_data = QueueData(
+                redis_host="0.0.0.0",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_requeue",
+            )
+        except redis.exceptions.ConnectionError:
+            queue_data = QueueData(
+                redis_host="172.17.0.1",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_requeue",
+            )
+
+        queue_data.redis.delete(
+            queue_data.queue_name, queue_data.queue_index_name, queue_data.states_name
+        )
+
+        tokens = ["first_token", "second_token", "third_token"]
+        sequences = [queue_data.add_to_queue_index(token=t) for t in tokens]
+
+        ## messages as celery leaves them on redis: queued ones on the list, the picked up one on the 'unacked' hash
+        def message(token):
+            return {
+                "body": "",
+                "headers": {"id": token, "root_id": token},
+                "properties": {"delivery_tag": "tag-" + token, "delivery_info": {}},
+            }
+
+        for t in tokens[1:]:
+            queue_data.redis.lpush(queue_data.queue_name, json.dumps(message(t)))
+        queue_data.redis.hset(
+            "unacked",
+            "tag-" + tokens[0],
+            json.dumps([message(tokens[0]), "", queue_data.queue_name]),
+        )
+        queue_data.set_as_starting(token=tokens[0])
+
+        ## no GPU got free, so the first task goes back to the front of the queue
+        self.assertTrue(queue_data.requeue(token=tokens[0], sequence=sequences[0]))
+        self.assertTrue(queue_data.redis.hget("unacked", "tag-" + tokens[0]) is None)
+        self.assertTrue(queue_data.get_queue()[-1] == tokens[0])
+
+        for i in range(len(tokens)):
+            resp = queue_data.get_status(token=tokens[i])
+            self.assertTrue(resp == {"status": "queued", "queue_position": i + 1})
+
+        queue_data.redis.delete(
+            queue_data.queue_name, queue_data.queue_index_name, queue_data.states_name
+        )
+
+    def test_requeue_under_contention(self):
+
+        try:
+            queue_data = QueueData(
+                redis_host="0.0.0.0",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_requeue_contention",
+            )
+        except redis.exceptions.ConnectionError:
+            queue_data = QueueData(
+                redis_host="172.17.0.1",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_requeue_contention",
+            )
+
+        queue_data.redis.delete(
+            queue_data.queue_name, queue_data.queue_index_name, queue_data.states_name
+        )
+
+        ## this replica and another one share a single GPU, which the other one holds for a while
+        lease_store = RedisLeaseStore(
+            redis=queue_data.redis, key="eden_test_requeue_contention"
+        )
+        gpu_allocator, other_replica = [
+            GPUAllocator(backend=SimulatedNVML(memory_mb=[16000]), lease_store=lease_store)
+            for i in range(2)
+        ]
+        other_lease = other_replica.acquire()
+
+        ## stands in for celery's consumer, the workers take messages only while it consumes the queue
+        class Consumer(object):
+            consuming = True
+
+            def call_soon(self, fn, *args):
+                fn(*args)
+
+            def cancel_task_queue(self, queue):
+                self.consuming = False
+
+            def add_task_queue(self, queue):
+                self.consuming = True
+
+        consumer = Consumer()
+        consumer_gate = ConsumerGate(queue_name=queue_data.queue_name)
+        consumer_gate.on_worker_ready(sender=consumer)
+
+        tokens = [f"contention_token_{i}" for i in range(6)]
+        sequences = {t: queue_data.add_to_queue_index(token=t) for t in tokens}
+        for t in tokens:
+            queue_data.redis.lpush(
+                queue_data.queue_name,
+                json.dumps(
+                    {
+                        "body": "",
+                        "headers": {"id": t, "root_id": t},
+                        "properties": {"delivery_tag": "tag-" + t, "delivery_info": {}},
+                    }
+                ),
+            )
+
+        done = []
+        requeued = []
+        lock = threading.Lock()
+
+        ## what the run task does with the messages celery hands over to its threads
+        def worker():
+            while len(done) < len(tokens):
+                payload = queue_data.redis.rpop(queue_data.queue_name) if consumer.consuming else None
+                if payload is None:
+                    time.sleep(0.01)
+                    continue
+
+                message = json.loads(payload)
+                token = message["headers"]["id"]
+                queue_data.redis.hset(
+                    "unacked", "tag-" + token, json.dumps([message, "", queue_data.queue_name])
+                )
+                queue_data.set_as_starting(token=token)
+
+                lease = gpu_allocator.acquire(timeout=0.05)
+                if lease is None:
+                    with lock:
+                        requeued.append(token)
+                    self.assertTrue(queue_data.requeue(token=token, sequence=sequences[token]))
+                    consumer_gate.pause_until(
+                        lambda: gpu_allocator.wait_until_free(timeout=0.05)
+                    )
+                    continue
+
+                time.sleep(0.02)
+                gpu_allocator.release(lease)
+                queue_data.redis.hdel("unacked", "tag-" + token)
+                queue_data.remove_from_queue_index(token=token)
+                queue_data.remove_state(token=token)
+                with lock:
+                    done.append(token)
+
+        threading.Timer(1, other_replica.release, args=(other_lease,)).start()
+
+        threads = [threading.Thread(target=worker, daemon=True) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        ## every task ran once the GPU got free
+        self.assertTrue(sorted(done) == sorted(tokens))
+        self.assertTrue(queue_data.redis.llen(queue_data.queue_name) == 0)
+        self.assertTrue(
+            all(queue_data.redis.hget("unacked", "tag-" + t) is None for t in tokens)
+        )
+
+        ## the workers stopped taking tasks off the queue instead of requeueing them every 50ms for a second
+        self.assertTrue(1 <= len(requeued) <= 4)
+
+        queue_data.redis.delete(
+            queue_data.queue_name,
+            queue_data.queue_index_name,
+            queue_data.states_name,
+            lease_store.leases_name,
+            lease_store.expiry_name,
+        )
+
+    def test_priority_lanes(self):
+
+        try:
+            queue_data = QueueData(
+                redis_host="0.0.0.0",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_priority_lanes",
+                priority_lanes=["high", "normal", "low"],
+                default_priority="normal",
+            )
+        except redis.exceptions.ConnectionError:
+            queue_data = QueueData(
+                redis_host="172.17.0.1",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_priority_lanes",
+                priority_lanes=["high", "normal", "low"],
+                default_priority="normal",
+            )
+
+        queue_data.redis.delete(
+            queue_data.queue_index_name,
+            queue_data.states_name,
+            queue_data.enqueued_name,
+            *queue_data.lane_names,
+        )
+
+        with self.assertRaises(ValueError):
+            queue_data.get_lane("urgent")
+
+        ## messages as celery's redis transport leaves them on the list of each lane
+        def enqueue(token, priority=None):
+            queue_data.add_to_queue_index(token=token, priority=priority)
+            message = {
+                "body": "",
+                "headers": {"id": token, "root_id": token},
+                "properties": {"priority": queue_data.get_lane(priority)},
+            }
+            queue_data.redis.lpush(
+                queue_data.lane_names[queue_data.get_lane(priority)], json.dumps(message)
+            )
+
+        enqueue("low_token", priority="low")
+        enqueue("normal_token")
+        enqueue("high_token", priority="high")
+        enqueue("second_high_token", priority="high")
+
+        ## the effective position across the lanes, not the order in which they came in
+        positions = {
+            "high_token": 1,
+            "second_high_token": 2,
+            "normal_token": 3,
+            "low_token": 4,
+        }
+        for token, position in positions.items():
+            self.assertTrue(
+                queue_data.get_status(token=token)
+                == {"status": "queued", "queue_position": position}
+            )
+        self.assertTrue(queue_data.get_queue_length() == 4)
+
+        ## nothing waited long enough yet
+        self.assertTrue(queue_data.promote_starved(max_wait={"low": 60}) == 0)
+
+        ## the low priority job waited too long, it goes behind the high priority ones
+        self.assertTrue(queue_data.promote_starved(max_wait={"low": 0}) == 1)
+        self.assertTrue(queue_data.redis.llen(queue_data.lane_names[2]) == 0)
+        self.assertTrue(queue_data.redis.llen(queue_data.lane_names[0]) == 3)
+        self.assertTrue(queue_data.get_queue_position(token="low_token") == 3)
+        self.assertTrue(queue_data.get_queue_position(token="normal_token") == 4)
+
+        ## the message itself says it's on the first lane now, in case the transport has to restore it
+        promoted = json.loads(queue_data.redis.lindex(queue_data.lane_names[0], 0))
+        self.assertTrue(promoted["headers"]["id"] == "low_token")
+        self.assertTrue(promoted["properties"]["priority"] == 0)
+
+        ## a job sent by an older replica can't tell how long it waited, it does not hold up the ones behind it
+        old_message = {"body": "", "headers": {"id": "old_token", "root_id": "old_token"}}
+        queue_data.redis.lpush(queue_data.lane_names[2], json.dumps(old_message))
+        enqueue("second_low_token", priority="low")
+
+        self.assertTrue(queue_data.promote_starved(max_wait={"low": 0}) == 2)
+        self.assertTrue(queue_data.redis.llen(queue_data.lane_names[2]) == 0)
+        self.assertTrue(queue_data.get_queue_position(token="second_low_token") == 4)
+        self.assertTrue(queue_data.get_queue_position(token="normal_token") == 5)
+        self.assertTrue(queue_data.redis.zscore(queue_data.queue_index_name, "old_token") is None)
+
+        queue_data.redis.delete(
+            queue_data.queue_index_name,
+            queue_data.states_name,
+            queue_data.enqueued_name,
+            *queue_data.lane_names,
+        )
+
+    def test_get_status_and_results(self):
+
+        try:
+            queue_data = QueueData(
+                redis_host="0.0.0.0",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_status_and_results",
+            )
+            result_storage = ResultStorage(
+                redis_host="0.0.0.0", redis_port=6379, redis_db=1
+            )
+        except redis.exceptions.ConnectionError:
+            queue_data = QueueData(
+                redis_host="172.17.0.1",
+                redis_port=6379,
+                redis_db=0,
+                queue_name="eden_test_status_and_results",
+            )
+            result_storage = ResultStorage(
+                redis_host="172.17.0.1", redis_port=6379, redis_db=1
+            )
+
+        token = "status_and_results_token"
+        results = {"config": {"prompt": "hello"}, "output": {}, "progress": "__none__"}
+
+        queue_data.add_to_queue_index(token=token)
+        result_storage.add(token=token, encoded_results=results)
+
+        status, results_we_got = queue_data.get_status_and_results(
+            token=token, result_storage=result_storage
+        )
+        self.assertTrue(status == {"status": "queued", "queue_position": 1})
+
+        ## outputs are never read for queued tasks
+        self.assertTrue(
+            results_we_got == {"config": results["config"], "progress": "__none__"}
+        )
+
+        ## the script should leave the connection on the queue's db
+        self.assertTrue(queue_data.redis.zrank(queue_data.queue_index_name, token) == 0)
+
+        status, results_we_got = queue_data.get_status_and_results(
+            token="totally not a valid token", result_storage=result_storage
+        )
+        self.assertTrue(status == {"status": "invalid token"})
+        self.assertTrue(results_we_got is None)
+
+        queue_data.remove_from_queue_index(token=token)
+        queue_data.remove_state(token=token)
+        result_storage.delete(token=token)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,122 @@
+import json
+import unittest
+
+from eden.queue import QueueData
+from eden.result_storage import ResultStorage
+from eden.result_cache import ResultCache
+from eden.datatypes import Image
+
+
+def get_queue_data_and_result_storage(queue_name):
+    ## first try connecting to 0.0.0.0 (works for local machines) and if that does not work then connect to 172.17.0.1 (gh actions)
+    try:
+        redis_host = "0.0.0.0"
+        result_storage = ResultStorage(redis_host=redis_host, redis_port=6379, redis_db=0)
+    except Exception:
+        redis_host = "172.17.0.1"
+        result_storage = ResultStorage(redis_host=redis_host, redis_port=6379, redis_db=0)
+
+    queue_data = QueueData(
+        redis_host=redis_host, redis_port=6379, redis_db=0, queue_name=queue_name
+    )
+    return queue_data, result_storage
+
+
+class TestResultCache(unittest.TestCase):
+    def test_config_keys(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_result_cache_keys"
+        )
+        result_cache = ResultCache(
+            queue_data=queue_data, result_storage=result_storage, version="1.0"
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 12345,
+            "input_image": Image("images/cloud.jpg").encode(binary=True),
+            "username": "someone",
+        }
+
+        ## the same config from a json client, with keys in another order and another username
+        same_config = {
+            "username": "someone else",
+            "input_image": Image("images/cloud.jpg").encode(),
+            "number": 12345,
+            "prompt": "let there be tests",
+        }
+
+        self.assertTrue(result_cache.get_key(config) == result_cache.get_key(same_config))
+        self.assertTrue(
+            result_cache.get_key(config)
+            != result_cache.get_key(dict(config, number=54321))
+        )
+
+        other_version = ResultCache(
+            queue_data=queue_data, result_storage=result_storage, version="2.0"
+        )
+        self.assertTrue(result_cache.get_key(config) != other_version.get_key(config))
+
+    def test_single_flight(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_result_cache"
+        )
+        result_cache = ResultCache(queue_data=queue_data, result_storage=result_storage)
+
+        key = result_cache.get_key({"prompt": "test_single_flight"})
+        tokens = [f"test_result_cache_token_{i}" for i in range(4)]
+
+        queue_data.add_to_queue_index(token=tokens[0])
+        self.assertTrue(result_cache.claim(key=key, token=tokens[0]) is None)
+
+        ## identical requests attach to the first one while it's queued
+        queue_data.add_to_queue_index(token=tokens[1])
+        self.assertTrue(result_cache.claim(key=key, token=tokens[1]) == tokens[0])
+
+        ## and once it's complete
+        queue_data.remove_from_queue_index(token=tokens[0])
+        queue_data.remove_state(token=tokens[0])
+        queue_data.redis.set(
+            "celery-task-meta-" + tokens[0],
+            json.dumps({"status": "SUCCESS", "result": None}),
+        )
+        result_storage.add(token=tokens[0], encoded_results={"output": {}})
+        self.assertTrue(result_cache.claim(key=key, token=tokens[2]) == tokens[0])
+
+        ## results which are gone can't be shared
+        result_storage.delete(token=tokens[0])
+        queue_data.add_to_queue_index(token=tokens[3])
+        self.assertTrue(result_cache.claim(key=key, token=tokens[3]) is None)
+        self.assertTrue(result_cache.claim(key=key, token=tokens[2]) == tokens[3])
+
+        ## the results of tokens[3] were handed out to tokens[2], so its config can't change anymore
+        result_storage.add(
+            token=tokens[3], encoded_results={"config": {}, "cache_key": key}
+        )
+        self.assertTrue(result_cache.forget(token=tokens[3]) == False)
+        self.assertTrue(queue_data.redis.get(key) == tokens[3].encode())
+
+        ## a config which was never shared can be updated, and is not shared anymore
+        other_key = result_cache.get_key({"prompt": "test_single_flight_update"})
+        queue_data.add_to_queue_index(token=tokens[1])
+        self.assertTrue(result_cache.claim(key=other_key, token=tokens[1]) is None)
+        result_storage.add(
+            token=tokens[1], encoded_results={"config": {}, "cache_key": other_key}
+        )
+        self.assertTrue(result_cache.forget(token=tokens[1]) == True)
+        self.assertTrue(queue_data.redis.get(other_key) is None)
+        queue_data.add_to_queue_index(token=tokens[2])
+        self.assertTrue(result_cache.claim(key=other_key, token=tokens[2]) is None)
+
+        for token in tokens:
+            queue_data.remove_from_queue_index(token=token)
+            queue_data.remove_state(token=token)
+            queue_data.redis.delete("celery-task-meta-" + token)
+            queue_data.redis.delete(result_cache.shared_prefix + token)
+            result_storage.delete(token=token)
+
+
+if __name__ == "__main__":
+    unittest.main()
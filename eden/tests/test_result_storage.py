@@ -4,6 +4,7 @@ from redis import Redis
 import redis
 
 from eden.result_storage import ResultStorage
+from eden.progress_tracker import ProgressTracker, fetch_progress_from_token
 from eden.datatypes import (
     Image,
 )
@@ -38,6 +39,112 @@ class TestBlock(unittest.TestCase):
 
         self.assertTrue(output == my_args)
 
+    def test_fields(self):
+
+        try:
+            result_storage = ResultStorage(
+                redis_host="0.0.0.0", redis_port=6379, redis_db=0
+            )
+        except redis.exceptions.ConnectionError:
+            result_storage = ResultStorage(
+                redis_host="172.17.0.1", redis_port=6379, redis_db=0
+            )
+
+        token = "fields_token"
+        config = {"prompt": "let there be light", "number": 12345}
+
+        result_storage.add(
+            token=token,
+            encoded_results={"config": config, "output": {}, "progress": "__none__"},
+        )
+        self.assertTrue(
+            result_storage.get(token=token)
+            == {"config": config, "output": {}, "progress": "__none__"}
+        )
+
+        ## outputs, config and progress can all be written without touching each other
+        result_storage.set_output(token=token, output={"a": 1, "b": "two"})
+        result_storage.set_fields(token=token, fields={"config": {"prompt": "updated"}})
+        result_storage.increment_progress(token=token, amount=0.5)
+
+        self.assertTrue(
+            result_storage.get(token=token)
+            == {
+                "config": {"prompt": "updated"},
+                "output": {"a": 1, "b": "two"},
+                "progress": 0.5,
+            }
+        )
+
+        ## replacing the outputs drops the old ones, updating them does not
+        result_storage.set_output(token=token, output={"c": 3})
+        result_storage.update_output(token=token, output={"d": 4})
+        self.assertTrue(
+            result_storage.get_fields(token=token, fields=["output"])
+            == {"output": {"c": 3, "d": 4}}
+        )
+        self.assertTrue(
+            result_storage.get_fields(token=token, fields=["config", "progress"])
+            == {"config": {"prompt": "updated"}, "progress": 0.5}
+        )
+
+        ## the outputs and the other fields are replaced together
+        result_storage.set_fields(
+            token=token, fields={"config": {"prompt": "final"}, "output": {"e": 5}}
+        )
+        self.assertTrue(
+            result_storage.get_fields(token=token, fields=["config", "output"])
+            == {"config": {"prompt": "final"}, "output": {"e": 5}}
+        )
+
+        result_storage.delete(token=token)
+        self.assertTrue(result_storage.get(token=token) is None)
+        self.assertTrue(result_storage.get_fields(token=token) is None)
+
+    def test_progress_tracker(self):
+
+        try:
+            result_storage = ResultStorage(
+                redis_host="0.0.0.0", redis_port=6379, redis_db=0
+            )
+        except redis.exceptions.ConnectionError:
+            result_storage = ResultStorage(
+                redis_host="172.17.0.1", redis_port=6379, redis_db=0
+            )
+
+        token = "progress_token"
+        result_storage.delete(token=token)
+        result_storage.add(
+            token=token,
+            encoded_results={"config": {}, "output": {}, "progress": "__none__"},
+        )
+
+        progress_tracker = ProgressTracker(
+            token=token, result_storage=result_storage, min_update_interval=60
+        )
+
+        ## the first update gets written right away, the rest are held back
+        for i in range(100):
+            progress_tracker.update(1 / 100)
+
+        self.assertTrue(result_storage.get_progress(token=token) == 0.01)
+
+        progress_tracker.flush()
+        self.assertTrue(
+            abs(fetch_progress_from_token(result_storage=result_storage, token=token) - 1.0)
+            < 1e-6
+        )
+
+        ## updating the progress leaves the rest of the results untouched
+        self.assertTrue(result_storage.get(token=token)["config"] == {})
+        self.assertTrue(result_storage.get(token=token)["output"] == {})
+
+        result_storage.delete(token=token)
+        self.assertTrue(result_storage.get_progress(token=token) is None)
+        self.assertTrue(
+            fetch_progress_from_token(result_storage=result_storage, token=token) == 0.0
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
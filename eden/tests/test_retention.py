@@ -0,0 +1,153 @@
+import json
+import time
+import unittest
+
+from eden.queue import QueueData
+from eden.result_storage import ResultStorage
+from eden.retention import ResultRetention
+
+
+def get_queue_data_and_result_storage(queue_name):
+    ## first try connecting to 0.0.0.0 (works for local machines) and if that does not work then connect to 172.17.0.1 (gh actions)
+    try:
+        redis_host = "0.0.0.0"
+        result_storage = ResultStorage(redis_host=redis_host, redis_port=6379, redis_db=0)
+    except Exception:
+        redis_host = "172.17.0.1"
+        result_storage = ResultStorage(redis_host=redis_host, redis_port=6379, redis_db=0)
+
+    queue_data = QueueData(
+        redis_host=redis_host, redis_port=6379, redis_db=0, queue_name=queue_name
+    )
+    return queue_data, result_storage
+
+
+def add_completed_task(queue_data, result_storage, result_retention, token):
+    """
+    what a worker leaves behind once a task is done: the results and celery's task meta
+    """
+    result_storage.add(
+        token=token,
+        encoded_results={"config": {"prompt": token}, "output": {"text": "x" * 1000}},
+    )
+    queue_data.redis.set(
+        "celery-task-meta-" + token, json.dumps({"status": "SUCCESS", "result": None})
+    )
+    result_retention.set_as_completed(token=token)
+
+
+class TestRetention(unittest.TestCase):
+    def test_max_bytes(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_retention_max_bytes"
+        )
+        result_retention = ResultRetention(
+            queue_data=queue_data, result_storage=result_storage, max_bytes=1500
+        )
+
+        tokens = [f"test_retention_token_{i}" for i in range(3)]
+        for token in tokens:
+            add_completed_task(queue_data, result_storage, result_retention, token)
+
+        reclaimed, num_evicted = result_retention.sweep()
+
+        ## only the newest one fits in the budget
+        self.assertTrue(num_evicted == 2)
+        self.assertTrue(reclaimed > 2000)
+        self.assertTrue(result_retention.get_total_bytes() <= 1500)
+
+        for token in tokens[:2]:
+            self.assertTrue(queue_data.get_status(token) == {"status": "expired"})
+            status, results = queue_data.get_status_and_results(
+                token=token, result_storage=result_storage
+            )
+            self.assertTrue(status == {"status": "expired"})
+            self.assertTrue(results is None)
+            self.assertTrue(queue_data.redis.get("celery-task-meta-" + token) is None)
+
+        self.assertTrue(queue_data.get_status(tokens[2]) == {"status": "complete"})
+        self.assertTrue(result_storage.get(tokens[2]) is not None)
+
+        result_retention.evict(tokens[2:])
+        queue_data.redis.delete(queue_data.expired_name)
+
+    def test_result_ttl(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_retention_ttl"
+        )
+        result_retention = ResultRetention(
+            queue_data=queue_data, result_storage=result_storage, result_ttl=1
+        )
+
+        token = "test_retention_ttl_token"
+        add_completed_task(queue_data, result_storage, result_retention, token)
+
+        self.assertTrue(result_retention.sweep() == (0, 0))
+        time.sleep(1.5)
+
+        ## redis expires the results by itself, the sweeper remembers the token as expired
+        self.assertTrue(result_storage.get(token) is None)
+        reclaimed, num_evicted = result_retention.sweep()
+        self.assertTrue(num_evicted == 1)
+        self.assertTrue(queue_data.get_status(token) == {"status": "expired"})
+
+        queue_data.redis.delete(queue_data.expired_name)
+
+    def test_forget(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_retention_forget"
+        )
+        result_retention = ResultRetention(
+            queue_data=queue_data, result_storage=result_storage, max_bytes=1500
+        )
+
+        tokens = [f"test_retention_forget_token_{i}" for i in range(2)]
+        for token in tokens:
+            add_completed_task(queue_data, result_storage, result_retention, token)
+
+        ## the first results are removed on fetch, the others fit in the budget now
+        total_bytes = result_retention.get_total_bytes()
+        result_storage.delete(tokens[0])
+        forgotten = result_retention.forget([tokens[0]])
+        self.assertTrue(forgotten > 1000)
+        self.assertTrue(result_retention.get_total_bytes() == total_bytes - forgotten)
+        self.assertTrue(result_retention.forget([tokens[0]]) == 0)
+
+        self.assertTrue(result_retention.sweep() == (0, 0))
+        self.assertTrue(result_storage.get(tokens[1]) is not None)
+
+        ## removed results are not expired, celery still knows the task is complete
+        self.assertTrue(queue_data.get_status(tokens[0]) == {"status": "complete"})
+
+        result_retention.evict(tokens[1:])
+        queue_data.redis.delete(
+            queue_data.expired_name, "celery-task-meta-" + tokens[0]
+        )
+
+    def test_unfinished_ttl(self):
+
+        queue_data, result_storage = get_queue_data_and_result_storage(
+            "test_retention_unfinished"
+        )
+        result_retention = ResultRetention(
+            queue_data=queue_data, result_storage=result_storage, unfinished_ttl=60
+        )
+
+        ## the results of a task which never completes are dropped by redis
+        token = "test_retention_unfinished_token"
+        result_retention.add(token=token, encoded_results={"config": {"prompt": token}})
+        self.assertTrue(0 < result_storage.redis.ttl(token) <= 60)
+
+        ## once it completes they're kept until they're evicted
+        result_retention.set_as_completed(token=token)
+        self.assertTrue(result_storage.redis.ttl(token) == -1)
+
+        result_retention.evict([token])
+        queue_data.redis.delete(queue_data.expired_name)
+
+
+if __name__ == "__main__":
+    unittest.main()
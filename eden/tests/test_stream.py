@@ -0,0 +1,71 @@
+import time
+import unittest
+
+from eden.client import Client
+from eden.datatypes import Image
+
+
+class TestStream(unittest.TestCase):
+    def test_stream(self):
+
+        filename = "images/cloud.jpg"
+
+        c = Client(
+            url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 2233,
+            "input_image": Image(
+                filename
+            ),  ## Image() supports jpg, png filenames, np.array or PIL.Image
+        }
+
+        token = c.run(config)["token"]
+
+        statuses = []
+        for resp in c.stream(token=token):
+            self.assertTrue("status" in list(resp.keys()))
+            statuses.append(resp["status"]["status"])
+
+        ## the stream ends once the task is done
+        self.assertTrue(statuses[-1] == "complete", msg=f"got {statuses}")
+        self.assertTrue(resp["output"]["number"] == config["number"])
+
+    def test_long_poll(self):
+
+        filename = "images/cloud.jpg"
+
+        c = Client(
+            url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 2233,
+            "input_image": Image(
+                filename
+            ),  ## Image() supports jpg, png filenames, np.array or PIL.Image
+        }
+
+        token = c.run(config)["token"]
+
+        ## returns as soon as something changes instead of waiting for all of it
+        start = time.time()
+        resp = c.fetch(token=token, wait=30)
+        self.assertTrue("status" in list(resp.keys()))
+        self.assertTrue(time.time() - start < 30)
+
+        resp = c.await_results(token=token, show_progress=False)
+        self.assertTrue(resp["status"]["status"] == "complete")
+
+        ## finished tasks don't wait at all
+        start = time.time()
+        resp = c.fetch(token=token, wait=30)
+        self.assertTrue(resp["status"]["status"] == "complete")
+        self.assertTrue(time.time() - start < 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,8 @@ from unittest import TestCase
 
 from eden.client import Client
 from eden.datatypes import Image
+from eden.retention import ResultRetention
+from eden.tests.test_retention import get_queue_data_and_result_storage
 
 from eden.datatypes import (
     Image,
@@ -67,6 +69,39 @@ class TestUpdateConfig(unittest.TestCase):
         print(resp)
         self.assertTrue(resp["config"], ideal_config)
 
+    def test_update_expired_config(self):
+
+        c = Client(
+            url="http://127.0.0.1:5656", username="test_abraham", verify_ssl=False
+        )
+
+        config = {
+            "prompt": "let there be tests",
+            "number": 2233,
+            "input_image": Image("images/cloud.jpg"),
+        }
+
+        token = c.run(config)["token"]
+
+        while c.fetch(token=token)["status"]["status"] != "complete":
+            time.sleep(0.5)
+
+        ## evicts the results the way the sweeper of a host with a result_ttl would
+        queue_data, result_storage = get_queue_data_and_result_storage("eden_block")
+        result_retention = ResultRetention(
+            queue_data=queue_data, result_storage=result_storage
+        )
+        result_retention.set_as_completed(token=token)
+        result_retention.evict([token])
+
+        resp = c.update_config(token=token, config=config)
+        self.assertTrue(
+            resp["status"]
+            == {"status": "could not update config because job expired"}
+        )
+
+        queue_data.redis.zrem(queue_data.expired_name, token)
+
 
 if __name__ == "__main__":
     sleep_and_count(5)
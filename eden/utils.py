@@ -1,6 +1,8 @@
 import os
 import time
 import json
+import logging
+import threading
 import secrets, string
 
 
@@ -26,3 +28,24 @@ def bytes_to_dict(dict_in_bytes):
 def stop_everything_gracefully(t):
     time.sleep(t)
     os._exit(0)
+
+
+def run_periodically(fn, interval: float):
+    """Calls `fn()` every `interval` seconds on a daemon thread.
+    Exceptions are logged instead of stopping the thread.
+
+    Returns:
+        threading.Thread: the thread, which is already started
+    """
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                fn()
+            except Exception as e:
+                logging.error(f"{fn.__name__} failed: {e}")
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
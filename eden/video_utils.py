@@ -0,0 +1,284 @@
+import os
+import cv2
+import struct
+import tempfile
+import numpy as np
+
+from .image_utils import encode_to_bytes, text_to_bytes, LazyImage
+
+"""
+containers supported by eden.datatypes.Video, as (fourcc, file extension)
+"""
+VIDEO_FORMATS = {
+    "mp4": ("mp4v", ".mp4"),
+    "webm": ("VP80", ".webm"),
+}
+
+"""
+Packed stream of jpg frames, which can be appended to one frame at a time without re-encoding the previous ones.
+Used for frames that are streamed as intermediate results:
+
+    FRAMES_MAGIC | fps (big endian float32) | [frame length (big endian uint32) | jpg bytes] * number of frames
+"""
+FRAMES_MAGIC = b"EDNF"
+FRAMES_JPEG_QUALITY = 90
+
+
+def frames_header(fps: float):
+    return FRAMES_MAGIC + struct.pack(">f", fps)
+
+
+def pack_frame(frame_bytes: bytes):
+    return struct.pack(">I", len(frame_bytes)) + frame_bytes
+
+
+def pack_frames(frames_bytes: list, fps: float):
+    return frames_header(fps) + b"".join(
+        pack_frame(frame_bytes) for frame_bytes in frames_bytes
+    )
+
+
+def unpack_frames(data: bytes):
+    """
+    Returns:
+        tuple: (fps, [jpg bytes of each frame])
+    """
+    fps = struct.unpack(">f", data[len(FRAMES_MAGIC) : len(FRAMES_MAGIC) + 4])[0]
+
+    frames_bytes = []
+    offset = len(FRAMES_MAGIC) + 4
+
+    while offset < len(data):
+        length = struct.unpack(">I", data[offset : offset + 4])[0]
+        frames_bytes.append(data[offset + 4 : offset + 4 + length])
+        offset += 4 + length
+
+    return fps, frames_bytes
+
+
+def get_video_format(video_bytes):
+    """
+    Reads the format of encoded video bytes from their first few bytes
+
+    Returns:
+        str or None: 'frames', 'mp4' or 'webm', None if it's something else
+    """
+    if video_bytes[: len(FRAMES_MAGIC)] == FRAMES_MAGIC:
+        return "frames"
+    elif video_bytes[4:8] == b"ftyp":
+        return "mp4"
+    elif video_bytes[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    return None
+
+
+def frame_to_numpy(frame):
+    """
+    RGB(A) uint8 array from a numpy array, PIL image or LazyImage
+    """
+    if isinstance(frame, LazyImage):
+        return frame.as_numpy()
+    return np.asarray(frame)
+
+
+def _encode_with_video_writer(frames, fps, format):
+    """
+    cv2.VideoWriter can only write to files, so the video goes through a temporary file
+    """
+    fourcc, extension = VIDEO_FORMATS[format]
+
+    first_frame = frame_to_numpy(frames[0])
+    height, width = first_frame.shape[:2]
+
+    fd, filename = tempfile.mkstemp(suffix=extension)
+    os.close(fd)
+
+    try:
+        writer = cv2.VideoWriter(
+            filename, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height)
+        )
+
+        if not writer.isOpened():
+            raise Exception(f"cv2 could not open a video writer for format: {format}")
+
+        for frame in frames:
+            frame = frame_to_numpy(frame)
+
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            elif frame.shape[-1] == 4:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+            else:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+            writer.write(frame)
+
+        writer.release()
+
+        with open(filename, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(filename)
+
+
+def encode_video_to_bytes(frames, fps=24, format="mp4", quality=None):
+    """
+    Encodes a sequence of frames into a single video
+
+    Args:
+        frames (list or numpy.array or str): list of RGB frames (numpy arrays, PIL images or LazyImages),
+            an array of shape (num_frames, height, width, channels), or the filename of a video, which is sent as it is
+        fps (float, optional): frames per second. Defaults to 24.
+        format (str, optional): 'mp4', 'webm' or 'frames' (packed jpgs which can be streamed frame by frame). Defaults to 'mp4'.
+        quality (int, optional): jpg quality (0-100) of each frame, only for format = 'frames'. Defaults to None.
+    """
+    if type(frames) == str:
+        with open(frames, "rb") as f:
+            return f.read()
+
+    if format == "frames":
+        return pack_frames(
+            [
+                encode_to_bytes(
+                    frame,
+                    format="jpeg",
+                    quality=quality if quality is not None else FRAMES_JPEG_QUALITY,
+                )
+                for frame in frames
+            ],
+            fps=fps,
+        )
+
+    if format not in VIDEO_FORMATS:
+        raise Exception(
+            f"expected format to be one of {list(VIDEO_FORMATS.keys()) + ['frames']}, not: {format}"
+        )
+
+    if len(frames) == 0:
+        raise Exception("expected at least one frame to encode a video")
+
+    return _encode_with_video_writer(frames, fps=fps, format=format)
+
+
+def _decode_with_video_capture(video_bytes, extension):
+    fd, filename = tempfile.mkstemp(suffix=extension)
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(video_bytes)
+
+        capture = cv2.VideoCapture(filename)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = []
+
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+        capture.release()
+        return fps, frames
+    finally:
+        os.remove(filename)
+
+
+def decode_video(video_bytes):
+    """
+    Returns:
+        tuple: (fps, [RGB numpy array for each frame])
+    """
+    format = get_video_format(video_bytes)
+
+    if format == "frames":
+        fps, frames_bytes = unpack_frames(video_bytes)
+        return fps, [LazyImage(frame_bytes).as_numpy() for frame_bytes in frames_bytes]
+
+    extension = VIDEO_FORMATS[format][1] if format in VIDEO_FORMATS else ".mp4"
+    return _decode_with_video_capture(video_bytes, extension=extension)
+
+
+class LazyVideo(object):
+    """
+    Video received from an eden client/host, which is decoded only when (and if) it's used.
+
+    * `as_bytes()`: the encoded video, nothing is decoded
+    * `as_frames()`: list of RGB numpy arrays, decoded once and cached
+    * `save(filename)`: writes the encoded video as it is
+
+    It can also be used like a list of frames: `len(video)`, `video[0]`, `for frame in video`.
+
+    Args:
+        data (bytes or str): encoded video, either raw bytes or base64 text
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._video_bytes = None
+        self._fps = None
+        self._frames = None
+
+    def as_bytes(self):
+        if self._video_bytes is None:
+            if isinstance(self._data, str):
+                self._video_bytes = text_to_bytes(self._data)
+            else:
+                self._video_bytes = bytes(self._data)
+            self._data = None
+        return self._video_bytes
+
+    def as_frames(self):
+        if self._frames is None:
+            self._fps, self._frames = decode_video(self.as_bytes())
+        return self._frames
+
+    @property
+    def format(self):
+        return get_video_format(self.as_bytes())
+
+    @property
+    def fps(self):
+        if self._fps is None:
+            if self.format == "frames":
+                self._fps = unpack_frames(self.as_bytes()[: len(FRAMES_MAGIC) + 4])[0]
+            else:
+                self.as_frames()
+        return self._fps
+
+    def save(self, filename):
+        """
+        Writes the encoded video into a file, mp4s and webms are written as they are.
+        Streamed frames can't be played as they are, so they're encoded into an mp4 (or webm) depending on the extension
+        """
+        format = self.format
+
+        if format == "frames":
+            extension = os.path.splitext(filename)[-1].lower()
+            target_format = "webm" if extension == ".webm" else "mp4"
+            video_bytes = encode_video_to_bytes(
+                self.as_frames(), fps=self.fps, format=target_format
+            )
+        else:
+            video_bytes = self.as_bytes()
+
+        with open(filename, "wb") as f:
+            f.write(video_bytes)
+
+    def __len__(self):
+        if self.format == "frames":
+            return len(unpack_frames(self.as_bytes())[1])
+        return len(self.as_frames())
+
+    def __getitem__(self, idx):
+        return self.as_frames()[idx]
+
+    def __iter__(self):
+        return iter(self.as_frames())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyVideo):
+            return self.as_bytes() == other.as_bytes()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"<eden LazyVideo format={self.format} bytes={len(self.as_bytes())}>"